@@ -0,0 +1,346 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Huoty, All rights reserved
+# Author: Huoty <sudohuoty@163.com>
+
+"""使用本地模拟的 JQData HTTP 服务测试接口性能
+
+模拟服务接收与 JQDataApi._request 相同的 POST JSON 请求（method、token、code 等），
+按接口返回指定行数的合成 CSV 数据，并可以模拟网络延迟与 gzip 压缩。
+测试每个接口的每秒调用数、p50/p99 延迟以及每秒传输的数据量，用法：
+
+    python benchmarks.py                          # 使用默认参数运行所有测试
+    python benchmarks.py --rows 50000 --latency 0.02 get_ticks
+    python benchmarks.py --save baseline.json     # 保存结果作为基准
+    python benchmarks.py --compare baseline.json  # 与基准对比，性能下降时退出码为 1
+"""
+
+from __future__ import print_function
+
+import sys
+import gzip
+import json
+import time
+import argparse
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jqdatahttp
+from jqdatahttp import JQDataApi
+
+
+_BAR_COLUMNS = ["date", "open", "close", "high", "low", "volume", "money"]
+_TICK_COLUMNS = list(jqdatahttp._tick_data_dtypes)
+
+
+def _make_bars(rows):
+    lines = [",".join(_BAR_COLUMNS)]
+    for idx in range(rows):
+        minute = idx % 240
+        price = 10 + (idx % 100) * 0.01
+        lines.append(
+            "2021-03-{:02d} {:02d}:{:02d}:00,{:.2f},{:.2f},{:.2f},{:.2f},"
+            "{},{:.1f}".format(
+                idx // 240 % 28 + 1, 9 + minute // 60, minute % 60,
+                price, price + 0.01, price + 0.02, price - 0.01,
+                1000 + idx, (1000 + idx) * price,
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+def _make_ticks(rows, codes=None):
+    columns = _TICK_COLUMNS if codes is None else ["code"] + _TICK_COLUMNS
+    lines = [",".join(columns)]
+    for idx in range(rows):
+        price = 10 + (idx % 100) * 0.01
+        values = ["2021-03-04 {:02d}:{:02d}:{:02d}".format(
+            9 + idx // 3600 % 6, idx // 60 % 60, idx % 60
+        )]
+        values.extend("{:.2f}".format(price) for _ in range(3))
+        values.extend([str(100 * idx), "{:.1f}".format(100 * idx * price), "0"])
+        values.extend(str(100 + level) for level in range(5))
+        values.extend("{:.2f}".format(price + level * 0.01) for level in range(5))
+        values.extend(str(200 + level) for level in range(5))
+        values.extend("{:.2f}".format(price - level * 0.01) for level in range(5))
+        if codes is not None:
+            values.insert(0, codes[idx % len(codes)])
+        lines.append(",".join(values))
+    return "\n".join(lines) + "\n"
+
+
+def _make_factor_values(rows, columns):
+    factors = columns.split(",")
+    lines = [",".join(["date"] + factors)]
+    for idx in range(rows):
+        lines.append(",".join(
+            ["{:04d}-{:02d}-{:02d}".format(
+                2005 + idx // 336, idx // 28 % 12 + 1, idx % 28 + 1
+            )] +
+            ["{:.6f}".format((idx + num) * 0.001) for num in range(len(factors))]
+        ))
+    return "\n".join(lines) + "\n"
+
+
+def _make_securities(rows):
+    lines = ["code,display_name,name,start_date,end_date,type"]
+    for idx in range(rows):
+        lines.append("{:06d}.XSHE,股票{},GP{},2000-01-01,2200-01-01,stock".format(
+            idx, idx, idx
+        ))
+    return "\n".join(lines) + "\n"
+
+
+# 各接口的模拟数据生成函数，参数为 (请求参数, 行数)
+_PAYLOAD_BUILDERS = {
+    "get_bars": lambda params, rows: _make_bars(rows),
+    "get_bars_period": lambda params, rows: _make_bars(rows),
+    "get_ticks": lambda params, rows: _make_ticks(rows),
+    "get_ticks_period": lambda params, rows: _make_ticks(rows),
+    "get_current_ticks": lambda params, rows: _make_ticks(
+        rows, params["code"].split(",")
+    ),
+    "get_factor_values": lambda params, rows: _make_factor_values(
+        rows, params["columns"]
+    ),
+    "get_all_securities": lambda params, rows: _make_securities(rows),
+}
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        params = json.loads(body)
+        method = params.get("method")
+        if server.latency:
+            time.sleep(server.latency)
+        if method in ("get_token", "get_current_token"):
+            data = b"benchmark-token"
+        elif method in _PAYLOAD_BUILDERS:
+            data = server.get_payload(method, params)
+        else:
+            data = "error: 不支持的接口 {}".format(method).encode("utf-8")
+
+        use_gzip = (
+            server.compress and
+            "gzip" in self.headers.get("Accept-Encoding", "")
+        )
+        if use_gzip:
+            data = server.get_compressed(data)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with server.lock:
+            server.bytes_sent += len(data)
+
+
+class MockJQDataServer(ThreadingHTTPServer):
+    """模拟的 JQData HTTP 服务
+
+    参数：
+        rows: 每个请求返回的数据行数
+        latency: 每个请求的模拟延迟（秒）
+        compress: 客户端支持时是否以 gzip 压缩响应内容
+    """
+
+    daemon_threads = True
+
+    def __init__(self, rows=10000, latency=0.0, compress=False):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), _MockHandler)
+        self.rows = rows
+        self.latency = latency
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.bytes_sent = 0
+        self._payloads = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/apis".format(self.server_port)
+
+    def get_payload(self, method, params):
+        # 相同参数的数据只生成一次，避免数据生成的耗时影响测试结果
+        key = (method, params.get("code"), params.get("columns"), self.rows)
+        with self.lock:
+            data = self._payloads.get(key)
+        if data is None:
+            data = _PAYLOAD_BUILDERS[method](params, self.rows).encode("utf-8")
+            with self.lock:
+                self._payloads[key] = data
+        return data
+
+    @functools.lru_cache(32)
+    def get_compressed(self, data):
+        return gzip.compress(data)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+_CODES = ["{:06d}.XSHE".format(idx) for idx in range(1, 101)]
+
+# 测试用例，名称对应 JQDataSDK 兼容接口
+BENCHMARKS = {
+    "get_bars": lambda: jqdatahttp.get_bars(
+        "000001.XSHE", count=1000, unit="1m", end_dt="2021-03-05"
+    ),
+    "get_bars_period": lambda: jqdatahttp.get_bars_period(
+        "000001.XSHE", "2021-03-01 09:30:00", "2021-03-05 15:00:00",
+        unit="1m",
+    ),
+    "get_ticks": lambda: jqdatahttp.get_ticks(
+        "000001.XSHE", start_dt="2021-03-04 09:00:00",
+        end_dt="2021-03-04 15:00:00",
+    ),
+    "get_current_ticks": lambda: jqdatahttp.get_current_ticks(_CODES),
+    "get_factor_values": lambda: jqdatahttp.get_factor_values(
+        ["000001.XSHE"], ["VEMA5", "VEMA10", "VOL20"],
+        start_date="2005-01-01", end_date="2021-03-05",
+    ),
+    "get_all_securities": lambda: jqdatahttp.get_all_securities("stock"),
+}
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    idx = int(round((len(values) - 1) * percent / 100.0))
+    return values[idx]
+
+
+def run_benchmark(server, func, repeat=20, warmup=2, concurrency=1):
+    """运行单个测试，返回每秒调用数、延迟分位数以及传输速率"""
+    for _ in range(warmup):
+        func()
+
+    def timed_call(_):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    bytes_sent = server.bytes_sent
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = list(executor.map(timed_call, range(repeat)))
+    else:
+        latencies = [timed_call(idx) for idx in range(repeat)]
+    elapsed = time.perf_counter() - start
+    bytes_sent = server.bytes_sent - bytes_sent
+    return {
+        "calls_per_sec": repeat / elapsed,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "mb_per_sec": bytes_sent / elapsed / 1e6,
+    }
+
+
+def _compare(results, baseline, tolerance):
+    """与基准结果对比，返回每秒调用数下降超过 tolerance 的测试"""
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        ratio = result["calls_per_sec"] / expected["calls_per_sec"]
+        if ratio < 1 - tolerance:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="使用本地模拟的 JQData HTTP 服务测试接口性能"
+    )
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help="要运行的测试，默认运行全部：{}".format(
+                            ", ".join(BENCHMARKS)))
+    parser.add_argument("--rows", type=int, default=10000,
+                        help="每个请求返回的数据行数，默认 10000")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="模拟的请求延迟（秒），默认 0")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="每个测试的调用次数，默认 20")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="并发调用的线程数，默认 1")
+    parser.add_argument("--compress", action="store_true",
+                        help="服务端以 gzip 压缩响应内容")
+    parser.add_argument("--no-keep-alive", action="store_true",
+                        help="不使用 HTTP 长连接")
+    parser.add_argument("--save", metavar="FILE",
+                        help="将结果保存为 JSON 文件")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="与保存的基准结果对比")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="对比时允许的每秒调用数下降比例，默认 0.2")
+    args = parser.parse_args(argv)
+
+    names = args.names or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmark: {}".format(", ".join(sorted(unknown))))
+
+    server = MockJQDataServer(
+        rows=args.rows, latency=args.latency, compress=args.compress
+    ).start()
+    origin_api = jqdatahttp.api
+    jqdatahttp.api = JQDataApi(
+        url=server.url, token="benchmark-token",
+        keep_alive=not args.no_keep_alive,
+    )
+    results = {}
+    try:
+        print("{:<20}{:>12}{:>12}{:>12}{:>12}".format(
+            "benchmark", "calls/s", "p50 ms", "p99 ms", "MB/s"
+        ))
+        for name in names:
+            result = run_benchmark(
+                server, BENCHMARKS[name], repeat=args.repeat,
+                concurrency=args.concurrency,
+            )
+            results[name] = result
+            print("{:<20}{calls_per_sec:>12.2f}{p50_ms:>12.2f}"
+                  "{p99_ms:>12.2f}{mb_per_sec:>12.2f}".format(name, **result))
+    finally:
+        jqdatahttp.api.close()
+        jqdatahttp.api = origin_api
+        server.stop()
+
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        regressions = _compare(results, baseline, args.tolerance)
+        for name, ratio in regressions:
+            print("regression: {} calls/s is {:.0%} of baseline".format(
+                name, ratio
+            ))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,25 +8,60 @@ from __future__ import print_function
 import os
 import sys
 import re
+import ssl
 import time
 import json
+import zlib
+import codecs
+import errno
 import socket
+import asyncio
+import struct
+import bisect
+import hashlib
+import tempfile
 import logging
 import datetime
 import functools
+import threading
 from types import ModuleType
-from collections import OrderedDict
+from collections import OrderedDict, deque, namedtuple
+import concurrent.futures
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
 
 try:
     from urllib.request import urlopen, Request as HTTPRequest
     from urllib.error import URLError, HTTPError
+    from urllib.parse import urlsplit
 except ImportError:
     from urllib2 import urlopen, Request as HTTPRequest, URLError, HTTPError
+    from urlparse import urlsplit
+
+try:
+    from http.client import (
+        HTTPConnection, HTTPSConnection, HTTPException, BadStatusLine,
+        RemoteDisconnected,
+    )
+except ImportError:
+    from httplib import (
+        HTTPConnection, HTTPSConnection, HTTPException, BadStatusLine,
+    )
+    RemoteDisconnected = BadStatusLine
 
 try:
-    from io import StringIO
+    from io import StringIO, BytesIO
 except ImportError:
     from StringIO import StringIO
+    from io import BytesIO
 
 
 __version__ = '0.1.9'
@@ -59,14 +94,26 @@ def is_binary_type(obj):
     return isinstance(obj, binary_type)
 
 
+# 延迟导入的模块首次使用时持有的锁
+_lazy_import_lock = threading.RLock()
+
+
 class _LazyModuleType(ModuleType):
 
     @property
     def _mod(self):
-        name = super(_LazyModuleType, self).__getattribute__("__name__")
-        if name not in sys.modules:
-            __import__(name)
-        return sys.modules[name]
+        namespace = super(_LazyModuleType, self).__getattribute__("__dict__")
+        module = namespace.get("_lazy_module")
+        if module is None:
+            # 首次使用时在锁内导入，多个线程同时使用时其他线程等待导入完成，
+            # 不会拿到初始化了一半的模块
+            with _lazy_import_lock:
+                module = namespace.get("_lazy_module")
+                if module is None:
+                    name = namespace["__name__"]
+                    __import__(name)
+                    module = namespace["_lazy_module"] = sys.modules[name]
+        return module
 
     def __getattribute__(self, name):
         if name == "_mod":
@@ -83,6 +130,10 @@ class _LazyModuleType(ModuleType):
 
 np = _LazyModuleType("numpy")
 pd = _LazyModuleType("pandas")
+# Arrow 与 Polars 为可选依赖，仅在指定对应的输出格式时导入
+pa = _LazyModuleType("pyarrow")
+pa_csv = _LazyModuleType("pyarrow.csv")
+pl = _LazyModuleType("polars")
 
 
 class JQDataError(Exception):
@@ -97,30 +148,1264 @@ class ParamsError(JQDataError):
     """参数错误"""
 
 
-class JQDataApi(object):
+class ServerError(JQDataError):
+    """服务端超时或内部错误（HTTP 504/500），通常稍后重试即可恢复"""
+
+
+class _PooledResponse(object):
+    """连接池返回的响应，关闭时自动将连接归还到连接池"""
+
+    def __init__(self, pool, key, conn, resp):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.msg
+
+    def read(self, amt=None):
+        return self._resp.read(amt)
+
+    def getheader(self, name, default=None):
+        return self._resp.getheader(name, default)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        # 只有响应已被完整读取且服务端未要求关闭时，连接才可以复用
+        if self._resp.isclosed() and not self._resp.will_close:
+            self._pool.put_connection(self._key, conn)
+        else:
+            self._resp.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _DeflateDecompressor(object):
+    """deflate 解压对象，兼容不带 zlib 头的原始 deflate 数据"""
+
+    def __init__(self):
+        self._obj = zlib.decompressobj()
+        self._started = False
+
+    def decompress(self, data):
+        if not self._started and data:
+            self._started = True
+            try:
+                return self._obj.decompress(data)
+            except zlib.error:
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+def _make_decompressor(content_encoding):
+    """根据 Content-Encoding 创建解压对象，内容未压缩时返回 None"""
+    content_encoding = (content_encoding or "").strip().lower()
+    if content_encoding in ("", "identity"):
+        return None
+    elif content_encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == "deflate":
+        return _DeflateDecompressor()
+    raise HTTPException(
+        "unsupported content encoding: {!r}".format(content_encoding)
+    )
+
+
+def _decompress_body(body, content_encoding):
+    """解压完整的响应内容"""
+    decompressor = _make_decompressor(content_encoding)
+    if decompressor is None or not body:
+        return body
+    return decompressor.decompress(body) + decompressor.flush()
+
+
+class _DecompressingResponse(object):
+    """透明解压响应内容，同时统计压缩的（实际传输的）与解压后的字节数"""
+
+    def __init__(self, resp):
+        self._resp = resp
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+        self.content_encoding = resp.getheader("Content-Encoding")
+        self._decompressor = _make_decompressor(self.content_encoding)
+        self.raw_size = 0
+        self.size = 0
+
+    def read(self, amt=None):
+        while True:
+            raw = self._resp.read(amt)
+            self.raw_size += len(raw)
+            if self._decompressor is None:
+                data = raw
+            elif amt is None:
+                data = self._decompressor.decompress(raw)
+                data += self._decompressor.flush()
+            elif raw:
+                data = self._decompressor.decompress(raw)
+            else:
+                data = self._decompressor.flush()
+            self.size += len(data)
+            # 压缩数据较少时可能解压不出内容，需要继续读取，否则会被误认为读取完毕
+            if data or not raw or amt is None:
+                return data
+
+    def getheader(self, name, default=None):
+        return self._resp.getheader(name, default)
+
+    def close(self):
+        self._resp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# 复用的空闲连接已被服务端关闭时，在收到任何响应内容之前出现的错误
+_STALE_CONNECTION_ERRORS = (BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+
+class _ConnectionPool(object):
+    """HTTP 长连接池
+
+    按 (scheme, host, port) 缓存空闲连接，线程安全。每个请求独占一个连接，
+    请求结束后连接被归还以供复用，避免每次请求都重新建立 TCP 连接和 TLS 握手。
+
+    参数：
+        maxsize: 每个主机最多保留的空闲连接数
+        idle_timeout: 空闲连接的最长保留时间（秒），超时的连接会被丢弃
+    """
+
+    def __init__(self, maxsize=10, idle_timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle_conns = {}
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _parse_url(url):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == "https" else 80)
+        path = parts.path or "/"
+        if parts.query:
+            path = "{}?{}".format(path, parts.query)
+        return (scheme, parts.hostname, port), path
+
+    @staticmethod
+    def _new_connection(key, timeout):
+        scheme, host, port = key
+        conn_cls = HTTPSConnection if scheme == "https" else HTTPConnection
+        return conn_cls(host, port, timeout=timeout)
+
+    def _check_fork(self):
+        # 子进程不能复用父进程的套接字，直接丢弃继承来的连接
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._idle_conns = {}
+
+    def get_connection(self, key, timeout):
+        """取出一个可用连接，返回 (连接, 是否为复用连接)"""
+        now = time.time()
+        expired = []
+        conn = None
+        with self._lock:
+            self._check_fork()
+            conns = self._idle_conns.get(key)
+            while conns:
+                idle_conn, last_used = conns.pop()
+                if now - last_used > self.idle_timeout:
+                    expired.append(idle_conn)
+                else:
+                    conn = idle_conn
+                    break
+            # 栈顶的连接最新，之后的更旧，顺带清理已过期的连接
+            while conns and now - conns[0][1] > self.idle_timeout:
+                expired.append(conns.popleft()[0])
+        for idle_conn in expired:
+            idle_conn.close()
+        if conn is None:
+            return self._new_connection(key, timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def put_connection(self, key, conn):
+        """归还连接，超出连接池容量时直接关闭"""
+        with self._lock:
+            self._check_fork()
+            conns = self._idle_conns.setdefault(key, deque())
+            if len(conns) < self.maxsize:
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+    def idle_count(self, url=None):
+        """空闲连接数"""
+        with self._lock:
+            if url is None:
+                return sum(len(conns) for conns in self._idle_conns.values())
+            key, _ = self._parse_url(url)
+            return len(self._idle_conns.get(key, ()))
+
+    def prewarm(self, url, count, timeout=None):
+        """预先建立连接，使空闲连接数达到 count 个"""
+        key, _ = self._parse_url(url)
+        count = min(count, self.maxsize) - self.idle_count(url)
+        for _ in range(count):
+            conn = self._new_connection(key, timeout)
+            try:
+                conn.connect()
+            except (socket.error, HTTPException) as ex:
+                logger.debug('prewarm connection to %r error: %s', url, ex)
+                conn.close()
+                break
+            self.put_connection(key, conn)
+
+    def clear(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle_conns, self._idle_conns = self._idle_conns, {}
+        for conns in idle_conns.values():
+            for conn, _ in conns:
+                conn.close()
+
+    @staticmethod
+    def _send(conn, method, path, data, headers):
+        try:
+            conn.request(method, path, body=data, headers=headers)
+            return conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+    def urlopen(self, url, data=None, headers=None, timeout=None,
+                method="POST"):
+        """发送请求
+
+        与 urllib 的 urlopen 行为保持一致：HTTP 状态码 >= 400 时抛出 HTTPError，
+        网络错误抛出 URLError，以便复用上层的重试与错误处理逻辑。
+        复用的连接已被服务端关闭时，在新建的连接上重试一次；超时等其他错误
+        不在这里重试，交由调用方按请求次数处理，避免重复发送请求
+        """
+        key, path = self._parse_url(url)
+        headers = dict(headers or {})
+        if data is not None:
+            headers.setdefault(
+                "Content-Type", "application/x-www-form-urlencoded"
+            )
+        conn, reused = self.get_connection(key, timeout)
+        try:
+            try:
+                resp = self._send(conn, method, path, data, headers)
+            except _STALE_CONNECTION_ERRORS as ex:
+                if not reused:
+                    raise
+                logger.debug("reused connection to %r is closed: %s", url, ex)
+                conn = self._new_connection(key, timeout)
+                resp = self._send(conn, method, path, data, headers)
+        except HTTPException as ex:
+            raise URLError(ex)
+
+        pooled_resp = _PooledResponse(self, key, conn, resp)
+        if resp.status >= 400:
+            with pooled_resp:
+                body = resp.read()
+            raise HTTPError(url, resp.status, resp.reason, resp.msg,
+                            BytesIO(body))
+        return pooled_resp
+
+
+class _AsyncResponse(object):
+    """asyncio 版连接池返回的响应，响应内容已被完整读取"""
+
+    def __init__(self, status, reason, headers, body, will_close):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.will_close = will_close
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+async def _read_http_response(reader):
+    """从 asyncio.StreamReader 中读取并解析一个 HTTP/1.1 响应"""
+    line = await reader.readline()
+    if not line:
+        raise RemoteDisconnected("Remote end closed connection without response")
+    parts = line.decode("iso-8859-1").rstrip("\r\n").split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise HTTPException("bad status line: {!r}".format(line))
+    version, status = parts[0], int(parts[1])
+    reason = parts[2] if len(parts) > 2 else ""
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("iso-8859-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    conn_header = headers.get("connection", "").lower()
+    will_close = conn_header == "close" or (
+        version == "HTTP/1.0" and conn_header != "keep-alive"
+    )
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                while await reader.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    elif status in (204, 304) or 100 <= status < 200:
+        body = b""
+    else:
+        body = await reader.read()
+        will_close = True
+    return _AsyncResponse(status, reason, headers, body, will_close)
+
+
+class _AsyncConnectionPool(object):
+    """asyncio 版 HTTP 长连接池
+
+    只能在同一个事件循环中使用，参数与 _ConnectionPool 相同
+    """
+
+    def __init__(self, maxsize=10, idle_timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle_conns = {}
+
+    async def _new_connection(self, key):
+        scheme, host, port = key
+        ssl_context = ssl.create_default_context() if scheme == "https" else None
+        return await asyncio.open_connection(host, port, ssl=ssl_context)
+
+    async def get_connection(self, key):
+        """取出一个可用连接，返回 (reader, writer, 是否为复用连接)"""
+        now = time.time()
+        conns = self._idle_conns.get(key)
+        while conns:
+            reader, writer, last_used = conns.pop()
+            if now - last_used > self.idle_timeout or reader.at_eof():
+                writer.close()
+                continue
+            return reader, writer, True
+        reader, writer = await self._new_connection(key)
+        return reader, writer, False
+
+    def put_connection(self, key, reader, writer):
+        conns = self._idle_conns.setdefault(key, deque())
+        if len(conns) < self.maxsize:
+            conns.append((reader, writer, time.time()))
+        else:
+            writer.close()
+
+    def idle_count(self, url=None):
+        """空闲连接数"""
+        if url is None:
+            return sum(len(conns) for conns in self._idle_conns.values())
+        key, _ = _ConnectionPool._parse_url(url)
+        return len(self._idle_conns.get(key, ()))
+
+    async def prewarm(self, url, count):
+        """预先建立连接，使空闲连接数达到 count 个"""
+        key, _ = _ConnectionPool._parse_url(url)
+        for _ in range(min(count, self.maxsize) - self.idle_count(url)):
+            try:
+                reader, writer = await self._new_connection(key)
+            except OSError as ex:
+                logger.debug('prewarm connection to %r error: %s', url, ex)
+                break
+            self.put_connection(key, reader, writer)
+
+    def clear(self):
+        """关闭所有空闲连接"""
+        idle_conns, self._idle_conns = self._idle_conns, {}
+        for conns in idle_conns.values():
+            for _, writer, _ in conns:
+                writer.close()
+
+    def reset(self):
+        """丢弃所有空闲连接，用于事件循环切换后，旧循环中的连接已不可用"""
+        self._idle_conns = {}
+
+    @staticmethod
+    async def _send(reader, writer, req_bytes):
+        try:
+            writer.write(req_bytes)
+            await writer.drain()
+            return await _read_http_response(reader)
+        except BaseException:
+            writer.close()
+            raise
+
+    async def urlopen(self, url, data=None, headers=None, method="POST"):
+        """发送请求，返回 _AsyncResponse，状态码的处理交由调用方"""
+        key, path = _ConnectionPool._parse_url(url)
+        scheme, host, port = key
+        default_port = 443 if scheme == "https" else 80
+        headers = dict(headers or {})
+        headers.setdefault(
+            "Host", host if port == default_port else "{}:{}".format(host, port)
+        )
+        if data is not None:
+            headers.setdefault(
+                "Content-Type", "application/x-www-form-urlencoded"
+            )
+            headers["Content-Length"] = str(len(data))
+        lines = ["{} {} HTTP/1.1".format(method, path)]
+        lines.extend("{}: {}".format(name, val) for name, val in headers.items())
+        req_bytes = ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1")
+        if data is not None:
+            req_bytes += data
+
+        reader, writer, reused = await self.get_connection(key)
+        try:
+            resp = await self._send(reader, writer, req_bytes)
+        except _STALE_CONNECTION_ERRORS as ex:
+            if not reused:
+                raise
+            # 复用的连接已被服务端关闭时，在新建的连接上重试一次
+            logger.debug("reused connection to %r is closed: %s", url, ex)
+            reader, writer = await self._new_connection(key)
+            resp = await self._send(reader, writer, req_bytes)
+
+        if resp.will_close:
+            writer.close()
+        else:
+            self.put_connection(key, reader, writer)
+        return resp
+
+
+# 可缓存的接口及其必须提供的日期参数，只有请求中的日期参数都早于今天时，
+# 数据才不会再变化，请求结果才会被缓存
+_CACHEABLE_METHODS = {
+    "get_price": ("end_date",),
+    "get_price_period": ("end_date",),
+    "get_bars": ("end_date",),
+    "get_bars_period": ("end_date",),
+    "get_ticks": ("end_date",),
+    "get_ticks_period": ("end_date",),
+    "get_call_auction": ("end_date",),
+    "get_fq_factor": ("end_date",),
+    "get_extras": ("end_date",),
+    "get_money_flow": ("end_date",),
+    "get_mtss": ("end_date",),
+    "get_factor_values": ("end_date",),
+    "get_billboard_list": ("date",),
+    "get_fundamentals": ("date",),
+    "get_index_stocks": ("date",),
+    "get_index_weights": ("date",),
+    "get_industry_stocks": ("date",),
+    "get_concept_stocks": ("date",),
+}
+
+_CACHE_DATE_PARAMS = ("date", "end_date", "fq_ref_date")
+
+
+def _period_end_date(value):
+    """将日期参数转化为其所表示时间段的最后一天，支持 2018, 2018q1 格式"""
+    value = str(value).strip().lower()
+    if re.match(r'^\d{4}$', value):
+        return datetime.date(int(value), 12, 31)
+    match = re.match(r'^(\d{4})q([1-4])$', value)
+    if match:
+        year, quarter = int(match.group(1)), int(match.group(2))
+        if quarter == 4:
+            return datetime.date(year, 12, 31)
+        return (datetime.date(year, quarter * 3 + 1, 1) -
+                datetime.timedelta(days=1))
+    return to_date(value)
+
+
+def _is_cacheable_request(method, params, today=None):
+    """判断请求的结果是否已经不再变化，可以被缓存"""
+    required_params = _CACHEABLE_METHODS.get(method)
+    if required_params is None:
+        return False
+    if not all(params.get(name) for name in required_params):
+        return False
+    # 前复权因子会随着除权除息而变化
+    if method == "get_fq_factor" and params.get("fq") == "pre":
+        return False
+    today = today or datetime.date.today()
+    for name in _CACHE_DATE_PARAMS:
+        value = params.get(name)
+        if not value:
+            continue
+        try:
+            if _period_end_date(value) >= today:
+                return False
+        except (ValueError, TypeError, IndexError):
+            return False
+    return True
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+
+def _atomic_write(path, content, mode=0o644):
+    """先写临时文件再重命名，保证其他进程读取到的总是完整的内容"""
+    dirname = os.path.dirname(path)
+    _makedirs(dirname)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(content)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class _FileLock(object):
+    """基于文件的进程间互斥锁，同一主机上的所有进程和线程共享
+
+    POSIX 系统使用 fcntl.flock，Windows 使用 msvcrt.locking，
+    两者均不可用时只在当前进程内加锁
+    """
+
+    _local_locks = {}
+    _local_locks_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        with self._local_locks_lock:
+            self._local_lock = self._local_locks.setdefault(
+                path, threading.Lock()
+            )
+
+    def acquire(self):
+        self._local_lock.acquire()
+        try:
+            _makedirs(os.path.dirname(self.path))
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+            self._fd = fd
+        except BaseException:
+            self._local_lock.release()
+            raise
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            os.close(fd)
+        finally:
+            self._local_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class _TokenStore(object):
+    """同一主机上多个进程共享的 token 存储
+
+    token 与其过期时间保存在文件中，每个账号一个文件。新启动的进程可以直接
+    使用其他进程已经获取的 token，无需再请求认证接口。刷新 token 时持有文件锁，
+    并发的刷新（包括其他进程中的）只会实际请求一次
+
+    参数：
+        path: 存储目录，默认为 ~/.cache/jqdatahttp
+        ttl: token 的有效时间（秒），超过后会重新获取
+    """
+
+    def __init__(self, path=None, ttl=12 * 3600):
+        if not path:
+            path = os.path.join(os.path.expanduser("~"), ".cache", "jqdatahttp")
+        self.path = path
+        self.ttl = ttl
+
+    def _token_path(self, username):
+        name = hashlib.sha1((username or "").encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.path, "token-{}.json".format(name))
+
+    def load_entry(self, username):
+        """读取未过期的 token 及其过期时间，不存在或者已过期时返回 (None, None)"""
+        try:
+            with open(self._token_path(username), "rb") as fp:
+                content = json.loads(fp.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return None, None
+        expire_at = content.get("expire_at", 0)
+        if content.get("username") != username or expire_at <= time.time():
+            return None, None
+        token = content.get("token") or None
+        return token, (expire_at if token else None)
+
+    def load(self, username):
+        """读取未过期的 token，不存在或者已过期时返回 None"""
+        return self.load_entry(username)[0]
+
+    def save(self, username, token):
+        content = json.dumps({
+            "username": username,
+            "token": token,
+            "expire_at": time.time() + self.ttl,
+        })
+        _atomic_write(self._token_path(username), content.encode("utf-8"),
+                      mode=0o600)
+
+    def refresh(self, username, stale_token, fetch):
+        """刷新 token
+
+        如果存储的 token 已经与 stale_token 不同（已被其他进程或线程刷新），
+        则直接返回存储的 token，否则调用 fetch() 获取新的 token 并保存
+        """
+        path = self._token_path(username)
+        with _FileLock(path + ".lock"):
+            token = self.load(username)
+            if token and token != stale_token:
+                return token
+            token = fetch()
+            self.save(username, token)
+            return token
+
+
+class _RateLimiter(object):
+    """令牌桶限流器
+
+    每秒补充 rate 个令牌，最多积累 burst 个，每个请求消耗一个令牌，令牌不足时
+    请求排队等待而不是失败。指定 path 时令牌桶的状态保存在文件中并由文件锁保护，
+    同一主机上所有共享该文件的进程和线程共用一个令牌桶
+
+    参数：
+        rate: 每秒允许的请求数
+        burst: 允许的突发请求数，默认与 rate 相同
+        path: 令牌桶状态文件的路径，为空时只在当前进程内限流
+    """
+
+    _STATE_FORMAT = "<dd"
+
+    def __init__(self, rate, burst=None, path=None):
+        if rate <= 0:
+            raise ParamsError("rate 参数必须大于 0")
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.path = path
+        self._lock = _FileLock(path + ".lock") if path else threading.Lock()
+        self._tokens = self.burst
+        self._updated_at = time.time()
+
+    def _load_state(self):
+        try:
+            with open(self.path, "rb") as fp:
+                return struct.unpack(self._STATE_FORMAT, fp.read())
+        except (IOError, OSError, struct.error):
+            return self.burst, time.time()
+
+    def _save_state(self, tokens, updated_at):
+        with open(self.path, "wb") as fp:
+            fp.write(struct.pack(self._STATE_FORMAT, tokens, updated_at))
+
+    def try_acquire(self):
+        """尝试获取一个令牌，成功时返回 0，否则返回需要等待的秒数"""
+        with self._lock:
+            if self.path:
+                tokens, updated_at = self._load_state()
+            else:
+                tokens, updated_at = self._tokens, self._updated_at
+            now = time.time()
+            tokens = min(
+                self.burst, tokens + max(now - updated_at, 0) * self.rate
+            )
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            if self.path:
+                self._save_state(tokens, now)
+            else:
+                self._tokens, self._updated_at = tokens, now
+        return wait
+
+    def acquire(self):
+        """获取一个令牌，令牌不足时阻塞等待"""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class _SingleFlight(object):
+    """合并相同的并发调用
+
+    同一时刻相同键的调用只实际执行一次，其他调用等待其完成并共享它的返回值或异常
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._calls[key] = Future()
+        if not is_leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class _AsyncSingleFlight(object):
+    """asyncio 版的 _SingleFlight，只能在同一个事件循环中使用"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func):
+        future = self._calls.get(key)
+        while future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 只有执行调用的协程被取消（如其自身的超时）时，等待者不随之取消，
+                # 而是由其中一个重新执行，等待者自身被取消时照常抛出
+                if not future.cancelled():
+                    raise
+            future = self._calls.get(key)
+        future = self._calls[key] = asyncio.get_event_loop().create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as ex:
+            future.set_exception(ex)
+            # 没有其他等待者时避免 asyncio 提示异常未被获取
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+class _DiskCache(object):
+    """基于磁盘的请求结果缓存
+
+    以去掉 token 后的请求内容的哈希值为键，缓存内容经 zlib 压缩后存储为单独的
+    文件。写入时先写临时文件再重命名，因此可以在多个进程间共享同一个缓存目录。
+    缓存总大小超过 max_size 时，按最近访问时间淘汰最久未使用的缓存
+
+    参数：
+        cache_dir: 缓存目录，默认为 ~/.cache/jqdatahttp
+        max_size: 缓存的最大字节数，默认为 1GB
+    """
+
+    _SUFFIX = ".z"
+
+    def __init__(self, cache_dir=None, max_size=1 << 30):
+        if not cache_dir:
+            cache_dir = os.path.join(
+                os.path.expanduser("~"), ".cache", "jqdatahttp"
+            )
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_size = None
+
+    @staticmethod
+    def make_key(url, method, params):
+        """由不含 token 的请求内容生成缓存键"""
+        body = json.dumps([url, method, params], default=str, sort_keys=True)
+        return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + self._SUFFIX)
+
+    def get(self, key):
+        """读取缓存，不存在时返回 None"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fp:
+                content = fp.read()
+            data = zlib.decompress(content).decode("utf-8")
+        except (IOError, OSError, zlib.error):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path, None)  # 更新访问时间，用于 LRU 淘汰
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def set(self, key, data):
+        content = zlib.compress(data.encode("utf-8"))
+        _atomic_write(self._path(key), content)
+        with self._lock:
+            if self._total_size is None:
+                self._total_size = self.size()
+            else:
+                self._total_size += len(content)
+            need_evict = self._total_size > self.max_size
+        if need_evict:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        try:
+            subdirs = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for subdir in subdirs:
+            subdir = os.path.join(self.cache_dir, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if not name.endswith(self._SUFFIX):
+                    continue
+                path = os.path.join(subdir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        """缓存的总字节数"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """淘汰最久未使用的缓存，直到总大小不超过 max_size"""
+        entries = sorted(self._entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+        with self._lock:
+            self._total_size = total_size
+
+    def clear(self):
+        """清空缓存"""
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._total_size = 0
+
+
+# 内存缓存的默认策略：接口 -> (缓存时间（秒）, 最多缓存的条数)，
+# 只缓存变化很少的元数据类接口
+_MEMORY_CACHE_POLICIES = {
+    "get_all_trade_days": (6 * 3600, 1),
+    "get_all_securities": (3600, 64),
+    "get_security_info": (3600, 4096),
+    "get_concepts": (3600, 1),
+    "get_industries": (3600, 16),
+    "get_all_factors": (6 * 3600, 1),
+    "get_index_weights": (3600, 256),
+    "get_dominant_future": (600, 256),
+}
+
+
+class _MemoryCache(object):
+    """进程内的接口结果缓存
+
+    按接口分别设置缓存时间与最多缓存的条数，超出条数时淘汰最久未使用的结果，线程安全。
+    过期不超过 max_stale 秒的结果仍会被返回并标记为过期，由调用方在后台刷新
+    （stale-while-revalidate），max_stale 为 0 时过期的结果不再使用
+
+    参数：
+        policies: 各接口的缓存策略，{接口名: (缓存时间（秒）, 最多缓存的条数)}
+        max_stale: 过期的结果最多继续使用的秒数，默认为各接口的缓存时间
+    """
+
+    def __init__(self, policies, max_stale=None):
+        self.policies = dict(policies)
+        self.max_stale = max_stale
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stats = {}
+        self._refreshing = set()
+
+    def is_cacheable(self, method):
+        ttl, maxsize = self.policies.get(method, (0, 0))
+        return ttl > 0 and maxsize > 0
+
+    def _count(self, method, name):
+        stats = self._stats.setdefault(
+            method, {"hits": 0, "stale_hits": 0, "misses": 0}
+        )
+        stats[name] += 1
+
+    def get(self, method, key):
+        """读取缓存，返回 (结果, 是否已过期)，没有可用的结果时返回 (None, False)"""
+        now = time.time()
+        ttl = self.policies[method][0]
+        max_stale = ttl if self.max_stale is None else self.max_stale
+        with self._lock:
+            entries = self._entries.get(method)
+            entry = entries.get(key) if entries else None
+            if entry is not None:
+                value, created_at = entry
+                age = now - created_at
+                if age <= ttl + max_stale:
+                    entries.move_to_end(key)
+                    is_stale = age > ttl
+                    self._count(method, "stale_hits" if is_stale else "hits")
+                    return value, is_stale
+                del entries[key]
+            self._count(method, "misses")
+        return None, False
+
+    def set(self, method, key, value):
+        maxsize = self.policies[method][1]
+        with self._lock:
+            entries = self._entries.setdefault(method, OrderedDict())
+            entries[key] = (value, time.time())
+            entries.move_to_end(key)
+            while len(entries) > maxsize:
+                entries.popitem(last=False)
+
+    def start_refresh(self, key):
+        """标记开始刷新，已在刷新中时返回 False，避免重复刷新"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def finish_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def invalidate(self, method=None):
+        """清除指定接口（默认为所有接口）的缓存结果"""
+        with self._lock:
+            if method is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(method, None)
+
+    def stats(self):
+        """各接口的缓存统计：命中数、命中过期结果数、未命中数以及缓存的条数"""
+        with self._lock:
+            result = {}
+            for method in set(self._stats) | set(self._entries):
+                stats = dict(self._stats.get(
+                    method, {"hits": 0, "stale_hits": 0, "misses": 0}
+                ))
+                stats["size"] = len(self._entries.get(method, ()))
+                result[method] = stats
+            return result
+
+
+# 耗时直方图各分桶的上界（秒），最后还有一个不设上界的分桶
+_LATENCY_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+# 各接口统计的计数指标：
+#   calls: 接口调用次数（包括命中缓存与合并的调用）
+#   requests: 实际发送的 HTTP 请求数（每次重试都计入），retries: 重试次数
+#   errors: 重试后仍然出错的调用数，token_refreshes: 因 token 缺失或失效而刷新
+#   token 的次数，request_bytes: 实际发送的请求内容的字节数
+#   response_bytes/raw_response_bytes: 解压后/实际传输的响应字节数
+_METRIC_COUNTERS = (
+    "calls", "requests", "retries", "errors", "token_refreshes",
+    "request_bytes", "response_bytes", "raw_response_bytes",
+)
+
+
+class _Histogram(object):
+    """固定分桶的耗时直方图"""
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(_LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(_LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """返回 count、sum 以及各分桶上界对应的累计次数（"+Inf" 为总次数）"""
+        buckets = OrderedDict()
+        total = 0
+        for bound, count in zip(_LATENCY_BUCKETS + ("+Inf",), self.counts):
+            total += count
+            buckets[bound] = total
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class _Metrics(object):
+    """按接口统计的调用指标，线程安全
+
+    每个接口包括 _METRIC_COUNTERS 中的计数，以及三类耗时直方图：
+    wait 为成功的那次请求从发送到收到响应头的耗时（网络与服务端，不包括限流
+    等待与重试间隔），latency 为从发送到响应内容读取完毕的耗时（流式读取时
+    包括读取期间调用方的处理时间），
+    parse 为各 CSV 解析函数的耗时（按解析函数名分别统计）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = {}
+
+    def _entry(self, method):
+        entry = self._methods.get(method)
+        if entry is None:
+            entry = self._methods[method] = {
+                "counters": dict.fromkeys(_METRIC_COUNTERS, 0),
+                "wait": _Histogram(),
+                "latency": _Histogram(),
+                "parse": {},
+            }
+        return entry
+
+    def add(self, method, name, value=1):
+        with self._lock:
+            self._entry(method)["counters"][name] += value
+
+    def observe(self, method, name, value):
+        with self._lock:
+            self._entry(method)[name].observe(value)
+
+    def observe_parse(self, method, parser, value):
+        with self._lock:
+            parse = self._entry(method)["parse"]
+            if parser not in parse:
+                parse[parser] = _Histogram()
+            parse[parser].observe(value)
+
+    def stats(self):
+        """返回 {接口名: {计数指标..., "wait": 直方图, "latency": 直方图,
+        "parse": {解析函数名: 直方图}}}，直方图的格式见 _Histogram.snapshot"""
+        with self._lock:
+            result = {}
+            for method, entry in self._methods.items():
+                stats = dict(entry["counters"])
+                stats["wait"] = entry["wait"].snapshot()
+                stats["latency"] = entry["latency"].snapshot()
+                stats["parse"] = {
+                    parser: hist.snapshot()
+                    for parser, hist in entry["parse"].items()
+                }
+                result[method] = stats
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+
+
+# 当前线程刚返回的接口结果（或流式响应的一块）所属的 (_Metrics, 接口名)，
+# 接下来的一次 CSV 解析的耗时计入该接口，解析后即清除
+_metrics_local = threading.local()
+
+
+def _timed_parser(name):
+    """统计 CSV 解析函数耗时的装饰器
+
+    只统计接口返回结果之后的第一次解析，之后无关的解析（包括用户代码中的调用）
+    不会被计入
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            current = getattr(_metrics_local, "current", None)
+            if current is None:
+                return func(*args, **kwargs)
+            _metrics_local.current = None
+            started = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics, method = current
+                metrics.observe_parse(method, name, time.time() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def _prometheus_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def format_prometheus(stats, prefix="jqdatahttp"):
+    """将 api.stats() 的结果转化为 Prometheus 文本格式，可用于暴露给监控系统抓取"""
+    lines = []
+
+    def histogram_lines(name, labels, hist):
+        for bound, count in hist["buckets"].items():
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                name, labels, bound, count
+            ))
+        lines.append("{}_sum{{{}}} {}".format(name, labels, hist["sum"]))
+        lines.append("{}_count{{{}}} {}".format(name, labels, hist["count"]))
+
+    prefix = _prometheus_name(prefix)
+    for counter in _METRIC_COUNTERS:
+        name = "{}_{}_total".format(prefix, counter)
+        lines.append("# TYPE {} counter".format(name))
+        for method in sorted(stats):
+            lines.append('{}{{method="{}"}} {}'.format(
+                name, method, stats[method][counter]
+            ))
+    for hist_name in ("wait", "latency"):
+        name = "{}_{}_seconds".format(prefix, hist_name)
+        lines.append("# TYPE {} histogram".format(name))
+        for method in sorted(stats):
+            histogram_lines(
+                name, 'method="{}"'.format(method), stats[method][hist_name]
+            )
+    name = "{}_parse_seconds".format(prefix)
+    lines.append("# TYPE {} histogram".format(name))
+    for method in sorted(stats):
+        for parser, hist in sorted(stats[method]["parse"].items()):
+            histogram_lines(
+                name, 'method="{}",parser="{}"'.format(method, parser), hist
+            )
+    return "\n".join(lines) + "\n"
+
+
+TransferInfo = namedtuple(
+    "TransferInfo", ["method", "content_encoding", "raw_size", "size"]
+)
+
+
+class _BaseJQDataApi(object):
+    """同步与异步接口共用的配置、参数处理与错误处理逻辑"""
 
     _V1_URL = "https://dataapi.joinquant.com/apis"
     _V2_URL = "https://dataapi.joinquant.com/v2/apis"
     _DEFAULT_URL = "https://dataapi.joinquant.com/v2/apis"
 
     def __init__(self, username=None, password=None, url=None, token=None,
-                 timeout=20):
+                 timeout=20, pool_prewarm=2):
         self._username = username
         self._password = password
         self._url = url
         self.timeout = timeout
 
+        # HTTP 长连接池，由子类创建
+        self._pool = None
+        # 认证成功后预先建立的连接数
+        self.pool_prewarm = pool_prewarm
+
+        # 历史数据的磁盘缓存，默认不开启
+        self._cache = None
+        # 元数据类接口的内存缓存，默认不开启，开启后可能返回过期的结果
+        self._memory_cache = None
+        # 请求限流器，默认不开启
+        self._rate_limiter = None
+
         # 外部设置的 token, 如果设置后会被直接使用，不再自动获取
         self._external_token = token
         # 自动获取的 token
         self._auto_token = None
+        # 自动获取的 token 的估计过期时间
+        self._token_expire_at = None
+        # 自动获取的 token 的有效时间（秒），用于估计 token 的过期时间
+        self.token_ttl = 12 * 3600
+        # 多进程共享的 token 存储，默认不开启
+        self._token_store = None
 
         # 数据内容编码
         self._encoding = "UTF-8"
 
+        # 是否合并相同的并发请求，合并后只实际发送一次请求，结果由各调用方共享
+        self.coalesce_requests = True
+
+        # 是否请求服务端以 gzip/deflate 压缩响应内容
+        self.compress = True
+        # 各线程最近一次请求的传输字节数
+        self._transfer_local = threading.local()
+        # 按接口统计的调用指标，默认开启，以及定期导出指标的后台线程
+        self._metrics = _Metrics()
+        self._metrics_exporters = {}
+
         self.show_request_params = False  # 是否显示请求参数
         self.show_raw_result = False      # 是否显示原始的返回结果
         self.auto_format_result = False   # 是否自动格式化返回结果
+        self.output_format = "pandas"     # 自动格式化时 CSV 数据的输出格式
 
     _INVALID_TOKEN_PATTERN = re.compile(
         r'(invalid\s+token)|(token\s+expired)|(token.*无效)|(token.*过期)|'
@@ -131,42 +1416,409 @@ class JQDataApi(object):
     def username(self):
         return self._username or os.getenv("JQDATA_USERNAME")
 
-    @property
-    def password(self):
-        return self._password or os.getenv("JQDATA_PASSWORD")
+    @property
+    def password(self):
+        return self._password or os.getenv("JQDATA_PASSWORD")
+
+    @property
+    def url(self):
+        if self._url:
+            return self._url
+        url_from_env = os.getenv("JQDATA_URL")
+        if url_from_env:
+            if url_from_env.upper() == "v1":
+                return self._V1_URL
+            elif url_from_env.upper() == "v2":
+                return self._V2_URL
+            else:
+                return url_from_env
+        else:
+            return self._DEFAULT_URL
+
+    @url.setter
+    def url(self, value):
+        if value.lower() == "v1":
+            value = self._V1_URL
+        elif value.lower() == "v2":
+            value = self._V2_URL
+        self._url = value
+
+    @property
+    def token(self):
+        external_token = self._external_token or os.getenv("JQDATA_TOKEN")
+        if external_token:
+            return external_token
+        if self._auto_token is None and self._token_store is not None:
+            self._use_stored_token()
+        return self._auto_token
+
+    _AUTH_METHODS = frozenset(["get_token", "get_current_token"])
+
+    @staticmethod
+    def _status_error(status_code, detail=None):
+        """根据 HTTP 状态码返回对应的异常，其他状态码返回 None"""
+        if status_code == 504:
+            err_msg = "请求超时，请稍后重试或减少查询条数"
+            return ServerError(err_msg)
+        elif status_code == 500:
+            err_msg = "服务器内部错误，请稍后再试，错误信息：{}".format(detail)
+            return ServerError(err_msg)
+        elif status_code == 429:
+            err_msg = "请求频率过高，请稍后再试"
+            return JQDataError(err_msg)
+        return None
+
+    def _check_error(self, resp_data):
+        """检查返回内容是否为错误信息，是则抛出对应的异常"""
+        if resp_data.startswith("error:"):
+            err_msg = resp_data.replace("error:", "").strip()
+            if re.search(self._INVALID_TOKEN_PATTERN, err_msg):
+                raise InvalidTokenError(err_msg)
+            else:
+                raise JQDataError(err_msg)
+
+    @property
+    def last_transfer(self):
+        """当前线程最近一次请求的传输信息
+
+        返回 TransferInfo(method, content_encoding, raw_size, size)，
+        raw_size 为实际传输的（压缩的）字节数，size 为解压后的字节数；
+        流式读取的请求在响应读取完毕后才会更新
+        """
+        return getattr(self._transfer_local, "info", None)
+
+    def _record_transfer(self, method, content_encoding, raw_size, size,
+                         started=None):
+        info = TransferInfo(method, content_encoding, raw_size, size)
+        self._transfer_local.info = info
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.add(method, "response_bytes", size)
+            metrics.add(method, "raw_response_bytes", raw_size)
+            if started is not None:
+                metrics.observe(method, "latency", time.time() - started)
+        logger.debug(
+            "%s transferred %d bytes (%s), %d bytes decompressed",
+            method, info.raw_size, info.content_encoding or "identity",
+            info.size,
+        )
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def enable_metrics(self):
+        """开启调用指标的统计（默认开启），已开启时保留已有的统计结果"""
+        if self._metrics is None:
+            self._metrics = _Metrics()
+        return self._metrics
+
+    def disable_metrics(self):
+        """关闭调用指标的统计，并清除已有的统计结果"""
+        self._metrics = None
+
+    def stats(self):
+        """各接口的调用指标，格式见 _Metrics.stats，未开启统计时返回空字典"""
+        metrics = self._metrics
+        return metrics.stats() if metrics is not None else {}
+
+    def _record_metric(self, method, name, value=1):
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.add(method, name, value)
+
+    def _observe_metric(self, method, name, value):
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.observe(method, name, value)
+
+    def _set_metrics_context(self, method):
+        """当前线程中接下来一次 CSV 解析的耗时计入 method 接口"""
+        metrics = self._metrics
+        _metrics_local.current = (metrics, method) if metrics is not None else None
+
+    def add_metrics_exporter(self, exporter, interval=60):
+        """添加调用指标的导出函数
+
+        每隔 interval 秒在后台线程中调用 exporter(stats)，stats 为 stats() 的结果，
+        可以在其中写入日志或推送到监控系统。interval 为 None 时只在调用
+        export_metrics 时导出。同一个 exporter 重复添加时替换之前的设置
+        """
+        self.remove_metrics_exporter(exporter)
+        stop_event = threading.Event()
+        thread = None
+        if interval is not None:
+            thread = threading.Thread(
+                target=self._run_metrics_exporter,
+                args=(exporter, interval, stop_event),
+                name="jqdatahttp-metrics-exporter",
+            )
+            thread.daemon = True
+        self._metrics_exporters[exporter] = (thread, stop_event)
+        if thread is not None:
+            thread.start()
+        return exporter
+
+    def remove_metrics_exporter(self, exporter):
+        """移除调用指标的导出函数"""
+        item = self._metrics_exporters.pop(exporter, None)
+        if item is not None:
+            item[1].set()
+
+    def _call_exporter(self, exporter):
+        try:
+            exporter(self.stats())
+        except Exception:
+            logger.exception("export metrics error")
+
+    def _run_metrics_exporter(self, exporter, interval, stop_event):
+        while not stop_event.wait(interval):
+            self._call_exporter(exporter)
+
+    def export_metrics(self):
+        """立即调用所有的导出函数"""
+        for exporter in list(self._metrics_exporters):
+            self._call_exporter(exporter)
+
+    def _request_headers(self):
+        if self.compress:
+            return {"Accept-Encoding": "gzip, deflate"}
+        return {}
+
+    @staticmethod
+    def _serialize_value(value):
+        if isinstance(value, (int, float, str, bool)) or value is None:
+            return value
+        elif isinstance(value, (tuple, list, set)):
+            return ",".join(value)
+        if isinstance(value, datetime.date):
+            return str(value)
+        elif isinstance(value, datetime.datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            return str(value)
+
+    def _prepare_request(self, kwargs):
+        """从接口参数中分离出请求选项，返回 (序列化后的请求参数, 请求选项)"""
+        show_request_params = kwargs.pop("show_request_params", False)
+        options = dict(
+            request_timeout=kwargs.pop("request_timeout", self.timeout),
+            request_attempt_count=kwargs.pop("request_attempt_count", 3),
+            show_request_body=(show_request_params or self.show_request_params)
+        )
+        params = {
+            key: self._serialize_value(val)
+            for key, val in kwargs.items() if val is not None
+        }
+        return params, options
+
+    def enable_cache(self, cache_dir=None, max_size=1 << 30):
+        """开启历史数据的磁盘缓存
+
+        只有查询的日期范围早于今天（数据不会再变化）的请求才会被缓存，
+        参数说明见 _DiskCache
+        """
+        self._cache = _DiskCache(cache_dir=cache_dir, max_size=max_size)
+        return self._cache
+
+    def disable_cache(self):
+        """关闭磁盘缓存，已缓存的数据不会被删除"""
+        self._cache = None
+
+    @property
+    def memory_cache(self):
+        return self._memory_cache
+
+    def enable_memory_cache(self, policies=None, max_stale=None):
+        """开启元数据类接口的内存缓存
+
+        policies 为 {接口名: (缓存时间（秒）, 最多缓存的条数)}，与默认的策略合并，
+        缓存时间为 0 时不缓存该接口。结果过期后的 max_stale 秒内（默认为缓存时间）
+        直接返回过期的结果，同时在后台刷新，参数说明见 _MemoryCache
+        """
+        merged_policies = dict(_MEMORY_CACHE_POLICIES)
+        merged_policies.update(policies or {})
+        self._memory_cache = _MemoryCache(merged_policies, max_stale=max_stale)
+        return self._memory_cache
+
+    def disable_memory_cache(self):
+        """关闭内存缓存"""
+        self._memory_cache = None
+
+    def _get_memory_cached(self, method, params):
+        """读取内存缓存，返回 (缓存键, 结果, 是否已过期)，接口不可缓存时缓存键为 None"""
+        memory_cache = self._memory_cache
+        if memory_cache is None or not memory_cache.is_cacheable(method):
+            return None, None, False
+        key = self._request_key(method, params)
+        value, is_stale = memory_cache.get(method, key)
+        return key, value, is_stale
+
+    def enable_rate_limit(self, rate=10, burst=None, path=None, shared=True):
+        """开启客户端限流，请求超过限制的频率时排队等待
+
+        参数：
+            rate: 每秒允许的请求数
+            burst: 允许的突发请求数，默认与 rate 相同
+            path: 限流状态文件的路径，默认为 ~/.cache/jqdatahttp 目录下
+                以账号区分的文件
+            shared: 是否与同一主机上的其他进程共享限流状态，为 False 时只在
+                当前进程内的线程间共享
+        """
+        if shared and not path:
+            name = hashlib.sha1(
+                (self.username or "").encode("utf-8")
+            ).hexdigest()[:16]
+            path = os.path.join(
+                os.path.expanduser("~"), ".cache", "jqdatahttp",
+                "ratelimit-{}".format(name)
+            )
+        self._rate_limiter = _RateLimiter(
+            rate, burst=burst, path=(path if shared else None)
+        )
+        return self._rate_limiter
+
+    def disable_rate_limit(self):
+        self._rate_limiter = None
+
+    def enable_token_store(self, path=None, ttl=12 * 3600):
+        """开启多进程共享的 token 存储，参数说明见 _TokenStore"""
+        self._token_store = _TokenStore(path=path, ttl=ttl)
+        return self._token_store
+
+    def disable_token_store(self):
+        self._token_store = None
+
+    def _load_stored_token(self, username=None, password=None):
+        """认证时优先使用 token 存储中其他进程已获取的 token"""
+        if self._token_store is None:
+            return None
+        if username:
+            self._username = username
+        if password:
+            self._password = password
+        return self._use_stored_token()
+
+    def _use_stored_token(self, stale_token=None):
+        """使用 token 存储中与 stale_token 不同的 token，没有时返回 None"""
+        token, expire_at = self._token_store.load_entry(self.username)
+        if not token or token == stale_token:
+            return None
+        self._auto_token = token
+        self._token_expire_at = expire_at
+        return token
+
+    def _set_auto_token(self, token):
+        self._auto_token = token
+        if self._token_store is not None:
+            self._token_store.save(self.username, token)
+            self._token_expire_at = time.time() + self._token_store.ttl
+        else:
+            self._token_expire_at = time.time() + self.token_ttl
+
+    def _get_cache_key(self, method, params):
+        """返回请求对应的缓存键，请求不可缓存时返回 None"""
+        if self._cache is None or not _is_cacheable_request(method, params):
+            return None
+        return self._cache.make_key(self.url, method, params)
+
+    @staticmethod
+    def _request_key(method, params):
+        """用于合并并发请求的键，由不含 token 的请求内容确定"""
+        return json.dumps([method, params], sort_keys=True, default=str)
+
+    def _set_cache(self, cache_key, data):
+        # 只有表头或者为空的结果可能是数据还未更新，不缓存
+        if cache_key is not None and data.strip().count("\n") > 0:
+            self._cache.set(cache_key, data)
+
+    def set_token(self, token):
+        self._external_token = token
+
+    def close(self):
+        """关闭连接池中的所有空闲连接"""
+        if self._pool is not None:
+            self._pool.clear()
+
+    def logout(self):
+        self._username = None
+        self._password = None
+        self._external_token = None
+        self._auto_token = None
+        self._token_expire_at = None
+        self.close()
+
+    def set_url(self, url):
+        self._url = url
+        return self  # 支持链式调用
+
+    @staticmethod
+    def _format_result(name, data, output_format="pandas"):
+        """将原生接口返回的内容格式化为 pandas.DataFrame 或者 list 等结构
+
+        output_format 为 arrow 或 polars 时，CSV 数据解析为 pyarrow.Table
+        或者 polars.DataFrame
+        """
+        if name in {"get_query_count"}:
+            data = int(data)
+        elif name in {"get_fund_info"}:
+            data = json.loads(data)
+        elif name in {
+            "get_index_stocks",
+            "get_margincash_stocks",
+            "get_marginsec_stocks",
+            "get_industry_stocks",
+            "get_concept_stocks",
+            "get_trade_days",
+            "get_all_trade_days",
+        }:
+            data = data.split()
+        else:
+            data = _csv2table(data, output_format=output_format)
+        return data
+
+
+class JQDataApi(_BaseJQDataApi):
+
+    def __init__(self, username=None, password=None, url=None, token=None,
+                 timeout=20, keep_alive=True, pool_size=10,
+                 pool_idle_timeout=60, pool_prewarm=2):
+        super(JQDataApi, self).__init__(
+            username=username, password=password, url=url, token=token,
+            timeout=timeout, pool_prewarm=pool_prewarm,
+        )
+
+        # HTTP 长连接池，keep_alive 为 False 时每次请求都新建连接
+        if keep_alive:
+            self._pool = _ConnectionPool(
+                maxsize=pool_size, idle_timeout=pool_idle_timeout
+            )
+
+        # 多标的查询时的默认并发请求数，为 1 时逐个标的顺序请求
+        self.max_workers = 1
+
+        # 流式读取响应时每次读取的字节数
+        self.stream_chunk_size = 1 << 18
 
-    @property
-    def url(self):
-        if self._url:
-            return self._url
-        url_from_env = os.getenv("JQDATA_URL")
-        if url_from_env:
-            if url_from_env.upper() == "v1":
-                return self._V1_URL
-            elif url_from_env.upper() == "v2":
-                return self._V2_URL
-            else:
-                return url_from_env
-        else:
-            return self._DEFAULT_URL
+        # 进行中的请求，用于合并相同的并发请求
+        self._inflight = _SingleFlight()
 
-    @url.setter
-    def url(self, value):
-        if value.lower() == "v1":
-            value = self._V1_URL
-        elif value.lower() == "v2":
-            value = self._V2_URL
-        self._url = value
+        # 刷新 token 时持有的锁，以及 token 的后台刷新线程
+        self._token_lock = threading.RLock()
+        self._token_refresher = None
 
-    @property
-    def token(self):
-        external_token = self._external_token or os.getenv("JQDATA_TOKEN")
-        if external_token:
-            return external_token
-        return self._auto_token
+    def _request(self, data, **options):
+        """发送请求，统计重试后仍然出错的调用数"""
+        method = data.get("method")
+        try:
+            return self._send_request(data, **options)
+        except Exception:
+            self._record_metric(method, "errors")
+            raise
 
-    def _request(self, data, request_timeout=None, request_attempt_count=3,
-                 show_request_body=False):
+    def _send_request(self, data, request_timeout=None,
+                      request_attempt_count=3, show_request_body=False,
+                      stream=False):
         req_body = json.dumps(data, default=str)
         if request_timeout is None:
             request_timeout = self.timeout
@@ -174,186 +1826,822 @@ class JQDataApi(object):
             print("start show request body", "-" * 20)
             print(req_body)
             print("end show request body", "-" * 20)
+        method = data.get("method")
         data = req_body.encode(self._encoding)
-        req = HTTPRequest(self.url, data=data, method="POST")
+        url = self.url
+        headers = self._request_headers()
+        if self._pool is not None:
+            open_url = functools.partial(
+                self._pool.urlopen, url, data=data, headers=headers,
+                timeout=request_timeout,
+            )
+        else:
+            req = HTTPRequest(url, data=data, headers=headers, method="POST")
+            open_url = functools.partial(urlopen, req, timeout=request_timeout)
         for request_count in range(request_attempt_count):
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire()
+            # 每次请求单独计时，不包括限流等待与重试间隔
+            self._record_metric(method, "requests")
+            self._record_metric(method, "request_bytes", len(data))
+            started = time.time()
             try:
-                resp = urlopen(req, timeout=request_timeout)
+                resp = open_url()
                 break
             except (URLError, HTTPError, socket.error) as ex:
                 status_code = getattr(ex, "code", 0)
-                if status_code == 504:
-                    err_msg = "请求超时，请稍后重试或减少查询条数"
-                    raise JQDataError(err_msg)
-                elif status_code == 500:
-                    err_msg = "服务器内部错误，请稍后再试，错误信息：{}".format(ex)
-                    raise JQDataError(err_msg)
-                elif status_code == 429:
-                    err_msg = "请求频率过高，请稍后再试"
-                    raise JQDataError(err_msg)
+                # 开启限流时，请求频率过高的请求等待后重试
+                if (status_code == 429 and self._rate_limiter is not None and
+                        request_count < request_attempt_count - 1):
+                    logger.debug('request %r error: %s', url, ex)
+                    self._record_metric(method, "retries")
+                    time.sleep(1 + request_count)
+                    continue
+                status_error = self._status_error(status_code, ex)
+                if status_error is not None:
+                    raise status_error
                 elif 400 <= status_code < 500:
                     try:
-                        resp_body = ex.read()
+                        resp_body = _decompress_body(
+                            ex.read(), ex.headers.get("Content-Encoding")
+                        )
                     except Exception:
                         raise ex
                     if not resp_body:
                         raise
                     resp_data = resp_body.decode(self._encoding)
-                    if resp_data.startswith("error:"):
-                        err_msg = resp_data.replace("error:", "").strip()
-                        if re.search(self._INVALID_TOKEN_PATTERN, err_msg):
-                            raise InvalidTokenError(err_msg)
-                        else:
-                            raise JQDataError(err_msg)
-                    else:
-                        raise JQDataError(resp_data[:100])
+                    self._check_error(resp_data)
+                    raise JQDataError(resp_data[:100])
                 else:
                     if request_count < request_attempt_count - 1:
-                        logger.debug('request %r error: %s', self.url, ex)
+                        logger.debug('request %r error: %s', url, ex)
+                        self._record_metric(method, "retries")
                         time.sleep(0.5)
                         continue
                     else:
                         raise
+        self._observe_metric(method, "wait", time.time() - started)
+        try:
+            resp = _DecompressingResponse(resp)
+        except HTTPException:
+            resp.close()
+            raise
+        if stream:
+            return self._stream_response(resp, method, started)
         with resp:
             resp_body = resp.read()
+            self._record_transfer(
+                method, resp.content_encoding, resp.raw_size, resp.size,
+                started,
+            )
             resp_data = resp_body.decode(self._encoding)
-            if resp_data.startswith("error:"):
-                err_msg = resp_data.replace("error:", "").strip()
-                if re.search(self._INVALID_TOKEN_PATTERN, err_msg):
-                    raise InvalidTokenError(err_msg)
-                else:
-                    raise JQDataError(err_msg)
+            self._check_error(resp_data)
             if resp.status != 200:
                 raise JQDataError(resp_data[:100])
         return resp_data
 
-    def __serialize_value(self, value):
-        if isinstance(value, (int, float, str, bool)) or value is None:
-            return value
-        elif isinstance(value, (tuple, list, set)):
-            return ",".join(value)
-        if isinstance(value, datetime.date):
-            return str(value)
-        elif isinstance(value, datetime.datetime):
-            return value.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            return str(value)
+    def _stream_response(self, resp, method=None, started=None):
+        """流式读取响应内容，返回逐块产出文本的迭代器
+
+        先读取第一块并检查是否为错误信息，错误在返回之前就会抛出，
+        之后每次产出的文本都以完整的行结尾。读取过程中出错时计入出错的请求数
+        """
+        decoder = codecs.getincrementaldecoder(self._encoding)()
+        chunk_size = self.stream_chunk_size
+        try:
+            first_data = decoder.decode(resp.read(chunk_size))
+            if resp.status != 200 or first_data.startswith("error:"):
+                resp_data = first_data + resp.read().decode(self._encoding)
+                self._check_error(resp_data)
+                raise JQDataError(resp_data[:100])
+        except BaseException:
+            resp.close()
+            raise
+
+        def iter_blocks():
+            with resp:
+                pending = first_data
+                while True:
+                    try:
+                        chunk = resp.read(chunk_size)
+                    except Exception:
+                        self._record_metric(method, "errors")
+                        raise
+                    if not chunk:
+                        break
+                    pending += decoder.decode(chunk)
+                    idx = pending.rfind("\n")
+                    if idx >= 0:
+                        # 调用方接下来解析这一块的耗时计入该接口
+                        self._set_metrics_context(method)
+                        yield pending[:(idx + 1)]
+                        pending = pending[(idx + 1):]
+                pending += decoder.decode(b"", final=True)
+                self._record_transfer(
+                    method, resp.content_encoding, resp.raw_size, resp.size,
+                    started,
+                )
+                if pending:
+                    self._set_metrics_context(method)
+                    yield pending
+
+        return iter_blocks()
+
+    def _iter_and_cache(self, cache_key, blocks):
+        """产出流式响应的同时收集完整内容，读取完毕后写入缓存"""
+        data = []
+        for block in blocks:
+            data.append(block)
+            yield block
+        self._set_cache(cache_key, "".join(data))
 
     def _request_data(self, method, **kwargs):
+        stream = kwargs.pop("stream", False)
+        self._record_metric(method, "calls")
+        params, options = self._prepare_request(kwargs)
+        if not stream:
+            memory_key, resp_data, is_stale = self._get_memory_cached(
+                method, params
+            )
+            if is_stale:
+                self._revalidate(memory_key, method, params, options)
+            if resp_data is not None:
+                return resp_data
+        else:
+            memory_key = None
+        cache_key = self._get_cache_key(method, params)
+        if cache_key is not None:
+            resp_data = self._cache.get(cache_key)
+            if resp_data is not None:
+                return iter([resp_data]) if stream else resp_data
+        if stream:
+            # 流式响应只能被读取一次，不能合并
+            options["stream"] = True
+            resp_data = self._fetch_data(method, params, options)
+            if cache_key is not None:
+                return self._iter_and_cache(cache_key, resp_data)
+            return resp_data
+        fetch = functools.partial(self._fetch_data, method, params, options)
+        if self.coalesce_requests:
+            resp_data = self._inflight.do(
+                self._request_key(method, params), fetch
+            )
+        else:
+            resp_data = fetch()
+        self._set_cache(cache_key, resp_data)
+        if memory_key is not None:
+            self._memory_cache.set(method, memory_key, resp_data)
+        return resp_data
+
+    def _revalidate(self, memory_key, method, params, options):
+        """在后台线程中刷新内存缓存中已过期的结果"""
+        memory_cache = self._memory_cache
+        if not memory_cache.start_refresh(memory_key):
+            return
+
+        def refresh():
+            try:
+                resp_data = self._inflight.do(
+                    memory_key,
+                    functools.partial(self._fetch_data, method, params, options)
+                )
+                memory_cache.set(method, memory_key, resp_data)
+            except Exception as ex:
+                logger.debug("revalidate %s error: %s", method, ex)
+            finally:
+                memory_cache.finish_refresh(memory_key)
+
+        thread = threading.Thread(target=refresh, name="jqdatahttp-revalidate")
+        thread.daemon = True
+        thread.start()
+
+    def _fetch_data(self, method, params, options):
+        """发送请求，token 失效时自动刷新后重试"""
         req_data = {"method": method}
-        if method not in {"get_token", "get_current_token"}:
+        if method not in self._AUTH_METHODS:
             if not self.token:
-                self.get_current_token()
+                self._record_metric(method, "token_refreshes")
+                self._refresh_token()
             req_data["token"] = self.token
-        show_request_params = kwargs.pop("show_request_params", False)
-        request_timeout = kwargs.pop("request_timeout", self.timeout)
-        request_attempt_count = kwargs.pop("request_attempt_count", 3)
-        request = functools.partial(
-            self._request,
-            request_timeout=request_timeout,
-            request_attempt_count=request_attempt_count,
-            show_request_body=(show_request_params or self.show_request_params)
-        )
-        req_data.update({
-            key: self.__serialize_value(val)
-            for key, val in kwargs.items() if val is not None
-        })
+        request = functools.partial(self._request, **options)
+        req_data.update(params)
         try:
-            resp_data = request(req_data)
+            return request(req_data)
         except InvalidTokenError:
             if not self._external_token:
-                req_data["token"] = self.get_current_token()
-                resp_data = request(req_data)
-            else:
-                raise
-        return resp_data
+                self._record_metric(method, "token_refreshes")
+                req_data["token"] = self._refresh_token(req_data["token"])
+                return request(req_data)
+            raise
+
+    def _request_new_token(self):
+        return self._request_data(
+            "get_token", mob=self.username, pwd=self.password,
+            request_timeout=5, request_attempt_count=10,
+        )
 
     def get_token(self, mob=None, pwd=None):
         if mob:
             self._username = mob
         if pwd:
             self._password = pwd
-        data = self._request_data(
-            "get_token", mob=self.username, pwd=self.password,
+        data = self._request_new_token()
+        self._set_auto_token(data)
+        return data
+
+    def _request_current_token(self):
+        return self._request_data(
+            "get_current_token", mob=self.username, pwd=self.password,
             request_timeout=5, request_attempt_count=10,
         )
-        self._auto_token = data
-        return data
 
     def get_current_token(self, mob=None, pwd=None):
         if mob:
             self._username = mob
         if pwd:
             self._password = pwd
-        data = self._request_data(
-            "get_current_token", mob=self.username, pwd=self.password,
-            request_timeout=5, request_attempt_count=10,
-        )
-        self._auto_token = data
+        data = self._request_current_token()
+        self._set_auto_token(data)
         return data
 
-    def set_token(self, token):
-        self._external_token = token
+    def _refresh_token(self, stale_token=None, renew=False):
+        """刷新自动获取的 token
+
+        刷新时持有锁，等待锁的过程中如果 token 已被其他线程刷新（与 stale_token
+        不同），则直接使用新的 token，因此并发的刷新只会实际请求一次。
+        renew 为 True 时获取新的 token（旧的 token 随之失效），否则获取当前可用的
+        token。开启 token 存储时，优先使用其他进程已经刷新过的 token
+        """
+        if renew:
+            fetch = self._request_new_token
+        else:
+            fetch = self._request_current_token
+        with self._token_lock:
+            if self._auto_token and self._auto_token != stale_token:
+                return self._auto_token
+            if self._token_store is None:
+                token = fetch()
+                self._set_auto_token(token)
+                return token
+            token = self._token_store.refresh(self.username, stale_token, fetch)
+            self._auto_token = token
+            self._token_expire_at = self._token_store.load_entry(self.username)[1]
+            return token
+
+    def enable_token_auto_refresh(self, margin=600):
+        """开启 token 的后台刷新
+
+        后台线程在自动获取的 token 估计过期前 margin 秒获取新的 token，
+        使接口调用不会因为 token 过期而多一次失败的请求。token 的过期时间由
+        token_ttl（开启 token 存储时为存储的 ttl）估计，外部设置的 token 不会被刷新
+        """
+        self.disable_token_auto_refresh()
+        stop_event = threading.Event()
+        thread = threading.Thread(
+            target=self._auto_refresh_token, args=(stop_event, margin),
+            name="jqdatahttp-token-refresh",
+        )
+        thread.daemon = True
+        self._token_refresher = (thread, stop_event)
+        thread.start()
+        return thread
+
+    def disable_token_auto_refresh(self):
+        """关闭 token 的后台刷新"""
+        refresher, self._token_refresher = self._token_refresher, None
+        if refresher is not None:
+            refresher[1].set()
+
+    def _auto_refresh_token(self, stop_event, margin):
+        while True:
+            expire_at = self._token_expire_at
+            if expire_at is None or self._external_token or not self.username:
+                # 还没有自动获取的 token，定期检查
+                wait = 60
+            else:
+                wait = expire_at - margin - time.time()
+            if wait > 0:
+                if stop_event.wait(wait):
+                    return
+                continue
+            try:
+                self._refresh_token(self._auto_token, renew=True)
+                logger.debug("token refreshed in background")
+            except Exception as ex:
+                logger.warning("refresh token in background error: %s", ex)
+                if stop_event.wait(60):
+                    return
 
     def reset_token(self):
         self._external_token = None
         return self.get_token()
 
+    def logout(self):
+        self.disable_token_auto_refresh()
+        super(JQDataApi, self).logout()
+
     def auth(self, username=None, password=None, url=None):
         if url:
             self._url = url
-        self.get_current_token(mob=username, pwd=password)
+        if self._load_stored_token(username, password) is None:
+            self.get_current_token(mob=username, pwd=password)
+        self.prewarm()
+
+    def prewarm(self, count=None):
+        """预先建立与服务器的长连接，未开启长连接时不做任何处理"""
+        if self._pool is None:
+            return
+        if count is None:
+            count = self.pool_prewarm
+        if count:
+            self._pool.prewarm(self.url, count, timeout=self.timeout)
+
+    def batch(self, max_workers=4, progress=None, executor=None):
+        """创建批量执行接口调用的 ApiBatch，参数说明见 ApiBatch"""
+        return ApiBatch(
+            self, max_workers=max_workers, progress=progress, executor=executor
+        )
 
-    def logout(self):
-        self._username = None
-        self._password = None
-        self._external_token = None
-        self._auto_token = None
+    @staticmethod
+    def _make_api_method(name):
+        """创建调用 name 接口的方法"""
+
+        def method(self, **kwargs):
+            show_raw_result = kwargs.pop("show_raw_result", False)
+            auto_format_result = kwargs.pop("auto_format_result", False)
+            output_format = kwargs.pop("output_format", None)
+            data = self._request_data(name, **kwargs)
+            self._set_metrics_context(name)
+            if kwargs.get("stream"):
+                return data
+            if show_raw_result or self.show_raw_result:
+                print("start show raw result", "-" * 20)
+                print(data)
+                print("end show raw result", "-" * 20)
+            if not auto_format_result and not self.auto_format_result:
+                return data
+            return self._format_result(
+                name, data, output_format or self.output_format
+            )
 
-    def set_url(self, url):
-        self._url = url
-        return self  # 支持链式调用
+        method.__name__ = name
+        return method
 
     def __getattr__(self, name):
-        if name.startswith("get_") or name == "run_query":
-
-            def wrapper(self, **kwargs):
-                show_raw_result = kwargs.pop("show_raw_result", False)
-                auto_format_result = kwargs.pop("auto_format_result", False)
-                data = self._request_data(name, **kwargs)
-                if show_raw_result or self.show_raw_result:
-                    print("start show raw result", "-" * 20)
-                    print(data)
-                    print("end show raw result", "-" * 20)
-                if not auto_format_result and not self.auto_format_result:
-                    return data
-
-                if name in {"get_query_count"}:
-                    data = int(data)
-                elif name in {"get_fund_info"}:
-                    data = json.loads(data)
-                elif name in {
-                    "get_index_stocks",
-                    "get_margincash_stocks",
-                    "get_marginsec_stocks",
-                    "get_industry_stocks",
-                    "get_concept_stocks",
-                    "get_trade_days",
-                    "get_all_trade_days",
-                }:
-                    data = data.split()
+        return _get_api_method(self, name)
+
+
+class AsyncJQDataApi(_BaseJQDataApi):
+    """asyncio 版接口
+
+    与 JQDataApi 的用法一致，但所有的接口方法都是协程，需要 await 调用：
+
+        api = AsyncJQDataApi()
+        await api.auth(username, password)
+        data = await api.get_security_info(code='000001.XSHE')
+
+    max_concurrency 用于限制同时进行中的请求数，因此可以使用 asyncio.gather
+    一次提交大量的请求。实例只能在同一个事件循环中使用，切换事件循环后，
+    会丢弃旧循环中建立的连接
+    """
+
+    def __init__(self, username=None, password=None, url=None, token=None,
+                 timeout=20, pool_size=10, pool_idle_timeout=60,
+                 pool_prewarm=2, max_concurrency=20):
+        super(AsyncJQDataApi, self).__init__(
+            username=username, password=password, url=url, token=token,
+            timeout=timeout, pool_prewarm=pool_prewarm,
+        )
+        self._pool = _AsyncConnectionPool(
+            maxsize=pool_size, idle_timeout=pool_idle_timeout
+        )
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._semaphore = None
+        self._token_lock = None
+        self._inflight = None
+        # 后台刷新缓存的任务，保存引用以免任务在完成前被回收
+        self._background_tasks = set()
+
+    def _check_loop(self):
+        loop = asyncio.get_event_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._token_lock = asyncio.Lock()
+            self._inflight = _AsyncSingleFlight()
+            self._pool.reset()
+
+    async def _request(self, data, **options):
+        """发送请求，统计重试后仍然出错的调用数"""
+        method = data.get("method")
+        try:
+            return await self._send_request(data, **options)
+        except Exception:
+            self._record_metric(method, "errors")
+            raise
+
+    async def _send_request(self, data, request_timeout=None,
+                            request_attempt_count=3, show_request_body=False):
+        self._check_loop()
+        req_body = json.dumps(data, default=str)
+        if request_timeout is None:
+            request_timeout = self.timeout
+        if show_request_body:
+            print("start show request body", "-" * 20)
+            print(req_body)
+            print("end show request body", "-" * 20)
+        method = data.get("method")
+        data = req_body.encode(self._encoding)
+        url = self.url
+        headers = self._request_headers()
+        async with self._semaphore:
+            for request_count in range(request_attempt_count):
+                while self._rate_limiter is not None:
+                    # 取令牌要加锁并读写限速文件，放到线程池中执行，不阻塞事件循环
+                    wait = await self._loop.run_in_executor(
+                        None, self._rate_limiter.try_acquire
+                    )
+                    if not wait:
+                        break
+                    await asyncio.sleep(wait)
+                self._record_metric(method, "requests")
+                self._record_metric(method, "request_bytes", len(data))
+                started = time.time()
+                try:
+                    resp = await asyncio.wait_for(
+                        self._pool.urlopen(url, data=data, headers=headers),
+                        request_timeout
+                    )
+                except (OSError, asyncio.TimeoutError,
+                        asyncio.IncompleteReadError, HTTPException) as ex:
+                    if request_count < request_attempt_count - 1:
+                        logger.debug('request %r error: %s', url, ex)
+                        self._record_metric(method, "retries")
+                        await asyncio.sleep(0.5)
+                        continue
+                    raise
+                self._observe_metric(method, "wait", time.time() - started)
+                resp.body = self._decompress_response(method, resp, started)
+                if resp.status < 400:
+                    break
+                http_error = HTTPError(url, resp.status, resp.reason,
+                                       resp.headers, BytesIO(resp.body))
+                if (resp.status == 429 and self._rate_limiter is not None and
+                        request_count < request_attempt_count - 1):
+                    logger.debug('request %r error: %s', url, http_error)
+                    self._record_metric(method, "retries")
+                    await asyncio.sleep(1 + request_count)
+                    continue
+                status_error = self._status_error(resp.status, http_error)
+                if status_error is not None:
+                    raise status_error
+                elif 400 <= resp.status < 500:
+                    if not resp.body:
+                        raise http_error
+                    resp_data = resp.body.decode(self._encoding)
+                    self._check_error(resp_data)
+                    raise JQDataError(resp_data[:100])
+                elif request_count < request_attempt_count - 1:
+                    logger.debug('request %r error: %s', url, http_error)
+                    self._record_metric(method, "retries")
+                    await asyncio.sleep(0.5)
                 else:
-                    data = _csv2df(data)
+                    raise http_error
+        resp_data = resp.body.decode(self._encoding)
+        self._check_error(resp_data)
+        if resp.status != 200:
+            raise JQDataError(resp_data[:100])
+        return resp_data
+
+    def _decompress_response(self, method, resp, started=None):
+        """解压完整读取的响应内容，并记录传输的字节数"""
+        content_encoding = resp.getheader("Content-Encoding")
+        body = _decompress_body(resp.body, content_encoding)
+        self._record_transfer(
+            method, content_encoding, len(resp.body), len(body), started
+        )
+        return body
+
+    async def _refresh_token(self, stale_token=None):
+        """刷新 token，并发的刷新只会实际请求一次"""
+        self._check_loop()
+        async with self._token_lock:
+            if self._auto_token and self._auto_token != stale_token:
+                return self._auto_token
+            if self._token_store is not None:
+                token = self._use_stored_token(stale_token)
+                if token is not None:
+                    return token
+            return await self.get_current_token()
+
+    async def _request_data(self, method, **kwargs):
+        self._record_metric(method, "calls")
+        params, options = self._prepare_request(kwargs)
+        memory_key, resp_data, is_stale = self._get_memory_cached(
+            method, params
+        )
+        if is_stale:
+            self._revalidate(memory_key, method, params, options)
+        if resp_data is not None:
+            return resp_data
+        cache_key = self._get_cache_key(method, params)
+        if cache_key is not None:
+            resp_data = self._cache.get(cache_key)
+            if resp_data is not None:
+                return resp_data
+        fetch = functools.partial(self._fetch_data, method, params, options)
+        if self.coalesce_requests:
+            self._check_loop()
+            resp_data = await self._inflight.do(
+                self._request_key(method, params), fetch
+            )
+        else:
+            resp_data = await fetch()
+        self._set_cache(cache_key, resp_data)
+        if memory_key is not None:
+            self._memory_cache.set(method, memory_key, resp_data)
+        return resp_data
+
+    def _revalidate(self, memory_key, method, params, options):
+        """在事件循环中创建任务，刷新内存缓存中已过期的结果"""
+        memory_cache = self._memory_cache
+        if not memory_cache.start_refresh(memory_key):
+            return
+
+        async def refresh():
+            try:
+                resp_data = await self._fetch_data(method, params, options)
+                memory_cache.set(method, memory_key, resp_data)
+            except Exception as ex:
+                logger.debug("revalidate %s error: %s", method, ex)
+            finally:
+                memory_cache.finish_refresh(memory_key)
+                self._background_tasks.discard(task)
+
+        task = asyncio.ensure_future(refresh())
+        self._background_tasks.add(task)
+
+    async def _fetch_data(self, method, params, options):
+        """发送请求，token 失效时自动刷新后重试"""
+        req_data = {"method": method}
+        if method not in self._AUTH_METHODS:
+            if not self.token:
+                self._record_metric(method, "token_refreshes")
+                await self._refresh_token()
+            req_data["token"] = self.token
+        req_data.update(params)
+        try:
+            return await self._request(req_data, **options)
+        except InvalidTokenError:
+            if not self._external_token:
+                self._record_metric(method, "token_refreshes")
+                req_data["token"] = await self._refresh_token(
+                    req_data["token"]
+                )
+                return await self._request(req_data, **options)
+            raise
+
+    async def get_token(self, mob=None, pwd=None):
+        if mob:
+            self._username = mob
+        if pwd:
+            self._password = pwd
+        data = await self._request_data(
+            "get_token", mob=self.username, pwd=self.password,
+            request_timeout=5, request_attempt_count=10,
+        )
+        self._set_auto_token(data)
+        return data
+
+    async def get_current_token(self, mob=None, pwd=None):
+        if mob:
+            self._username = mob
+        if pwd:
+            self._password = pwd
+        data = await self._request_data(
+            "get_current_token", mob=self.username, pwd=self.password,
+            request_timeout=5, request_attempt_count=10,
+        )
+        self._set_auto_token(data)
+        return data
+
+    async def reset_token(self):
+        self._external_token = None
+        return await self.get_token()
+
+    async def auth(self, username=None, password=None, url=None):
+        if url:
+            self._url = url
+        if self._load_stored_token(username, password) is None:
+            await self.get_current_token(mob=username, pwd=password)
+        await self.prewarm()
+
+    async def prewarm(self, count=None):
+        """预先建立与服务器的长连接"""
+        self._check_loop()
+        if count is None:
+            count = self.pool_prewarm
+        if count:
+            await self._pool.prewarm(self.url, count)
+
+    @staticmethod
+    def _make_api_method(name):
+        """创建调用 name 接口的协程方法"""
+
+        async def method(self, **kwargs):
+            show_raw_result = kwargs.pop("show_raw_result", False)
+            auto_format_result = kwargs.pop("auto_format_result", False)
+            output_format = kwargs.pop("output_format", None)
+            data = await self._request_data(name, **kwargs)
+            self._set_metrics_context(name)
+            if show_raw_result or self.show_raw_result:
+                print("start show raw result", "-" * 20)
+                print(data)
+                print("end show raw result", "-" * 20)
+            if not auto_format_result and not self.auto_format_result:
                 return data
+            return self._format_result(
+                name, data, output_format or self.output_format
+            )
+
+        method.__name__ = name
+        return method
+
+    def __getattr__(self, name):
+        return _get_api_method(self, name)
+
+
+def _get_api_method(obj, name):
+    """__getattr__ 的实现：按需创建接口方法并缓存到类上
+
+    之后的访问都是普通的属性查找，不再经过 __getattr__。多个线程同时首次访问时
+    可能重复创建，但创建的方法完全相同，setattr 本身是原子的，因此无需加锁
+    """
+    if not (name.startswith("get_") or name == "run_query"):
+        raise AttributeError("{!r} object has no attribute {!r}".format(
+            type(obj).__name__, name
+        ))
+    cls = type(obj)
+    method = cls._make_api_method(name)
+    setattr(cls, name, method)
+    return method.__get__(obj, cls)
+
+
+class ApiBatch(object):
+    """批量执行接口调用
+
+    提交的调用在线程池中执行，同时进行的调用数不超过 max_workers，
+    每个调用立即返回 concurrent.futures.Future，出错的调用只影响各自的 Future。
+    可以提交接口方法（batch.get_mtss(...) 等同于在线程池中调用
+    api.get_mtss(...)，返回值与直接调用相同），也可以通过 submit 提交任意函数，
+    如 get_extras、get_fundamentals 等兼容接口：
+
+        with api.batch(max_workers=8) as batch:
+            f1 = batch.get_mtss(code="000001.XSHE", date="2021-03-01")
+            f2 = batch.submit(get_fundamentals, "000001.XSHE", "2021q1", "income")
+        f1.result(), f2.result()
 
-            cls = self.__class__
-            wrapper.__name__ = name
-            setattr(cls, name, wrapper)
+    退出 with 语句时等待所有调用完成，with 语句中发生异常时取消还未开始的调用
 
-        return object.__getattribute__(self, name)
+    参数：
+        api: 执行接口方法的 JQDataApi 实例
+        max_workers: 最多同时进行的调用数
+        progress: 每个调用完成（包括出错与取消）后调用 progress(done, total, future)，
+            done 为已完成的调用数，total 为已提交的调用数
+        executor: 执行调用的线程池，指定后忽略 max_workers，且关闭时不会关闭该线程池
+    """
+
+    def __init__(self, api, max_workers=4, progress=None, executor=None):
+        self.api = api
+        self.progress = progress
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="jqdatahttp-batch"
+            )
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._futures = []
+        self._done_count = 0
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.cancel()
+        self.close()
+
+    def __len__(self):
+        return len(self._futures)
+
+    def __getattr__(self, name):
+        method = None
+        if not name.startswith("_") and name not in ("api", "progress"):
+            method = getattr(self.api, name, None)
+        if not callable(method):
+            raise AttributeError("{!r} object has no attribute {!r}".format(
+                type(self).__name__, name
+            ))
+        return functools.partial(self.submit, method)
+
+    @property
+    def futures(self):
+        """按提交顺序排列的所有 Future"""
+        return list(self._futures)
+
+    def submit(self, func, *args, **kwargs):
+        """提交 func(*args, **kwargs)，返回 Future"""
+        with self._lock:
+            if self._closed:
+                raise JQDataError("batch is closed")
+            future = self._executor.submit(func, *args, **kwargs)
+            self._futures.append(future)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        with self._lock:
+            self._done_count += 1
+            done, total = self._done_count, len(self._futures)
+        if self.progress is not None:
+            try:
+                self.progress(done, total, future)
+            except Exception:
+                logger.exception("batch progress callback error")
+
+    def cancel(self):
+        """取消所有还未开始的调用，返回取消的数量"""
+        return sum(future.cancel() for future in self.futures)
+
+    def wait(self, timeout=None):
+        """等待所有调用完成，返回 (已完成的 Future 集合, 未完成的 Future 集合)"""
+        return concurrent.futures.wait(self.futures, timeout=timeout)
+
+    def results(self, return_exceptions=True):
+        """等待所有调用完成，按提交顺序返回结果
+
+        return_exceptions 为 True 时，出错的调用对应的值为其异常
+        （取消的调用为 CancelledError），否则遇到第一个出错的调用时抛出异常
+        """
+        results = []
+        for future in self.futures:
+            try:
+                results.append(future.result())
+            except BaseException as ex:
+                if not return_exceptions or not isinstance(
+                    ex, (Exception, concurrent.futures.CancelledError)
+                ):
+                    raise
+                results.append(ex)
+        return results
+
+    def errors(self):
+        """等待所有调用完成，返回 {提交序号: 异常}，不包括取消的调用"""
+        self.wait()
+        return {
+            idx: future.exception()
+            for idx, future in enumerate(self.futures)
+            if not future.cancelled() and future.exception() is not None
+        }
+
+    def close(self, wait=True):
+        """不再接受新的调用，wait 为 True 时等待已提交的调用完成"""
+        with self._lock:
+            self._closed = True
+        if self._own_executor:
+            self._executor.shutdown(wait=wait)
+        elif wait:
+            self.wait()
+
+
+# 常用的接口方法预先定义在类上，调用时无需经过 __getattr__
+_API_METHOD_NAMES = (
+    "get_all_factors", "get_all_securities", "get_all_trade_days", "get_bars",
+    "get_bars_period", "get_billboard_list", "get_call_auction",
+    "get_concept_stocks", "get_concepts", "get_current_tick",
+    "get_current_ticks", "get_dominant_future", "get_extras",
+    "get_factor_style_returns", "get_factor_values",
+    "get_fq_factor", "get_fund_info", "get_fundamentals",
+    "get_future_contracts", "get_index_stocks", "get_index_weights",
+    "get_industries", "get_industry", "get_industry_stocks",
+    "get_locked_shares", "get_margincash_stocks", "get_marginsec_stocks",
+    "get_money_flow", "get_mtss", "get_pause_stocks", "get_price",
+    "get_price_period", "get_query_count", "get_security_info", "get_ticks",
+    "get_ticks_period", "get_trade_days", "run_query",
+)
+
+for _cls in (JQDataApi, AsyncJQDataApi):
+    for _name in _API_METHOD_NAMES:
+        if not hasattr(_cls, _name):
+            setattr(_cls, _name, _cls._make_api_method(_name))
+del _cls, _name
 
 
 api = JQDataApi()
+async_api = AsyncJQDataApi()
 
 
 def auth(username=None, password=None, url=None):
@@ -399,6 +2687,59 @@ def settimeout(value):
     api.timeout = value
 
 
+def enable_cache(cache_dir=None, max_size=1 << 30):
+    """开启历史数据的磁盘缓存"""
+    return api.enable_cache(cache_dir=cache_dir, max_size=max_size)
+
+
+def disable_cache():
+    """关闭历史数据的磁盘缓存"""
+    api.disable_cache()
+
+
+def enable_memory_cache(policies=None, max_stale=None):
+    """开启元数据类接口的内存缓存"""
+    return api.enable_memory_cache(policies=policies, max_stale=max_stale)
+
+
+def disable_memory_cache():
+    """关闭元数据类接口的内存缓存"""
+    api.disable_memory_cache()
+
+
+def enable_rate_limit(rate=10, burst=None, path=None, shared=True):
+    """开启客户端限流，同一主机上的所有进程共享限流状态"""
+    return api.enable_rate_limit(rate=rate, burst=burst, path=path,
+                                 shared=shared)
+
+
+def enable_token_store(path=None, ttl=12 * 3600):
+    """开启多进程共享的 token 存储"""
+    return api.enable_token_store(path=path, ttl=ttl)
+
+
+def enable_token_auto_refresh(margin=600):
+    """开启 token 的后台刷新，在 token 过期前获取新的 token"""
+    return api.enable_token_auto_refresh(margin=margin)
+
+
+def batch(max_workers=4, progress=None, executor=None):
+    """使用模块的 api 创建 ApiBatch，参数说明见 ApiBatch"""
+    return api.batch(
+        max_workers=max_workers, progress=progress, executor=executor
+    )
+
+
+def stats():
+    """模块的 api 按接口统计的调用指标"""
+    return api.stats()
+
+
+def add_metrics_exporter(exporter, interval=60):
+    """为模块的 api 添加调用指标的导出函数，每隔 interval 秒调用 exporter(stats)"""
+    return api.add_metrics_exporter(exporter, interval=interval)
+
+
 def _csv2list(data):
     """转化为 list 类型"""
     data = data.strip().split()
@@ -407,12 +2748,78 @@ def _csv2list(data):
     return data
 
 
+@functools.lru_cache(None)
+def _has_fast_loadtxt():
+    # numpy 1.23 开始 loadtxt 由 C 实现，比 genfromtxt 快数倍
+    return np.lib.NumpyVersion(np.__version__) >= '1.23.0'
+
+
+def _loadtxt_records(data, dtype):
+    """使用 numpy.loadtxt 将 CSV 解析为结构化数组
+
+    结果与 numpy.genfromtxt 一致：object 类型的字段为 bytes，缺失的浮点数为 nan，
+    缺失的整数为 -1。存在 loadtxt 无法解析的内容时抛出 ValueError
+    """
+    names = dtype.names
+    has_empty = (
+        ",," in data or ",\n" in data or data.startswith(",") or
+        data.endswith(",")
+    )
+    if not has_empty:
+        arr = np.loadtxt(StringIO(data), dtype=dtype, delimiter=",",
+                         ndmin=1, comments="#")
+        for name in names:
+            if dtype[name].kind == "O":
+                arr[name] = [item.encode("utf-8") for item in arr[name]]
+        return arr
+
+    # 有缺失值时先填充为 nan，整数按浮点数解析后再转换。连续的多个空字段
+    # 如 ",,," 需要替换两次，str.replace 比正则表达式快得多
+    data = data.replace(",,", ",nan,").replace(",,", ",nan,")
+    data = data.replace(",\n", ",nan\n").replace("\n,", "\nnan,")
+    if data.startswith(","):
+        data = "nan" + data
+    if data.endswith(","):
+        data = data + "nan"
+    load_dtype = [
+        (name, "f8" if dtype[name].kind in "iub" else dtype[name])
+        for name in names
+    ]
+    raw = np.loadtxt(StringIO(data), dtype=load_dtype, delimiter=",",
+                     ndmin=1, comments="#")
+    arr = np.empty(raw.shape, dtype=dtype)
+    for name in names:
+        kind = dtype[name].kind
+        col = raw[name]
+        if kind in "iub":
+            arr[name] = np.where(np.isnan(col), -1, col)
+        elif kind == "O":
+            arr[name] = [
+                b"" if item == "nan" else item.encode("utf-8") for item in col
+            ]
+        elif kind in "US":
+            arr[name] = np.where(col == col.dtype.type("nan"), "", col)
+        else:
+            arr[name] = col
+    return arr
+
+
+@_timed_parser("csv2array")
 def _csv2array(data, dtype=None, skip_header=0):
     """转换为 numpy 数组"""
     if not data:
         return np.empty((0, 0))
     if dtype and not isinstance(dtype, np.dtype):
         dtype = np.dtype(dtype)
+    if dtype is not None and dtype.names and _has_fast_loadtxt():
+        parts = data.split("\n", skip_header)
+        body = parts[skip_header] if len(parts) > skip_header else ""
+        if not body.strip():
+            return np.empty(0, dtype=dtype)
+        try:
+            return _loadtxt_records(body, dtype)
+        except ValueError:
+            pass
     arr = np.genfromtxt(StringIO(data), dtype=dtype, delimiter=",",
                         skip_header=skip_header, encoding='utf-8')
     if arr.size == 1 and len(arr.shape) == 0:
@@ -420,10 +2827,11 @@ def _csv2array(data, dtype=None, skip_header=0):
     return arr
 
 
+@_timed_parser("csv2df")
 def _csv2df(data, dtype=None):
     """转化为 pandas.DataFrame 类型"""
     if not data:
-        return np.DataFrame()
+        return pd.DataFrame()
     if dtype and not isinstance(dtype, np.dtype):
         dtype = np.dtype(dtype)
     try:
@@ -432,13 +2840,76 @@ def _csv2df(data, dtype=None):
         return pd.read_csv(StringIO(data))
 
 
+_OUTPUT_FORMATS = ("pandas", "arrow", "polars")
+
+# 兼容接口返回表格数据的格式，默认为 pandas.DataFrame
+_output_format = "pandas"
+
+
+def set_output_format(output_format="pandas"):
+    """设置兼容接口返回表格数据的格式
+
+    支持 pandas（pandas.DataFrame）、arrow（pyarrow.Table）、
+    polars（polars.DataFrame），后两者需要安装对应的库。
+    依赖 pandas 索引组装结果的接口仍然返回 pandas.DataFrame
+    """
+    global _output_format
+    _output_format = _check_output_format(output_format)
+
+
+def _check_output_format(output_format):
+    """检查输出格式，为空时返回全局设置的格式"""
+    output_format = output_format or _output_format
+    if output_format not in _OUTPUT_FORMATS:
+        raise ParamsError("output_format should be one of {}".format(
+            ", ".join(_OUTPUT_FORMATS)
+        ))
+    return output_format
+
+
+def _csv2table(data, dtype=None, output_format=None):
+    """按输出格式转化 CSV 数据
+
+    arrow 与 polars 格式由对应的库直接解析 CSV 的字节内容，不经过 pandas，
+    此时忽略 dtype 参数，字段类型由解析时推断
+    """
+    output_format = _check_output_format(output_format)
+    if output_format == "pandas":
+        return _csv2df(data, dtype=dtype)
+    content = data.encode("utf-8") if data and data.strip() else None
+    if output_format == "arrow":
+        if content is None:
+            return pa.table({})
+        return pa_csv.read_csv(pa.BufferReader(content))
+    if content is None:
+        return pl.DataFrame()
+    return pl.read_csv(content)
+
+
+def _columns2table(columns, output_format):
+    """将字段名到 numpy 数组的映射转化为 pyarrow.Table 或者 polars.DataFrame"""
+    if output_format == "arrow":
+        return pa.table(OrderedDict(
+            (name, pa.array(values)) for name, values in columns.items()
+        ))
+    return pl.DataFrame(OrderedDict(
+        (name, pl.Series(name, values)) for name, values in columns.items()
+    ))
+
+
 def _date2dt(date):
     """转化 datetime.date 到 datetime.datetime 类型"""
     return datetime.datetime.combine(date, datetime.time.min)
 
 
 def to_date(date):
-    """转化为 datetime.date 类型"""
+    """转化为 datetime.date 类型
+
+    参数为数组（list、tuple、numpy.ndarray、pandas.Series 等）时向量化地转化，
+    返回 datetime64[D] 类型的数组（兼容模式下为 datetime.date 对象数组）
+    """
+    if _is_array_like(date):
+        return _convert_dates(date, "D")
     if not date:
         return date
     elif is_string_types(date):
@@ -461,13 +2932,19 @@ def to_date(date):
 
 
 def to_datetime(dt):
-    """转化为 datetime.datetime 类型"""
+    """转化为 datetime.datetime 类型
+
+    参数为数组（list、tuple、numpy.ndarray、pandas.Series 等）时向量化地转化，
+    返回 datetime64[ns] 类型的数组（兼容模式下为 datetime.datetime 对象数组）
+    """
+    if _is_array_like(dt):
+        return _convert_dates(dt, "ns")
     if not dt:
         return dt
     elif is_string_types(dt):
         try:
             slen = len(dt)
-            if slen == 12 or slen == 14:  # 202101010000 or 20210101000000
+            if slen in (8, 12, 14):  # 20210101, 202101010000 or 20210101000000
                 return datetime.datetime(
                     int(dt[:4]),
                     *map(int, (dt[idx:(idx + 2)] for idx in range(4, slen, 2)))
@@ -485,14 +2962,102 @@ def to_datetime(dt):
     raise ValueError("bad datetime format '{!r}'".format(dt))
 
 
+# 日期时间的兼容模式：开启后 K 线的 date 字段、Tick 的 time 字段以及
+# to_date/to_datetime 的数组结果为 datetime.date/datetime.datetime 对象，
+# 默认为 numpy.datetime64 类型
+_datetime_as_object = False
+
+
+def set_datetime_as_object(enabled=True):
+    """设置是否以 datetime.date/datetime.datetime 对象的形式返回日期时间"""
+    global _datetime_as_object
+    _datetime_as_object = bool(enabled)
+
+
+def _is_array_like(obj):
+    # numpy 的标量（如 numpy.datetime64）也有 __array__ 属性，所以用 ndim 判断
+    return isinstance(obj, (list, tuple)) or getattr(obj, "ndim", 0) > 0
+
+
+def _is_iso_datetime(text):
+    return (
+        len(text) >= 10 and text[4:5] in ("-", b"-") and
+        text[7:8] in ("-", b"-")
+    )
+
+
+def _array2datetime64(data, unit="ns"):
+    """将日期时间数组向量化地转化为 numpy.datetime64 数组
+
+    支持字符串、bytes 以及 datetime.date/datetime.datetime 对象，空值转化为 NaT。
+    ISO 格式（如 2021-03-04 22:56:00）的字符串由 numpy 直接解析，
+    其他格式（如 20210304）交由 pandas.to_datetime 解析，仍无法解析时逐个转化
+    """
+    dtype = np.dtype("datetime64[{}]".format(unit))
+    arr = np.asarray(data)
+    if arr.dtype.kind == "M":
+        return arr.astype(dtype)
+    if arr.dtype.kind == "O" and arr.size:
+        # 转为定长的 bytes 或字符串数组，numpy 解析 bytes 比字符串更快
+        sample = arr.flat[0]
+        if is_binary_type(sample):
+            arr = arr.astype("S")
+        elif is_string_types(sample):
+            arr = arr.astype("U")
+    if arr.dtype.kind in "SU" and arr.size:
+        # numpy 会把 20210304 这样的字符串当作年份解析，因此只直接解析 ISO 格式
+        texts = arr.ravel()
+        valid = texts[texts != texts.dtype.type()]
+        if valid.size and not (
+            _is_iso_datetime(valid[0]) and _is_iso_datetime(valid[-1])
+        ):
+            if texts.dtype.kind == "S":
+                texts = np.char.decode(texts, "utf-8")
+            try:
+                values = pd.to_datetime(pd.Index(texts)).values
+            except (ValueError, OverflowError):
+                values = [to_datetime(str(text)) or None for text in texts]
+            return np.asarray(values, dtype=dtype).reshape(arr.shape)
+    return arr.astype(dtype)
+
+
 def _array2date(data):
-    vectorize = np.vectorize(to_date, otypes=[datetime.date])
-    return vectorize(data)
+    """将日期数组转化为 datetime.date 对象数组"""
+    return _array2datetime64(data, unit="D").astype(object)
 
 
 def _array2datetime(data):
-    vectorize = np.vectorize(to_datetime, otypes=[datetime.datetime])
-    return vectorize(data)
+    """将日期时间数组转化为 datetime.datetime 对象数组"""
+    return _array2datetime64(data, unit="us").astype(object)
+
+
+def _convert_dates(data, unit):
+    """to_date/to_datetime 数组参数的转化，pandas.Series 保持索引不变"""
+    if _datetime_as_object:
+        values = _array2date(data) if unit == "D" else _array2datetime(data)
+    else:
+        values = _array2datetime64(data, unit=unit)
+    if isinstance(data, pd.Series):
+        return pd.Series(values, index=data.index, name=data.name)
+    return values
+
+
+def _convert_time_field(arr, name):
+    """将结构化数组中的日期时间字段转化为 datetime64[ns] 类型"""
+    if arr.dtype.names is None or name not in arr.dtype.names:
+        return arr
+    if _datetime_as_object:
+        values = _array2datetime(arr[name])
+    else:
+        values = _array2datetime64(arr[name])
+    dtype = [
+        (col, values.dtype if col == name else arr.dtype[col])
+        for col in arr.dtype.names
+    ]
+    result = np.empty(arr.shape, dtype=dtype)
+    for col in arr.dtype.names:
+        result[col] = values if col == name else arr[col]
+    return result
 
 
 # 交易所代码（国际标准）对应的交易所全称
@@ -621,7 +3186,7 @@ class Security(object):
     @property
     def extra(self):
         """其他信息"""
-        self._extra
+        return self._extra
 
     def to_dict(self):
         info = {
@@ -641,11 +3206,7 @@ class Security(object):
         return info
 
 
-def get_security_info(code, date=None):
-    """获取股票/基金/指数的信息"""
-    assert code, "code is required"
-    date = to_date(date) if date else datetime.date.today()
-    data = api.get_security_info(code=code)
+def _parse_security_info(data):
     data = data.strip().split()
     if len(data) < 2:
         return None
@@ -653,8 +3214,244 @@ def get_security_info(code, date=None):
     return Security(**info)
 
 
+# 证券主数据加载的证券类型，对应 get_all_securities 接口的 code 参数
+_SECURITY_MASTER_TYPES = (
+    "stock", "fund", "index", "futures", "options", "etf", "lof", "fja", "fjb",
+    "QDII_fund", "open_fund", "bond_fund", "stock_fund", "money_market_fund",
+    "mixture_fund",
+)
+
+# 列表接口不返回母基信息，这些类型的标的仍然通过 get_security_info 接口查询
+_SECURITY_TYPES_WITH_PARENT = ("fja", "fjb")
+
+_SECURITY_COLUMNS = ["code", "display_name", "name", "start_date", "end_date", "type"]
+
+# 某个证券类型的标的列表，values 为各行的字符串值，start_date/end_date 为 datetime64[D] 数组
+_SecurityTable = namedtuple(
+    "_SecurityTable", ["frame", "values", "start_date", "end_date"]
+)
+
+
+def _parse_security_table(data):
+    if data and data.strip():
+        frame = pd.read_csv(StringIO(data), dtype=str, keep_default_na=False)
+    else:
+        frame = pd.DataFrame(columns=_SECURITY_COLUMNS)
+    return _SecurityTable(
+        frame, frame.values,
+        _array2datetime64(frame["start_date"].values, unit="D"),
+        _array2datetime64(frame["end_date"].values, unit="D"),
+    )
+
+
+class SecurityMaster(object):
+    """证券主数据
+
+    按证券类型通过 get_all_securities 接口加载标的列表，每天只加载一次，
+    之后按代码查询标的信息、按日期筛选上市中的标的都在本地完成：
+
+    - 代码到所在行的哈希索引，查询为 O(1)
+    - 同一代码只创建一个 Security 对象，重复查询返回同一个对象
+    - 按日期筛选时根据 start_date/end_date 向量化地计算
+
+    按代码查询时加载所有类型，某个类型加载失败（包括网络错误）时记录日志并跳过，
+    当天不再重试。请求与解析在锁外进行，只在发布加载结果时持有锁，
+    加载过程中其他线程的查询不会被阻塞。
+
+    参数：
+        types: 加载的证券类型，默认为 _SECURITY_MASTER_TYPES
+        api: 请求数据使用的 JQDataApi 实例，默认为模块的 api
+    """
+
+    def __init__(self, types=None, api=None):
+        self.types = tuple(types or _SECURITY_MASTER_TYPES)
+        self._api = api
+        self._lock = threading.RLock()
+        self._day = None
+        self._reset()
+
+    def _reset(self):
+        self._tables = {}
+        self._failed = set()
+        self._index = {}
+        self._securities = {}
+        self._complete = False
+
+    def invalidate(self):
+        """清空已加载的数据，下次使用时重新加载"""
+        with self._lock:
+            self._reset()
+
+    def _check_day(self):
+        today = datetime.date.today()
+        if self._day != today:
+            with self._lock:
+                if self._day != today:
+                    self._reset()
+                    self._day = today
+
+    def _load_table(self, type_):
+        client = self._api if self._api is not None else api
+        table = _parse_security_table(client.get_all_securities(code=type_))
+        with self._lock:
+            # 其他线程已经加载了该类型时使用已有的结果，保证同一代码只有一个对象
+            if type_ in self._tables:
+                return self._tables[type_]
+            self._tables[type_] = table
+            self._failed.discard(type_)
+            index = self._index
+            for row, code in enumerate(table.frame["code"].values):
+                if code not in index:
+                    index[code] = (table, row)
+        return table
+
+    def _table(self, type_):
+        self._check_day()
+        table = self._tables.get(type_)
+        if table is None:
+            table = self._load_table(type_)
+        return table
+
+    def _load_all(self):
+        self._check_day()
+        if self._complete:
+            return
+        for type_ in self.types:
+            if type_ in self._tables or type_ in self._failed:
+                continue
+            try:
+                self._load_table(type_)
+            except Exception as ex:
+                logger.warning("load securities of %s error: %s", type_, ex)
+                with self._lock:
+                    self._failed.add(type_)
+        self._complete = True
+
+    def get(self, code, load=True):
+        """查询单个标的的信息，不存在时返回 None
+
+        load 为 False 时不加载数据，只在已加载的数据中查询
+        """
+        if load:
+            self._load_all()
+        else:
+            self._check_day()
+        security = self._securities.get(code)
+        if security is not None:
+            return security
+        item = self._index.get(code)
+        if item is None:
+            return None
+        table, row = item
+        info = dict(zip(table.frame.columns, table.values[row]))
+        security = Security(**info)
+        return self._securities.setdefault(code, security)
+
+    def get_many(self, codes):
+        """查询多个标的的信息，返回按 codes 顺序排列的字典，不存在的标的值为 None"""
+        return {code: self.get(code) for code in _convert_security(codes)}
+
+    def listed_mask(self, type_, date):
+        """某个类型的各个标的在 date 是否上市中的布尔数组"""
+        table = self._table(type_)
+        date = np.datetime64(to_date(date), "D")
+        return (table.start_date <= date) & ~(table.end_date < date)
+
+    def get_all_securities(self, types=None, date=None):
+        """获取指定类型的标的列表，指定 date 时只返回当天上市中的标的，
+        返回值与 get_all_securities 函数相同
+        """
+        if not types:
+            types = ["stock"]
+        elif is_string_types(types):
+            types = [types]
+        frames = []
+        for type_ in types:
+            frame = self._table(type_).frame
+            if date:
+                frame = frame[self.listed_mask(type_, date)]
+            frames.append(frame)
+        frame = frames[0] if len(frames) == 1 else pd.concat(frames)
+        return frame.set_index("code")
+
+
+# 证券主数据，默认不开启（每次都请求接口），由 enable_security_master 开启
+_security_master = None
+
+
+def get_security_master():
+    """获取证券主数据，未开启时返回 None"""
+    return _security_master
+
+
+def enable_security_master(types=None):
+    """开启证券主数据，参数说明见 SecurityMaster"""
+    global _security_master
+    _security_master = SecurityMaster(types=types)
+    return _security_master
+
+
+def disable_security_master():
+    """关闭证券主数据，get_security_info 等函数每次都请求接口"""
+    global _security_master
+    _security_master = None
+
+
+def _master_security_info(code, load=True):
+    """从证券主数据中查询标的信息，未开启或者查询不到时返回 None"""
+    master = _security_master
+    if master is None:
+        return None
+    try:
+        security = master.get(code, load=load)
+    except Exception as ex:
+        logger.warning("query security master error: %s", ex)
+        return None
+    if security is None or security.type in _SECURITY_TYPES_WITH_PARENT:
+        return None
+    return security
+
+
+def _request_security_info(code):
+    return _parse_security_info(api.get_security_info(code=code))
+
+
+def get_security_info(code, date=None):
+    """获取股票/基金/指数的信息
+
+    开启证券主数据时优先从中查询，查询不到或者加载失败时请求接口
+    """
+    assert code, "code is required"
+    security = _master_security_info(code)
+    if security is None:
+        security = _request_security_info(code)
+    return security
+
+
+def get_securities_info(codes, date=None, max_workers=None):
+    """批量获取股票/基金/指数的信息
+
+    返回按 codes 顺序排列的字典，值为 Security 对象，标的不存在时为 None。
+    证券主数据中查询不到的标的请求接口，max_workers 为并发请求数
+    """
+    codes = _convert_security(codes)
+    results = OrderedDict((code, _master_security_info(code)) for code in codes)
+    missing = [code for code, security in results.items() if security is None]
+    if missing:
+        results.update(_map_securities(
+            _request_security_info, missing, max_workers=max_workers
+        ))
+    return results
+
+
 def get_all_securities(types=[], date=None):
-    """获取平台支持的所有股票、基金、指数、期货信息"""
+    """获取平台支持的所有股票、基金、指数、期货信息
+
+    开启证券主数据时，各类型的标的列表每天只请求一次，按 date 筛选在本地完成
+    """
+    master = _security_master
+    if master is not None:
+        return master.get_all_securities(types, date)
     if not types:
         types = ["stock"]
     elif is_string_types(types):
@@ -676,47 +3473,316 @@ def get_all_securities(types=[], date=None):
     return securities.set_index('code')
 
 
-@functools.lru_cache(None)
-def get_all_trade_days():
-    """获取所有交易日"""
-    data = _csv2array(api.get_all_trade_days(), dtype="<U16")
-    return _array2date(data)
+# 1970-01-01 的序数，datetime.date.toordinal() 减去该值即为 datetime64[D] 的整数值
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
 
 
-def get_trade_days(start_date=None, end_date=None, count=None):
-    """获取指定日期范围内的所有交易日"""
-    start_date = to_date(start_date)
-    end_date = to_date(end_date)
+class TradingCalendar(object):
+    """交易日历
+
+    交易日保存为 datetime64[D] 数组，并预先计算从自然日到交易日序号的映射表
+    （每个自然日及之前的交易日个数），判断是否为交易日、查找前后交易日、
+    计算交易日偏移与区间内的交易日数都是 O(1) 的。日期参数支持 datetime.date、
+    datetime.datetime、字符串以及 numpy.datetime64，返回的日期为 datetime.date
+
+    参数：
+        days: 交易日数组，可以是字符串、datetime.date 或者 datetime64
+    """
+
+    def __init__(self, days):
+        days = _array2datetime64(np.asarray(days), unit="D")
+        days = np.unique(days[~np.isnat(days)])
+        if not days.size:
+            raise ParamsError("交易日不能为空")
+        self.days = days
+        ordinals = days.astype("int64")
+        self._first = int(ordinals[0])
+        self._is_trading = np.zeros(int(ordinals[-1]) - self._first + 1, bool)
+        self._is_trading[ordinals - self._first] = True
+        self._counts = np.cumsum(self._is_trading)
+        self._dates = None
+
+    def __len__(self):
+        return self.days.size
+
+    def __repr__(self):
+        return "TradingCalendar({} ~ {}, {} days)".format(
+            self.days[0], self.days[-1], self.days.size
+        )
+
+    @property
+    def dates(self):
+        """datetime.date 对象数组形式的所有交易日"""
+        if self._dates is None:
+            self._dates = self.days.astype(object)
+        return self._dates
+
+    @staticmethod
+    def _ordinal(date):
+        if isinstance(date, np.datetime64):
+            return int(date.astype("datetime64[D]").astype("int64"))
+        return to_date(date).toordinal() - _EPOCH_ORDINAL
+
+    def _count_until(self, ordinal):
+        """截止到（包含）该自然日的交易日个数"""
+        idx = ordinal - self._first
+        if idx < 0:
+            return 0
+        if idx >= self._counts.size:
+            return self.days.size
+        return int(self._counts[idx])
+
+    def _date_at(self, idx):
+        if 0 <= idx < self.days.size:
+            return self.dates[idx]
+        return None
+
+    def is_trading_day(self, date):
+        """是否为交易日，参数为数组时返回布尔数组"""
+        if _is_array_like(date):
+            idx = _array2datetime64(date, unit="D").astype("int64") - self._first
+            valid = (idx >= 0) & (idx < self._is_trading.size)
+            result = np.zeros(idx.shape, bool)
+            result[valid] = self._is_trading[idx[valid]]
+            return result
+        idx = self._ordinal(date) - self._first
+        return 0 <= idx < self._is_trading.size and bool(self._is_trading[idx])
+
+    def previous(self, date, include=False):
+        """date 之前最近的交易日，include 为 True 时包含 date 本身，不存在时返回 None"""
+        ordinal = self._ordinal(date) - (0 if include else 1)
+        return self._date_at(self._count_until(ordinal) - 1)
+
+    def next(self, date, include=False):
+        """date 之后最近的交易日，include 为 True 时包含 date 本身，不存在时返回 None"""
+        ordinal = self._ordinal(date) - (1 if include else 0)
+        return self._date_at(self._count_until(ordinal))
+
+    def shift(self, date, n):
+        """date 之后（n 为负数时为之前）的第 n 个交易日，超出范围时返回 None
+
+        date 不是交易日时以其之前最近的交易日为基准，如 shift(周六, 1) 为下周一
+        """
+        idx = self._count_until(self._ordinal(date)) - 1 + n
+        return self._date_at(idx) if idx >= 0 else None
+
+    def count_between(self, start_date, end_date):
+        """start_date 与 end_date 之间（包含两端）的交易日数"""
+        start = self._count_until(self._ordinal(start_date) - 1)
+        end = self._count_until(self._ordinal(end_date))
+        return max(end - start, 0)
+
+    def _slice(self, start_date=None, end_date=None, count=None):
+        """返回指定日期范围的交易日在 days 中的下标区间 (start, end)"""
+        size = self.days.size
+        if not any([start_date, end_date, count]):
+            return 0, size
+        start_idx = (
+            self._count_until(self._ordinal(start_date) - 1) if start_date else 0
+        )
+        end_idx = self._count_until(self._ordinal(end_date)) if end_date else size
+
+        if not count and all([start_date, end_date]):
+            return start_idx, max(start_idx, end_idx)
+        if not end_date and all([start_date, count]):
+            return start_idx, min(start_idx + count, size)
+        if not start_date and all([end_date, count]):
+            return max(end_idx - count, 0), end_idx
+        if start_date and not any([end_date, count]):
+            return start_idx, size
+        if end_date and not any([start_date, count]):
+            return 0, end_idx
+        raise ParamsError("start_date 参数与 count 参数必须输入一个")
+
+    def get_trade_days(self, start_date=None, end_date=None, count=None):
+        """指定日期范围内的交易日，返回 datetime64[D] 数组"""
+        start, end = self._slice(start_date, end_date, count)
+        return self.days[start:end]
+
+    def save(self, path):
+        """保存到文件"""
+        buf = BytesIO()
+        np.save(buf, self.days.astype("int64"))
+        _atomic_write(path, buf.getvalue())
+
+    @classmethod
+    def load(cls, path):
+        """从文件中加载"""
+        days = np.load(path).astype("datetime64[D]")
+        return cls(days)
+
+
+class _CalendarStore(object):
+    """交易日历的本地存储，冷启动时无需请求接口即可使用交易日历
+
+    文件的修改时间在 ttl 秒以内时直接使用，过期后重新请求接口，
+    请求失败时仍然使用过期的交易日历
+
+    参数：
+        path: 文件路径，默认为 ~/.cache/jqdatahttp/trade_days.npy
+        ttl: 交易日历的有效时间（秒）
+    """
+
+    def __init__(self, path=None, ttl=24 * 3600):
+        if not path:
+            path = os.path.join(
+                os.path.expanduser("~"), ".cache", "jqdatahttp", "trade_days.npy"
+            )
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._calendar = None
+        self._mtime = None
+
+    def load(self, fresh_only=True):
+        """加载交易日历，文件不存在（或者 fresh_only 为 True 且已过期）时返回 None"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return None
+        if fresh_only and time.time() - mtime > self.ttl:
+            return None
+        with self._lock:
+            if self._calendar is not None and self._mtime == mtime:
+                return self._calendar
+        try:
+            calendar = TradingCalendar.load(self.path)
+        except (IOError, OSError, ValueError) as ex:
+            logger.debug("load trading calendar error: %s", ex)
+            return None
+        with self._lock:
+            self._calendar, self._mtime = calendar, mtime
+        return calendar
+
+    def save(self, calendar):
+        with self._lock:
+            if calendar is self._calendar:
+                return
+        try:
+            calendar.save(self.path)
+            mtime = os.stat(self.path).st_mtime
+        except (IOError, OSError) as ex:
+            logger.warning("save trading calendar error: %s", ex)
+            return
+        with self._lock:
+            self._calendar, self._mtime = calendar, mtime
+
+
+# 交易日历的本地存储，默认不开启
+_calendar_store = None
+
+
+def enable_calendar_store(path=None, ttl=24 * 3600):
+    """开启交易日历的本地存储，参数说明见 _CalendarStore"""
+    global _calendar_store
+    _calendar_store = _CalendarStore(path=path, ttl=ttl)
+    return _calendar_store
+
+
+def disable_calendar_store():
+    """关闭交易日历的本地存储"""
+    global _calendar_store
+    _calendar_store = None
+
+
+@functools.lru_cache(4)
+def _parse_trading_calendar(data):
+    # 接口结果由内存缓存保存，相同的结果只解析一次
+    return TradingCalendar(_csv2array(data, dtype="<U16"))
+
+
+def _stored_calendar(fresh_only=True):
+    store = _calendar_store
+    return store.load(fresh_only) if store is not None else None
+
+
+def _calendar_from_data(data):
+    calendar = _parse_trading_calendar(data)
+    if _calendar_store is not None:
+        _calendar_store.save(calendar)
+    return calendar
+
+
+# 进程内保存的交易日历，与接口的内存缓存无关，获取后超过刷新间隔（秒）才重新获取
+_CALENDAR_REFRESH_INTERVAL = 6 * 3600
+# (获取时使用的接口实例, 交易日历, 获取时间)
+_calendar_memo = None
+_calendar_lock = threading.Lock()
+
+
+def clear_trading_calendar():
+    """清除进程内保存的交易日历，下次使用时重新获取"""
+    global _calendar_memo
+    _calendar_memo = None
+
+
+def _memo_calendar(client, fresh_only=True):
+    """进程内保存的由 client 获取的交易日历，不存在（或者 fresh_only 为 True
+    且已超过刷新间隔）时返回 None"""
+    memo = _calendar_memo
+    if memo is None or memo[0] is not client:
+        return None
+    if fresh_only and time.time() - memo[2] > _CALENDAR_REFRESH_INTERVAL:
+        return None
+    return memo[1]
+
+
+def _set_memo_calendar(client, calendar):
+    global _calendar_memo
+    _calendar_memo = (client, calendar, time.time())
+    return calendar
+
+
+def _fallback_calendar(client, ex):
+    """请求接口失败时使用已过期的交易日历，都不存在时重新抛出异常"""
+    calendar = _memo_calendar(client, fresh_only=False)
+    if calendar is None:
+        calendar = _stored_calendar(fresh_only=False)
+    if calendar is None:
+        raise ex
+    logger.warning("get trade days error, use the stale ones: %s", ex)
+    return calendar
+
+
+def get_trading_calendar():
+    """获取交易日历
 
-    dates = get_all_trade_days()
+    交易日历在进程内保存 _CALENDAR_REFRESH_INTERVAL 秒，不受接口内存缓存开关的影响。
+    开启本地存储时优先使用存储的交易日历，请求接口失败时也会使用已过期的交易日历
+    """
+    client = api
+    calendar = _memo_calendar(client)
+    if calendar is not None:
+        return calendar
+    with _calendar_lock:
+        calendar = _memo_calendar(client)
+        if calendar is not None:
+            return calendar
+        calendar = _stored_calendar()
+        if calendar is None:
+            try:
+                data = client.get_all_trade_days()
+            except Exception as ex:
+                return _fallback_calendar(client, ex)
+            calendar = _calendar_from_data(data)
+        return _set_memo_calendar(client, calendar)
 
-    if not any([start_date, end_date, count]):
-        return dates
 
-    start_idx = dates.searchsorted(start_date) if start_date else 0
-    end_idx = dates.searchsorted(end_date, side='right') if end_date else -1
+def get_all_trade_days():
+    """获取所有交易日"""
+    return get_trading_calendar().dates
+
 
-    if not count and all([start_date, end_date]):
-        return dates[start_idx:end_idx]
-    if not end_date and all([start_date, count]):
-        return dates[start_idx:(start_idx + count)]
-    if not start_date and all([end_date, count]):
-        return dates[(end_idx - count if end_idx > count else 0):end_idx]
-    if start_date and not any([end_date, count]):
-        return dates[start_idx:]
-    if end_date and not any([start_date, count]):
-        return dates[:end_idx]
-    raise ParamsError("start_date 参数与 count 参数必须输入一个")
+def get_trade_days(start_date=None, end_date=None, count=None):
+    """获取指定日期范围内的所有交易日"""
+    calendar = get_trading_calendar()
+    start, end = calendar._slice(start_date, end_date, count)
+    return calendar.dates[start:end]
 
 
 def is_trading_day(date):
-    date = to_date(date)
-    all_dates = get_all_trade_days()
-    idx = all_dates.searchsorted(date)
-    try:
-        return all_dates[idx] == date
-    except IndexError:
-        return False
+    """是否为交易日，参数为数组时返回布尔数组"""
+    return get_trading_calendar().is_trading_day(date)
 
 
 def _normalize_stock_code(code):
@@ -780,6 +3846,176 @@ def _convert_security(security):
         raise ParamsError("security type should be Security or list")
 
 
+def _attach_security(ex, code):
+    """为异常附加出错的标的代码，返回需要抛出的异常"""
+    if getattr(ex, "security", None) is not None:
+        return ex
+    if isinstance(ex, JQDataError):
+        new_ex = ex.__class__("{}: {}".format(code, ex))
+        new_ex.__cause__ = ex
+        ex = new_ex
+    ex.security = code
+    return ex
+
+
+def _map_securities(func, securities, max_workers=None, executor=None):
+    """对每个标的调用 func(code)，返回按 securities 顺序排列的字典
+
+    指定 executor 或者 max_workers 大于 1 时并发请求，否则逐个顺序请求。
+    出错时抛出的 JQDataError 会在错误信息中带上出错的标的代码，
+    异常对象的 security 属性为出错的标的代码
+    """
+    def call(code):
+        try:
+            return func(code)
+        except Exception as ex:
+            raise _attach_security(ex, code)
+
+    if max_workers is None:
+        max_workers = api.max_workers
+    if executor is None and (max_workers <= 1 or len(securities) <= 1):
+        return {code: call(code) for code in securities}
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(
+            max_workers=min(max_workers, len(securities))
+        )
+    try:
+        futures = [(code, executor.submit(call, code)) for code in securities]
+        results = {}
+        try:
+            for code, future in futures:
+                results[code] = future.result()
+        except BaseException:
+            for _, future in futures:
+                future.cancel()
+            raise
+        return results
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
+# 按时间段拆分请求时，每个请求的预计行数上限，行数过多的请求容易超时
+_PERIOD_CHUNK_ROWS = 10000
+
+# 每个交易日的预计 Tick 数量（3 秒一个快照）
+_TICKS_PER_TRADE_DAY = 4800
+
+# 时间段请求失败时单独重试的次数
+_PERIOD_CHUNK_ATTEMPTS = 2
+
+
+def _bars_per_trade_day(unit):
+    """每个交易日的预计 K 线数量，按 A 股每天 240 分钟估算"""
+    if unit.endswith("m"):
+        return max(1, 240 // int(unit[:-1] or 1))
+    return 1
+
+
+def _trade_day_bounds(start_dt, end_dt):
+    """start_dt 与 end_dt 之间（不含两端）各交易日的零点"""
+    days = get_trading_calendar().days
+    first = np.searchsorted(days, np.datetime64(start_dt.date(), "D"), "right")
+    last = np.searchsorted(days, np.datetime64(end_dt.date(), "D"), "right")
+    bounds = [_date2dt(day) for day in days[first:last].astype(object)]
+    return [bound for bound in bounds if bound < end_dt]
+
+
+def _split_period(start_dt, end_dt, rows_per_day, max_rows):
+    """按交易日将 [start_dt, end_dt] 拆分为多个时间段，每段的预计行数不超过 max_rows
+
+    返回 [(开始时间, 结束时间), ...]，相邻时间段以交易日的零点为分界，时间上
+    首尾相接（期货夜盘跨零点的数据不会遗漏），分界时刻的数据在合并时去重
+    """
+    days_per_chunk = max(1, int(max_rows // rows_per_day)) if max_rows else 0
+    if not days_per_chunk or (end_dt - start_dt).days < days_per_chunk:
+        return [(start_dt, end_dt)]
+    bounds = _trade_day_bounds(start_dt, end_dt)
+    if len(bounds) < days_per_chunk:
+        return [(start_dt, end_dt)]
+    edges = [start_dt] + bounds[days_per_chunk - 1::days_per_chunk] + [end_dt]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+# 时间段请求的临时性错误：服务端超时或内部错误、网络错误，其他错误（如服务端
+# 返回的查询条数用尽、账号过期等错误信息）重试与拆分都无济于事，直接抛出
+_TRANSIENT_ERRORS = (
+    ServerError, URLError, socket.timeout, ConnectionError, HTTPException,
+)
+
+
+def _fetch_period_chunk(fetch, start_dt, end_dt):
+    """获取一个时间段的数据，返回结构化数组的列表
+
+    出现临时性错误时单独重试该时间段，仍然失败且跨多个交易日时，
+    拆分为前后两半分别获取
+    """
+    for attempt in range(_PERIOD_CHUNK_ATTEMPTS):
+        try:
+            return [fetch(start_dt, end_dt)]
+        except _TRANSIENT_ERRORS as ex:
+            error = ex
+            logger.warning(
+                "fetch %s ~ %s error (attempt %d): %s",
+                start_dt, end_dt, attempt + 1, ex
+            )
+    bounds = _trade_day_bounds(start_dt, end_dt)
+    if not bounds:
+        raise error
+    middle = bounds[len(bounds) // 2]
+    return (_fetch_period_chunk(fetch, start_dt, middle) +
+            _fetch_period_chunk(fetch, middle, end_dt))
+
+
+def _merge_period_chunks(arrays, time_field):
+    """按时间顺序合并各时间段的数据，去掉与前一段重复的分界数据"""
+    merged, last = [], None
+    for arr in arrays:
+        if not arr.size or time_field not in arr.dtype.names:
+            continue
+        if last is not None:
+            arr = arr[arr[time_field] > last]
+        if arr.size:
+            merged.append(arr)
+            last = arr[time_field][-1]
+    if not merged:
+        return arrays[0]
+    return merged[0] if len(merged) == 1 else np.concatenate(merged)
+
+
+def _map_periods(fetch, securities, chunks, time_field, fields=None,
+                 max_workers=None, executor=None):
+    """获取各标的在各个时间段的数据，返回按 securities 顺序排列的字典
+
+    fetch(code, start_dt, end_dt) 返回结构化数组，每个 (标的, 时间段) 为一个任务，
+    由 _map_securities 执行，各标的的结果按时间合并后再选取 fields 字段
+    """
+    tasks = [(code, idx) for code in securities for idx in range(len(chunks))]
+
+    def call(task):
+        code, idx = task
+        try:
+            return _fetch_period_chunk(
+                functools.partial(fetch, code), *chunks[idx]
+            )
+        except Exception as ex:
+            raise _attach_security(ex, code)
+
+    results = _map_securities(
+        call, tasks, max_workers=max_workers, executor=executor
+    )
+    mapping = OrderedDict()
+    for code in securities:
+        arrays = [
+            arr for idx in range(len(chunks)) for arr in results[(code, idx)]
+        ]
+        arr = _merge_period_chunks(arrays, time_field)
+        mapping[code] = arr[fields] if fields else arr
+    return mapping
+
+
 _bar_data_dtypes = OrderedDict([
     ('date', 'O'), ('open', '<f8'), ('close', '<f8'),
     ('high', '<f8'), ('low', '<f8'), ('volume', '<f8'), ('money', '<f8'),
@@ -797,40 +4033,340 @@ _tick_data_dtypes = OrderedDict([
 ])
 
 
-def get_price(security, start_date=None, end_date=None, frequency='1d',
-              fields=None, skip_paused=False, fq='pre', count=None,
-              panel=False, fill_paused=True):
-    """获取一支或者多只证券的行情数据"""
+def _parse_records(data, dtype_mapping):
+    """解析带表头的 CSV 为结构化数组，字段类型由表头在 dtype_mapping 中查找
+
+    data 可以是完整的字符串，也可以是流式响应逐块产出的文本（每块以完整的行结尾），
+    后者在下载的同时逐块解析，无需在内存中保留完整的响应内容
+    """
+    blocks = iter([data] if is_string_types(data) else data)
+    first_block = next(blocks, "")
+    header = [
+        item.strip() for item in first_block.split('\n', 1)[0].split(',') if item
+    ]
+    dtype = np.dtype([(col, dtype_mapping[col]) for col in header])
+    arrays = [_csv2array(first_block, dtype=dtype, skip_header=1)]
+    for block in blocks:
+        arrays.append(_csv2array(block, dtype=dtype))
+    arrays = [arr for arr in arrays if arr.size]
+    if not arrays:
+        return np.empty(0, dtype=dtype)
+    return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+
+def _merge_column_dtype(dtypes, complete):
+    """多个标的同一字段的类型合并为一个类型，complete 为 False 表示部分标的缺少该字段"""
+    try:
+        dtype = np.result_type(*dtypes)
+    except TypeError:
+        return np.dtype(object)
+    if not complete and dtype.kind in "biu":
+        return np.dtype("f8")
+    return dtype
+
+
+def _assemble_columns(arrays_mapping):
+    """将各标的的结构化数组按字段拼接，返回 (标的列表, 各标的行数, 各标的起始行, 字段数组)
+
+    每个字段预先分配一个完整长度的数组，依次写入各标的的数据。
+    部分标的缺少的字段填充为 NaN（日期时间为 NaT，对象类型为 None）
+    """
+    codes = list(arrays_mapping)
+    arrays = list(arrays_mapping.values())
+    sizes = np.array([arr.size for arr in arrays], dtype=np.intp)
+    offsets = np.zeros(len(arrays) + 1, dtype=np.intp)
+    np.cumsum(sizes, out=offsets[1:])
+    total = int(offsets[-1])
+
+    names = []
+    for arr in arrays:
+        names.extend(name for name in arr.dtype.names or () if name not in names)
+
+    columns = OrderedDict()
+    for name in names:
+        dtypes = [arr.dtype[name] for arr in arrays if name in arr.dtype.names]
+        dtype = _merge_column_dtype(dtypes, len(dtypes) == len(arrays))
+        column = np.empty(total, dtype=dtype)
+        for arr, start, end in zip(arrays, offsets[:-1], offsets[1:]):
+            if name in arr.dtype.names:
+                column[start:end] = arr[name]
+            elif dtype.kind == "M":
+                column[start:end] = np.datetime64("NaT")
+            elif dtype.kind == "O":
+                column[start:end] = None
+            else:
+                column[start:end] = np.nan
+        columns[name] = column
+    return codes, sizes, offsets, columns
+
+
+def _assemble_frame(arrays_mapping, output_format="pandas"):
+    """将各标的的结构化数组按列组装为以 (标的, 序号) 为索引的 DataFrame
+
+    索引由标的序号与行序号构造，不会为每个标的创建 DataFrame，也不会再拼接复制。
+    output_format 为 arrow 或 polars 时返回以 code 为第一列的 pyarrow.Table
+    或者 polars.DataFrame
+    """
+    codes, sizes, offsets, columns = _assemble_columns(arrays_mapping)
+    total = int(offsets[-1])
+    code_index = np.repeat(np.arange(len(codes), dtype=np.intp), sizes)
+    if output_format != "pandas":
+        if output_format == "arrow":
+            code_column = pa.DictionaryArray.from_arrays(
+                pa.array(code_index.astype("int32")),
+                pa.array(codes, type=pa.string()),
+            )
+        else:
+            code_column = np.array(codes, dtype=object)[code_index]
+        table = _columns2table(columns, output_format)
+        if output_format == "arrow":
+            return table.add_column(0, "code", code_column)
+        return table.insert_column(0, pl.Series("code", code_column))
+    row_index = np.arange(total, dtype=np.intp) - np.repeat(offsets[:-1], sizes)
+    index = pd.MultiIndex(
+        levels=[pd.Index(codes, dtype=object),
+                pd.RangeIndex(int(sizes.max()) if total else 0)],
+        codes=[code_index, row_index],
+        verify_integrity=False,
+    )
+    return pd.DataFrame(columns, index=index, columns=list(columns), copy=False)
+
+
+def _parse_bars(data, fields=None):
+    """解析 K 线数据为 numpy 结构化数组"""
+    bars = _parse_records(data, _bar_data_dtypes)
+    bars = _convert_time_field(bars, "date")
+    return bars[fields] if fields else bars
+
+
+def _record_columns(arr):
+    """结构化数组的各个字段"""
+    return OrderedDict((name, arr[name]) for name in arr.dtype.names)
+
+
+def _format_bars(bars_mapping, is_list_security, df, output_format=None):
+    """将各标的的 K 线数据组装为最终的返回结果"""
+    if df:
+        output_format = _check_output_format(output_format)
+        if is_list_security:
+            return _assemble_frame(bars_mapping, output_format)
+        else:
+            _, arr = bars_mapping.popitem()
+            if output_format != "pandas":
+                return _columns2table(_record_columns(arr), output_format)
+            return pd.DataFrame(data=arr, index=range(arr.size))
+    else:
+        if is_list_security:
+            return bars_mapping
+        else:
+            _, arr = bars_mapping.popitem()
+            return arr
+
+
+def _parse_ticks(data, fields=None):
+    """解析 Tick 数据为 numpy 结构化数组"""
+    ticks = _parse_records(data, _tick_data_dtypes)
+    if _datetime_as_object:
+        if "time" in ticks.dtype.names:
+            ticks["time"] = ticks["time"].astype(str)
+    else:
+        ticks = _convert_time_field(ticks, "time")
+    return ticks[fields] if fields else ticks
+
+
+def _format_ticks(ticks_mapping, is_list_security, df, output_format=None):
+    """将各标的的 Tick 数据组装为最终的返回结果"""
+    if df:
+        output_format = _check_output_format(output_format)
+        if output_format != "pandas":
+            if len(ticks_mapping) == 1 and not is_list_security:
+                _, ticks = ticks_mapping.popitem()
+                return _columns2table(_record_columns(ticks), output_format)
+            return _assemble_frame(ticks_mapping, output_format)
+        df = _assemble_frame(ticks_mapping)
+        if "time" in df and df["time"].dtype.kind != "M":
+            df["time"] = _array2datetime64(df["time"].values)
+        return df
+    else:
+        if is_list_security or len(ticks_mapping) > 1:
+            return ticks_mapping
+        else:
+            _, ticks = ticks_mapping.popitem()
+            return ticks
+
+
+# 后复权时使用的复权基准日期，早于所有标的的上市日期
+_POST_FQ_REF_DATE = datetime.date(1990, 12, 19)
+
+# fill_paused 为 False 时，停牌期间置为 NaN 的字段
+_PAUSED_NAN_FIELDS = ('open', 'close', 'high', 'low', 'volume', 'money', 'avg')
+
+
+def _fq_ref_date(fq):
+    """将 fq 参数转化为接口的复权基准日期参数"""
+    if not fq:
+        return None
+    if fq == "pre":
+        return datetime.date.today()
+    if fq == "post":
+        return _POST_FQ_REF_DATE
+    raise ParamsError("fq should be 'pre', 'post' or None")
+
+
+def _price_dt(value, unit):
+    """日线及以上的周期转化为日期，分钟线转化为日期时间"""
+    return to_datetime(value) if unit.endswith("m") else to_date(value)
+
+
+def _bars_column(arr, name):
+    """结构化数组的某个字段，字段不存在时为 NaN"""
+    if name in arr.dtype.names:
+        return arr[name]
+    return np.full(arr.size, np.nan)
+
+
+def _format_price(bars_mapping, fields, is_list_security, panel,
+                  output_format="pandas"):
+    """将各标的的行情数据组装为 get_price 的返回结果
+
+    单个标的返回以 date 为索引的 DataFrame；多个标的时按列拼接各标的的数据，
+    返回包含 time、code 列的长格式 DataFrame，panel 为 True 时返回以字段名为键、
+    以时间为索引、以标的为列的 DataFrame 字典（只支持 pandas 格式）。
+    output_format 为 arrow 或 polars 时，单个标的的 date 作为第一列
+    """
+    if not is_list_security:
+        _, arr = bars_mapping.popitem()
+        if output_format != "pandas":
+            columns = OrderedDict([("date", arr["date"])])
+            columns.update((name, _bars_column(arr, name)) for name in fields)
+            return _columns2table(columns, output_format)
+        return pd.DataFrame(
+            OrderedDict((name, _bars_column(arr, name)) for name in fields),
+            index=pd.Index(arr["date"], name="date"),
+        )
+    codes = list(bars_mapping)
+    arrays = list(bars_mapping.values())
     if panel:
-        raise ParamsError("'panel' param is discarded")
-    start_date = to_date(start_date) if start_date else None
-    end_date = to_date(end_date) if end_date else None
-    if (not count) and (not start_date):
-        start_date = "2015-01-01"
+        if arrays:
+            times = np.unique(np.concatenate([arr["date"] for arr in arrays]))
+        else:
+            times = np.empty(0, dtype="M8[ns]")
+        positions = [np.searchsorted(times, arr["date"]) for arr in arrays]
+        result = OrderedDict()
+        for name in fields:
+            values = np.full((times.size, len(codes)), np.nan)
+            for col, (arr, rows) in enumerate(zip(arrays, positions)):
+                values[rows, col] = _bars_column(arr, name)
+            result[name] = pd.DataFrame(values, index=times, columns=codes)
+        return result
+
+    def concat(name):
+        if not arrays:
+            return np.empty(0)
+        return np.concatenate([_bars_column(arr, name) for arr in arrays])
+
+    columns = OrderedDict()
+    columns["time"] = concat("date")
+    columns["code"] = np.repeat(
+        np.array(codes, dtype=object), [arr.size for arr in arrays]
+    )
+    for name in fields:
+        columns[name] = concat(name)
+    if output_format != "pandas":
+        return _columns2table(columns, output_format)
+    return pd.DataFrame(columns)
+
+
+def get_price(security, start_date=None, end_date=None, frequency='1d',
+              fields=None, skip_paused=False, fq='pre', count=None,
+              panel=False, fill_paused=True, max_workers=None, executor=None,
+              output_format=None):
+    """获取一支或者多只证券的行情数据
+
+    参数：
+        security: 证券代码，支持多个
+        start_date: 开始时间，与 count 二选一，都不指定时为 2015-01-01
+        end_date: 结束时间，默认为今天。分钟线只指定日期时，日内时间为 00:00:00
+        frequency: 时间周期，支持 1m, 5m, 15m, 30m, 60m, 120m, 1d, 1w, 1M，
+            以及 daily（同 1d）与 minute（同 1m）
+        fields: 需要获取的数据字段，默认为 open, close, high, low, volume, money
+        skip_paused: 是否跳过停牌的数据
+        fq: 复权方式，pre 为前复权，post 为后复权，None 为不复权
+        count: 返回的结果数量，与 start_date 二选一
+        panel: 多个标的时是否返回以字段名为键的 DataFrame 字典，
+            否则返回包含 time、code 列的长格式 DataFrame
+        fill_paused: 停牌期间是否使用接口返回的价格（停牌前收盘价）填充，
+            否则价格与成交量等字段为 NaN
+        max_workers: 查询多个标的时的并发请求数，默认为 api.max_workers
+        executor: 执行请求的线程池，指定后忽略 max_workers 参数
+        output_format: 返回数据的格式，支持 pandas、arrow、polars，
+            默认为 set_output_format 设置的格式
+    """
+    is_list_security = isinstance(security, (tuple, list, set)) or ',' in security
+    security = _convert_security(security)
+    output_format = _check_output_format(output_format)
     if count and start_date:
         raise ParamsError("(start_date, count) only one param is required")
     if frequency == "daily":
         frequency = "1d"
     elif frequency == "minute":
         frequency = "1m"
-    if not fields:
-        fields = ['open', 'close', 'high', 'low', 'volume', 'money']
-    fields.insert(0, "date")
-
-    data = api.get_price(
-        code=security,
-        end_date=end_date,
-        count=int(count),
-        unit=frequency,
-        fq_ref_date=None
+    if not count and not start_date:
+        start_date = "2015-01-01"
+    start_date = _price_dt(start_date, frequency) if start_date else None
+    end_date = _price_dt(end_date or datetime.date.today(), frequency)
+    fq_ref_date = _fq_ref_date(fq)
+    fields = list(fields) if fields else [
+        'open', 'close', 'high', 'low', 'volume', 'money'
+    ]
+
+    def get_code_price(code):
+        if count:
+            data = api.get_price(
+                code=code,
+                count=int(count),
+                unit=frequency,
+                end_date=end_date,
+                fq_ref_date=fq_ref_date,
+                stream=True,
+            )
+        else:
+            data = api.get_price_period(
+                code=code,
+                date=start_date,
+                end_date=end_date,
+                unit=frequency,
+                fq_ref_date=fq_ref_date,
+                stream=True,
+            )
+        bars = _parse_bars(data)
+        if "paused" in bars.dtype.names:
+            paused = bars["paused"] == 1
+            if skip_paused:
+                bars = bars[~paused]
+            elif not fill_paused and paused.any():
+                for name in _PAUSED_NAN_FIELDS:
+                    if name in bars.dtype.names:
+                        bars[name][paused] = np.nan
+        return bars
+
+    bars_mapping = _map_securities(
+        get_code_price, security, max_workers=max_workers, executor=executor
+    )
+    return _format_price(
+        bars_mapping, fields, is_list_security, panel, output_format
     )
-    data = _csv2df(data)
-    return data[fields].set_index("date")
 
 
 def get_bars(security, count, unit="1d", fields=None, include_now=False,
-             end_dt=None, fq_ref_date=None, df=True):
-    """获取历史数据(包含快照数据), 可查询单个标的多个数据字段"""
+             end_dt=None, fq_ref_date=None, df=True, max_workers=None,
+             executor=None, output_format=None):
+    """获取历史数据(包含快照数据), 可查询单个标的多个数据字段
+
+    查询多个标的时，max_workers 指定并发请求数（默认为 api.max_workers），
+    也可以通过 executor 参数指定执行请求的线程池。
+    output_format 为 df 为 True 时返回数据的格式，支持 pandas、arrow、polars
+    """
     is_list_security = isinstance(security, (tuple, list, set)) or ',' in security
     security = _convert_security(security)
     assert count > 0
@@ -840,43 +4376,28 @@ def get_bars(security, count, unit="1d", fields=None, include_now=False,
     if fq_ref_date:
         fq_ref_date = to_date(fq_ref_date)
 
-    bars_mapping = {}
-    for code in security:
+    def get_code_bars(code):
         data = api.get_bars(
             code=code,
             count=int(count),
             unit=unit,
             end_date=end_dt,
             fq_ref_date=fq_ref_date,
+            stream=True,
         )
-        header = [
-            item.strip() for item in data.split('\n', 1)[0].split(',') if item
-        ]
-        dtype = [(col, _bar_data_dtypes[col]) for col in header]
-        bars = _csv2array(data, dtype=dtype, skip_header=1)
-        bars["date"] = _array2datetime(bars["date"])
-        bars_mapping[code] = bars[fields] if fields else bars
+        return _parse_bars(data, fields)
 
-    if df:
-        if is_list_security:
-            dfs = []
-            for code, arr in bars_mapping.items():
-                index = [[code] * arr.size, list(range(arr.size))]
-                dfs.append(pd.DataFrame(data=arr, index=index))
-            return pd.concat(dfs, copy=False)
-        else:
-            _, arr = bars_mapping.popitem()
-            return pd.DataFrame(data=arr, index=range(arr.size))
-    else:
-        if is_list_security:
-            return bars_mapping
-        else:
-            _, arr = bars_mapping.popitem()
-            return arr
+    bars_mapping = _map_securities(
+        get_code_bars, security, max_workers=max_workers, executor=executor
+    )
+
+    return _format_bars(bars_mapping, is_list_security, df, output_format)
 
 
 def get_bars_period(security, start_dt, end_dt, unit="1d", fields=None,
-                    fq_ref_date=None, df=True):
+                    fq_ref_date=None, df=True, max_workers=None,
+                    executor=None, output_format=None,
+                    chunk_rows=_PERIOD_CHUNK_ROWS):
     """获取指定时间段的行情数据
 
     参数：
@@ -890,6 +4411,13 @@ def get_bars_period(security, start_dt, end_dt, unit="1d", fields=None,
         fields: 需要获取的数据字段
         fq_ref_date：复权基准日期，该参数为空时返回不复权数据
         df: 是否返回 pandas.DataFrame，否则返回 numpy.ndarray
+        max_workers: 查询多个标的时的并发请求数，默认为 api.max_workers
+        executor: 执行请求的线程池，指定后忽略 max_workers 参数
+        output_format: df 为 True 时返回数据的格式，支持 pandas、arrow、polars，
+            默认为 set_output_format 设置的格式
+        chunk_rows: 时间段较长时，按交易日拆分为多个预计行数不超过 chunk_rows
+            的请求（各标的、各时间段的请求一起按 max_workers 并发），
+            合并时去掉分界处重复的数据，失败的时间段单独重试。为 0 时不拆分
     """
     is_list_security = isinstance(security, (tuple, list, set)) or ',' in security
     security = _convert_security(security)
@@ -898,42 +4426,30 @@ def get_bars_period(security, start_dt, end_dt, unit="1d", fields=None,
     if fq_ref_date:
         fq_ref_date = to_date(fq_ref_date)
 
-    bars_mapping = {}
-    for code in security:
+    def get_code_bars(code, start, end):
         data = api.get_bars_period(
             code=code,
-            date=start_dt,
-            end_date=end_dt,
+            date=start,
+            end_date=end,
             unit=unit,
             fq_ref_date=fq_ref_date,
+            stream=True,
         )
-        header = [
-            item.strip() for item in data.split('\n', 1)[0].split(',') if item
-        ]
-        dtype = [(col, _bar_data_dtypes[col]) for col in header]
-        bars = _csv2array(data, dtype=dtype, skip_header=1)
-        bars["date"] = _array2datetime(bars["date"])
-        bars_mapping[code] = bars[fields] if fields else bars
+        return _parse_bars(data)
 
-    if df:
-        if is_list_security:
-            dfs = []
-            for code, arr in bars_mapping.items():
-                index = [[code] * arr.size, list(range(arr.size))]
-                dfs.append(pd.DataFrame(data=arr, index=index))
-            return pd.concat(dfs, copy=False)
-        else:
-            _, arr = bars_mapping.popitem()
-            return pd.DataFrame(data=arr, index=range(arr.size))
-    else:
-        if is_list_security:
-            return bars_mapping
-        else:
-            _, arr = bars_mapping.popitem()
-            return arr
+    chunks = _split_period(
+        start_dt, end_dt, _bars_per_trade_day(unit), chunk_rows
+    )
+    bars_mapping = _map_periods(
+        get_code_bars, security, chunks, "date", fields=fields,
+        max_workers=max_workers, executor=executor,
+    )
 
+    return _format_bars(bars_mapping, is_list_security, df, output_format)
 
-def get_fq_factor(security, start_date, end_date, fq="post"):
+
+def get_fq_factor(security, start_date, end_date, fq="post",
+                  output_format=None):
     """获取股票和基金复权因子"""
     security = _convert_security(security)
     start_date = to_date(start_date)
@@ -941,76 +4457,367 @@ def get_fq_factor(security, start_date, end_date, fq="post"):
     data = api.get_fq_factor(
         code=security, fq=fq, date=start_date, end_date=end_date
     )
-    return _csv2df(data)
+    return _csv2table(data, output_format=output_format)
+
 
+_current_tick_dtype = list(_tick_data_dtypes.items())
+_current_ticks_dtype = [("code", "U30")] + list(_tick_data_dtypes.items())
 
-def get_current_tick(security):
+
+def get_current_tick(security, output_format=None):
     """获取最新的 tick 数据"""
     if isinstance(security, Security):
         security = security.code
-    dtype = list(_tick_data_dtypes.items())
-    return _csv2df(api.get_current_tick(code=security), dtype=dtype)
+    return _csv2table(
+        api.get_current_tick(code=security), dtype=_current_tick_dtype,
+        output_format=output_format,
+    )
 
 
-def get_current_ticks(security):
+def get_current_ticks(security, output_format=None):
     """获取多标的最新的 tick 数据"""
     security = _convert_security(security)
-    dtype = [("code", "U30")] + list(_tick_data_dtypes.items())
-    return _csv2df(api.get_current_ticks(code=",".join(security)), dtype=dtype)
+    return _csv2table(
+        api.get_current_ticks(code=",".join(security)),
+        dtype=_current_ticks_dtype, output_format=output_format,
+    )
 
 
 def get_last_price(codes):
     """获取标的的最新价格"""
-    data = get_current_ticks(codes)
+    data = get_current_ticks(codes, output_format="pandas")
     if data.empty:
         return {}
-    return {row.code: row.current for _, row in data.iterrows()}
+    return dict(zip(data["code"], data["current"]))
+
+
+# A 股的交易时段（包含集合竞价），QuotePoller 只在交易日的这些时段内轮询
+A_SHARE_SESSIONS = (
+    (datetime.time(9, 15), datetime.time(11, 30)),
+    (datetime.time(13, 0), datetime.time(15, 0)),
+)
+
+# QuotePoller 默认保存并比较的行情字段
+_QUOTE_FIELDS = (
+    "current", "high", "low", "volume", "money",
+    "a1_p", "a1_v", "b1_p", "b1_v",
+)
+
+_current_ticks_dtypes = OrderedDict([("code", "U30")])
+_current_ticks_dtypes.update(_tick_data_dtypes)
+
+# 每轮轮询的统计：scheduled 为计划开始时间，lag 为实际开始时间与计划时间之差，
+# latency 为本轮请求与解析的耗时（秒），missed 为因耗时过长而跳过的轮次数
+PollStats = namedtuple("PollStats", [
+    "scheduled", "lag", "latency", "requests", "errors", "rows", "changed",
+    "missed",
+])
+
+
+class QuotePoller(object):
+    """按固定节奏轮询大量标的的最新行情，只输出行情有变化的标的
+
+    标的按 chunk_size 分片，每轮各分片的 get_current_ticks 请求在线程池中并发进行。
+    最新行情保存在预先分配的数组中（snapshot 方法返回 DataFrame），
+    每轮只把 time 或 fields 中任一字段发生变化的行交给 on_update(changes, stats)，
+    changes 为包含 code、time 与 fields 字段的 DataFrame。
+
+    轮询时间以交易时段的开始时间为基准按 interval 对齐（如 9:15:00、9:15:03、...），
+    非交易日与交易时段之外不轮询。某一轮耗时超过 interval 时跳过错过的轮次，
+    记录在统计信息的 missed 中并输出警告日志，最近的统计信息保存在 history 中：
+
+        poller = QuotePoller(codes, interval=3, on_update=handle)
+        poller.start()
+        ...
+        poller.stop()
+
+    参数：
+        codes: 标的代码列表
+        interval: 轮询间隔（秒）
+        chunk_size: 每个请求包含的标的数
+        max_workers: 并发请求数
+        fields: 保存并比较的行情字段，为 tick 数据的字段
+        sessions: 交易时段，由 (开始时间, 结束时间) 组成，为 None 时全天轮询
+        on_update: 每轮结束后调用 on_update(changes, stats)，没有变化时不调用
+        api: 执行请求的 JQDataApi 实例，默认为全局的 api
+        history_size: 保存最近多少轮的统计信息
+    """
+
+    def __init__(self, codes, interval=3, chunk_size=500, max_workers=4,
+                 fields=_QUOTE_FIELDS, sessions=A_SHARE_SESSIONS,
+                 on_update=None, api=None, history_size=100):
+        codes = _convert_security(codes)
+        if not codes:
+            raise ParamsError("codes 不能为空")
+        unknown = [name for name in fields if name not in _tick_data_dtypes]
+        if "time" in fields or unknown:
+            raise ParamsError("不支持的行情字段：{}".format(unknown or "time"))
+        if interval <= 0 or chunk_size <= 0:
+            raise ParamsError("interval 与 chunk_size 必须大于 0")
+        self.codes = np.array(codes)
+        self.interval = interval
+        self.fields = list(fields)
+        self.sessions = sessions
+        self.on_update = on_update
+        self.api = api
+        self._chunks = [
+            ",".join(codes[i:i + chunk_size])
+            for i in range(0, len(codes), chunk_size)
+        ]
+        self._max_workers = max_workers
+        self._executor = None
+        # 按代码排序后用 searchsorted 查找各行在快照数组中的位置
+        self._order = np.argsort(self.codes, kind="mergesort")
+        self._sorted_codes = self.codes[self._order]
+        self._time = np.full(self.codes.size, np.datetime64("NaT"), "M8[ns]")
+        self._values = OrderedDict(
+            (name, np.full(self.codes.size, np.nan)) for name in self.fields
+        )
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._calendar = None
+        self._calendar_day = None
+        self.history = deque(maxlen=history_size)
+
+    def __repr__(self):
+        return "QuotePoller({} codes, interval={})".format(
+            self.codes.size, self.interval
+        )
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def snapshot(self):
+        """最新行情，未获取到行情的标的为 NaN/NaT"""
+        with self._lock:
+            columns = OrderedDict([("code", self.codes), ("time", self._time.copy())])
+            for name, values in self._values.items():
+                columns[name] = values.copy()
+        return pd.DataFrame(columns, copy=False)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers,
+                thread_name_prefix="jqdatahttp-quote",
+            )
+        return self._executor
+
+    def _fetch(self, code):
+        data = (self.api or api).get_current_ticks(code=code)
+        if not data.strip():
+            return None
+        ticks = _parse_records(data, _current_ticks_dtypes)
+        names = ticks.dtype.names
+        if "code" not in names or "time" not in names:
+            raise JQDataError("get_current_ticks 的返回结果缺少 code 或 time 字段")
+        return ticks
+
+    def _positions(self, codes):
+        """各行在快照数组中的位置，不在 codes 中的行为 -1"""
+        idx = np.searchsorted(self._sorted_codes, codes)
+        idx[idx >= self._sorted_codes.size] = 0
+        found = self._sorted_codes[idx] == codes
+        return np.where(found, self._order[idx], -1)
+
+    def _update(self, arrays):
+        """用各分片的结构化数组更新快照数组，返回有变化的行"""
+        positions, times = [], []
+        new_values = OrderedDict((name, []) for name in self.fields)
+        for ticks in arrays:
+            pos = self._positions(ticks["code"])
+            valid = pos >= 0
+            positions.append(pos[valid])
+            times.append(_array2datetime64(ticks["time"][valid]))
+            for name, values in new_values.items():
+                if name in ticks.dtype.names:
+                    values.append(ticks[name][valid].astype("f8"))
+                else:
+                    values.append(np.full(valid.sum(), np.nan))
+        pos = np.concatenate(positions) if positions else np.empty(0, np.intp)
+        times = np.concatenate(times) if times else self._time[:0]
+        for name, values in new_values.items():
+            new_values[name] = np.concatenate(values) if values else np.empty(0)
+
+        with self._lock:
+            old = self._time[pos]
+            changed = (times != old) & ~(np.isnat(times) & np.isnat(old))
+            for name, values in new_values.items():
+                old = self._values[name][pos]
+                changed |= (values != old) & ~(np.isnan(values) & np.isnan(old))
+            self._time[pos] = times
+            for name, values in new_values.items():
+                self._values[name][pos] = values
+
+        columns = OrderedDict([
+            ("code", self.codes[pos[changed]]), ("time", times[changed]),
+        ])
+        for name, values in new_values.items():
+            columns[name] = values[changed]
+        return pd.DataFrame(columns, copy=False), pos.size
+
+    def poll(self, scheduled=None):
+        """立即轮询一轮，返回 (changes, stats)，不调用 on_update
+
+        部分分片请求失败时只输出警告日志，该分片的标的保持上一轮的行情
+        """
+        started = datetime.datetime.now()
+        start_time = time.time()
+        executor = self._get_executor()
+        futures = [executor.submit(self._fetch, chunk) for chunk in self._chunks]
+        arrays = []
+        errors = 0
+        for future in futures:
+            try:
+                ticks = future.result()
+            except Exception as ex:
+                errors += 1
+                logger.warning("poll current ticks error: %s", ex)
+                continue
+            if ticks is not None and ticks.size:
+                arrays.append(ticks)
+        changes, rows = self._update(arrays)
+        stats = PollStats(
+            scheduled=scheduled or started,
+            lag=(started - scheduled).total_seconds() if scheduled else 0.0,
+            latency=time.time() - start_time,
+            requests=len(futures),
+            errors=errors,
+            rows=rows,
+            changed=len(changes),
+            missed=0,
+        )
+        return changes, stats
+
+    def _is_trading_day(self, date):
+        if self._calendar_day != datetime.date.today():
+            try:
+                self._calendar = get_trading_calendar()
+            except Exception as ex:
+                logger.warning("get trading calendar error: %s", ex)
+                self._calendar = None
+            self._calendar_day = datetime.date.today()
+        calendar = self._calendar
+        if calendar is None or date > calendar.dates[-1]:
+            # 交易日历不可用时按周一至周五为交易日处理
+            return date.weekday() < 5
+        return calendar.is_trading_day(date)
+
+    def next_poll_time(self, now=None):
+        """now 之后（不包含 now）的下一个轮询时间，sessions 为 None 时按全天对齐"""
+        now = now or datetime.datetime.now()
+        interval = datetime.timedelta(seconds=self.interval)
+        if self.sessions is None:
+            start = datetime.datetime.combine(now.date(), datetime.time())
+            return start + ((now - start) // interval + 1) * interval
+        for offset in range(30):
+            date = now.date() + datetime.timedelta(days=offset)
+            if not self._is_trading_day(date):
+                continue
+            for start_time, end_time in self.sessions:
+                start = datetime.datetime.combine(date, start_time)
+                end = datetime.datetime.combine(date, end_time)
+                if now < start:
+                    return start
+                scheduled = start + ((now - start) // interval + 1) * interval
+                if scheduled <= end:
+                    return scheduled
+        return None
+
+    def _run_once(self, scheduled):
+        changes, stats = self.poll(scheduled)
+        elapsed = (datetime.datetime.now() - scheduled).total_seconds()
+        if elapsed >= self.interval:
+            # 本轮结束时已经错过的轮次，下一轮从之后的对齐时间开始
+            stats = stats._replace(missed=int(elapsed // self.interval))
+            logger.warning(
+                "quote polling falls behind: lag %.3fs, latency %.3fs, "
+                "%d cycles missed", stats.lag, stats.latency, stats.missed,
+            )
+        self.history.append(stats)
+        if self.on_update is not None and len(changes):
+            try:
+                self.on_update(changes, stats)
+            except Exception:
+                logger.exception("quote poller on_update error")
+        return self.next_poll_time(max(datetime.datetime.now(), scheduled))
+
+    def run(self):
+        """在当前线程中按固定节奏轮询，直到调用 stop"""
+        next_time = self.next_poll_time()
+        while next_time is not None and not self._stop_event.is_set():
+            wait = (next_time - datetime.datetime.now()).total_seconds()
+            if wait > 0 and self._stop_event.wait(wait):
+                break
+            next_time = self._run_once(next_time)
+
+    def start(self):
+        """在后台线程中开始轮询"""
+        if self.running:
+            return self
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self.run, name="jqdatahttp-quote-poller", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self, wait=True):
+        """停止轮询，wait 为 True 时等待正在进行的一轮结束"""
+        self._stop_event.set()
+        thread = self._thread
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
 
 
 def get_ticks(security, start_dt=None, end_dt=None, count=None, fields=None,
-              skip=True, df=True):
-    """获取 Tick 数据"""
+              skip=True, df=True, max_workers=None, executor=None,
+              output_format=None, chunk_rows=_PERIOD_CHUNK_ROWS):
+    """获取 Tick 数据
+
+    查询多个标的时，max_workers 指定并发请求数（默认为 api.max_workers），
+    也可以通过 executor 参数指定执行请求的线程池。
+    output_format 为 df 为 True 时返回数据的格式，支持 pandas、arrow、polars。
+    按时间段查询时，chunk_rows 的说明见 get_bars_period
+    """
     is_list_security = isinstance(security, (tuple, list, set)) or ',' in security
     security = _convert_security(security)
     end_dt = to_datetime(end_dt) if end_dt else datetime.datetime.now()
     if count:
         assert count > 0
-        get_data = functools.partial(
-            api.get_ticks, count=count, end_date=end_dt, skip=skip
+
+        def get_code_ticks(code):
+            data = api.get_ticks(
+                code=code, count=count, end_date=end_dt, skip=skip, stream=True
+            )
+            return _parse_ticks(data, fields)
+
+        ticks_mapping = _map_securities(
+            get_code_ticks, security, max_workers=max_workers, executor=executor
         )
     else:
         start_dt = to_datetime(start_dt if start_dt else end_dt.date())
-        get_data = functools.partial(
-            api.get_ticks_period, date=start_dt, end_date=end_dt, skip=skip
-        )
 
-    ticks_mapping = {}
-    for code in security:
-        data = get_data(code=code)
-        header = [
-            item.strip() for item in data.split('\n', 1)[0].split(',') if item
-        ]
-        dtype = [(col, _tick_data_dtypes[col]) for col in header]
-        ticks = _csv2array(data, dtype=dtype, skip_header=1)
-        if "time" in ticks.dtype.names:
-            ticks["time"] = ticks["time"].astype(str)
-        ticks_mapping[code] = ticks[fields] if fields else ticks
+        def get_period_ticks(code, start, end):
+            data = api.get_ticks_period(
+                code=code, date=start, end_date=end, skip=skip, stream=True
+            )
+            return _parse_ticks(data)
 
-    if df:
-        dfs = []
-        for code, arr in ticks_mapping.items():
-            index = [[code] * arr.size, list(range(arr.size))]
-            dfs.append(pd.DataFrame(data=arr, index=index))
-        df = pd.concat(dfs, copy=False)
-        if "time" in df:
-            df["time"] = pd.to_datetime(df.time)
-        return df
-    else:
-        if is_list_security or len(ticks_mapping) > 1:
-            return ticks_mapping
-        else:
-            _, ticks = ticks_mapping.popitem()
-            return ticks
+        chunks = _split_period(
+            start_dt, end_dt, _TICKS_PER_TRADE_DAY, chunk_rows
+        )
+        ticks_mapping = _map_periods(
+            get_period_ticks, security, chunks, "time", fields=fields,
+            max_workers=max_workers, executor=executor,
+        )
+    return _format_ticks(ticks_mapping, is_list_security, df, output_format)
 
 
 def get_extras(info, security_list, start_date=None, end_date=None, df=True, count=None):
@@ -1050,7 +4857,8 @@ def get_extras(info, security_list, start_date=None, end_date=None, df=True, cou
         }
 
 
-def get_fundamentals(code, date, table, count=None, columns=None):
+def get_fundamentals(code, date, table, count=None, columns=None,
+                     output_format=None):
     """查询财务数据
 
     参数：
@@ -1063,36 +4871,72 @@ def get_fundamentals(code, date, table, count=None, columns=None):
         count: 查询条数，最多查询 1000 条，count 个自然日之前的数据将被过滤掉
             不填 count 时按 date 查询
         columns: 需要查询的字段，为空时则查询所有字段
+        output_format: 返回数据的格式，支持 pandas、arrow、polars
     """
     code_list = _convert_security(code)
     data = api.get_fundamentals(
         code=code_list, date=date, table=table, count=count, columns=columns
     )
-    return _csv2df(data)
+    return _csv2table(data, output_format=output_format)
+
+
+def _listed_securities(types, start_date, end_date):
+    """在 start_date 到 end_date 之间任意一天上市中的标的代码列表"""
+    df = get_all_securities(types)
+    start = np.datetime64(to_date(start_date), "D")
+    end = np.datetime64(to_date(end_date), "D")
+    listed = _array2datetime64(df["start_date"].values, unit="D") <= end
+    delisted = _array2datetime64(df["end_date"].values, unit="D") < start
+    return df.index[listed & ~delisted].tolist()
+
 
+# get_billboard_list 默认的并发请求数，不指定 stock_list 时需要请求数千次
+_BILLBOARD_MAX_WORKERS = 8
 
-def get_billboard_list(stock_list=None, start_date=None, end_date=None, count=None):
-    """获取指定日期区间内的龙虎榜数据"""
+
+def get_billboard_list(stock_list=None, start_date=None, end_date=None,
+                       count=None, max_workers=_BILLBOARD_MAX_WORKERS,
+                       max_requests=None):
+    """获取指定日期区间内的龙虎榜数据
+
+    每个标的只请求一次整个日期区间的数据，不指定 stock_list 时查询区间内
+    上市过的所有股票。请求前会估算请求次数，超过 max_requests 时抛出 ParamsError。
+    max_workers 为并发请求数，默认为 8，为 None 时使用 api.max_workers
+    """
     trade_days = get_trade_days(start_date, end_date, count)
-    df_list = []
+    if not len(trade_days):
+        return pd.DataFrame()
+    start_date, end_date = trade_days[0], trade_days[-1]
     if stock_list:
         stock_list = _convert_security(stock_list)
-        start_date, end_date = trade_days[0], trade_days[-1]
-        if start_date == end_date:
-            end_date = None
-        for stock in stock_list:
-            data = api.get_billboard_list(
-                code=stock, date=start_date, end_date=end_date
-            )
-            df = _csv2df(data)
-            df_list.append(df)
     else:
-        for date in trade_days:
-            for stock in get_all_securities("stock", date).index:
-                data = api.get_billboard_list(code=stock, date=date)
-                df = _csv2df(data)
-                df_list.append(df)
-    return pd.concat(df_list)
+        stock_list = _listed_securities("stock", start_date, end_date)
+    logger.info(
+        "get_billboard_list will make %d requests from %s to %s",
+        len(stock_list), start_date, end_date
+    )
+    if max_requests is not None and len(stock_list) > max_requests:
+        raise ParamsError(
+            "查询龙虎榜数据需要请求 {} 次，超过了 max_requests={}".format(
+                len(stock_list), max_requests
+            )
+        )
+    if start_date == end_date:
+        end_date = None
+
+    def get_code_billboard(code):
+        data = api.get_billboard_list(
+            code=code, date=start_date, end_date=end_date
+        )
+        return _csv2df(data) if data.strip() else None
+
+    results = _map_securities(
+        get_code_billboard, stock_list, max_workers=max_workers
+    )
+    df_list = [df for df in results.values() if df is not None and len(df)]
+    if not df_list:
+        return pd.DataFrame()
+    return pd.concat(df_list, ignore_index=True)
 
 
 def get_locked_shares(stock_list=None, start_date=None, end_date=None, forward_count=None):
@@ -1223,16 +5067,95 @@ def get_all_factors():
     return _csv2df(api.get_all_factors())
 
 
-def get_factor_values(securities, factors=None, start_date=None, end_date=None, count=None):
-    """获取因子数据"""
-    securities = _convert_security(securities)
-
+def _convert_factors(factors):
     if factors is None:
         factors = ['VEMA5']
     elif is_string_types(factors):
         factors = factors.strip().split(',') if ',' in factors else [factors]
     if not isinstance(factors, (tuple, list, set)):
         raise Exception("Parameter 'factors' type error")
+    return factors
+
+
+def _default_factor_dates(start_date, end_date):
+    if start_date and not end_date:
+        end_date = datetime.date.today()
+    elif not start_date and end_date:
+        start_date = datetime.date(2005, 1, 1)
+    return start_date, end_date
+
+
+# 因子数据的三维数组形式，values[i, j, k] 为因子 factors[i] 在
+# dates[j]（datetime64[D]）时标的 codes[k] 的值，缺失的值为 NaN
+FactorValues = namedtuple("FactorValues", ["values", "factors", "dates", "codes"])
+
+
+def _parse_factor_values(data, factors):
+    """解析单个标的的因子数据为结构化数组，日期字段为 datetime64[D]，因子字段为 float64"""
+    header = [
+        item.strip() for item in data.split("\n", 1)[0].split(",") if item.strip()
+    ] if data else []
+    if not header:
+        return np.empty(0, dtype=[("date", "M8[D]")])
+    dtype = np.dtype([
+        (col, "M8[D]" if col == "date" else "f8" if col in factors else "U32")
+        for col in header
+    ])
+    return _csv2array(data, dtype=dtype, skip_header=1)
+
+
+def _format_factor_values(arrays_mapping, factors, ndarray=False):
+    """将各标的的因子数据整理为以因子名为键的 pandas.DataFrame 字典
+
+    所有标的、所有因子的数据一次性写入 (因子, 日期, 标的) 的三维数组，
+    各因子的 DataFrame 为其中一层的视图，不再逐个因子 pivot。
+    ndarray 为 True 时直接返回 FactorValues
+    """
+    codes = list(arrays_mapping)
+    arrays = [arr for arr in arrays_mapping.values()]
+    sizes = [arr.size for arr in arrays]
+    filled = [arr for arr in arrays if arr.size]
+    if filled:
+        dates, rows = np.unique(_array2datetime64(
+            np.concatenate([arr["date"] for arr in filled]), unit="D"
+        ), return_inverse=True)
+        cols = np.repeat(np.arange(len(codes)), sizes)
+        stacked = np.stack([
+            np.concatenate([_bars_column(arr, factor) for arr in filled])
+            for factor in factors
+        ])
+    else:
+        dates = np.empty(0, dtype="M8[D]")
+    values = np.full((len(factors), dates.size, len(codes)), np.nan)
+    if filled:
+        values[:, rows, cols] = stacked
+
+    if ndarray:
+        return FactorValues(values, list(factors), dates, codes)
+    if _datetime_as_object:
+        index = pd.Index(dates.astype(object), name="date")
+    else:
+        index = pd.DatetimeIndex(dates, name="date")
+    columns = pd.Index(codes, name="code")
+    return {
+        factor: pd.DataFrame(values[idx], index=index, columns=columns,
+                             copy=False)
+        for idx, factor in enumerate(factors)
+    }
+
+
+def get_factor_values(securities, factors=None, start_date=None, end_date=None,
+                      count=None, ndarray=False, max_workers=None,
+                      executor=None):
+    """获取因子数据
+
+    返回以因子名为键、以日期为索引、以标的为列的 pandas.DataFrame 字典，
+    ndarray 为 True 时返回 FactorValues（因子 × 日期 × 标的的三维数组）。
+    接口每次只能查询一个标的，查询多个标的时 max_workers 指定并发请求数
+    （默认为 api.max_workers），也可以通过 executor 参数指定执行请求的线程池
+    """
+    securities = _convert_security(securities)
+    factors = _convert_factors(factors)
 
     start_date = to_date(start_date)
     end_date = to_date(end_date)
@@ -1240,32 +5163,25 @@ def get_factor_values(securities, factors=None, start_date=None, end_date=None,
     if count:
         dates = get_trade_days(start_date, end_date, count)
         start_date, end_date = dates[0], dates[-1]
-    elif start_date and not end_date:
-        end_date = datetime.date.today()
-    elif not start_date and end_date:
-        start_date = datetime.date(2005, 1, 1)
+    else:
+        start_date, end_date = _default_factor_dates(start_date, end_date)
 
     factors_str = ','.join(factors)
-    dfs = []
-    for code in securities:
+
+    def get_code_factor_values(code):
         data = api.get_factor_values(
             code=code,
             date=start_date,
             end_date=end_date,
             columns=factors_str,
         )
-        df = _csv2df(data)
-        df["code"] = code
-        dfs.append(df)
-
-    all_data = pd.concat(dfs)
-    data_dict = {}
-    for factor in factors:
-        pretty_data = all_data.pivot(
-            index='date', columns='code', values=factor
-        )
-        data_dict[factor] = pretty_data.astype("float64").fillna(np.nan)
-    return data_dict
+        return _parse_factor_values(data, factors)
+
+    arrays_mapping = _map_securities(
+        get_code_factor_values, securities, max_workers=max_workers,
+        executor=executor
+    )
+    return _format_factor_values(arrays_mapping, factors, ndarray)
 
 
 def get_factor_style_returns(factors, start_date=None, end_date=None,
@@ -1345,3 +5261,207 @@ def get_pause_stocks(date):
     data = api.get_pause_stocks(date=date)
     stocks = data.strip().split()
     return stocks
+
+
+# asyncio 版 JQDataSDK 兼容接口，使用 async_api 请求数据，
+# 多标的查询时各标的并发请求，并发数受 async_api.max_concurrency 限制
+
+
+async def _gather_securities(func, securities):
+    """并发执行 func(code) 协程，返回按 securities 顺序排列的字典"""
+    async def call(code):
+        try:
+            return await func(code)
+        except Exception as ex:
+            raise _attach_security(ex, code)
+
+    tasks = [asyncio.ensure_future(call(code)) for code in securities]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return dict(zip(securities, results))
+
+
+async def get_security_info_async(code, date=None):
+    """获取股票/基金/指数的信息
+
+    证券主数据由同步接口加载，这里只使用已加载的数据，查询不到时请求接口
+    """
+    assert code, "code is required"
+    security = _master_security_info(code, load=False)
+    if security is not None:
+        return security
+    data = await async_api.get_security_info(code=code)
+    return _parse_security_info(data)
+
+
+async def get_trading_calendar_async():
+    """获取交易日历，进程内保存与本地存储的说明见 get_trading_calendar"""
+    client = async_api
+    calendar = _memo_calendar(client)
+    if calendar is not None:
+        return calendar
+    calendar = _stored_calendar()
+    if calendar is None:
+        try:
+            data = await client.get_all_trade_days()
+        except Exception as ex:
+            return _fallback_calendar(client, ex)
+        calendar = _calendar_from_data(data)
+    return _set_memo_calendar(client, calendar)
+
+
+async def get_all_trade_days_async():
+    """获取所有交易日"""
+    return (await get_trading_calendar_async()).dates
+
+
+async def get_trade_days_async(start_date=None, end_date=None, count=None):
+    """获取指定日期范围内的所有交易日"""
+    calendar = await get_trading_calendar_async()
+    start, end = calendar._slice(start_date, end_date, count)
+    return calendar.dates[start:end]
+
+
+async def get_bars_async(security, count, unit="1d", fields=None,
+                         include_now=False, end_dt=None, fq_ref_date=None,
+                         df=True, output_format=None):
+    """获取历史数据(包含快照数据), 可查询单个标的多个数据字段"""
+    is_list_security = isinstance(security, (tuple, list, set)) or ',' in security
+    security = _convert_security(security)
+    assert count > 0
+    if end_dt:
+        end_dt = to_date(end_dt)  # HTTP 版只支持 date 参数
+    if fq_ref_date:
+        fq_ref_date = to_date(fq_ref_date)
+
+    async def get_code_bars(code):
+        data = await async_api.get_bars(
+            code=code,
+            count=int(count),
+            unit=unit,
+            end_date=end_dt,
+            fq_ref_date=fq_ref_date,
+        )
+        return _parse_bars(data, fields)
+
+    bars_mapping = await _gather_securities(get_code_bars, security)
+    return _format_bars(bars_mapping, is_list_security, df, output_format)
+
+
+async def get_bars_period_async(security, start_dt, end_dt, unit="1d",
+                                fields=None, fq_ref_date=None, df=True,
+                                output_format=None):
+    """获取指定时间段的行情数据，参数同 get_bars_period"""
+    is_list_security = isinstance(security, (tuple, list, set)) or ',' in security
+    security = _convert_security(security)
+    start_dt = to_datetime(start_dt)
+    end_dt = to_datetime(end_dt)
+    if fq_ref_date:
+        fq_ref_date = to_date(fq_ref_date)
+
+    async def get_code_bars(code):
+        data = await async_api.get_bars_period(
+            code=code,
+            date=start_dt,
+            end_date=end_dt,
+            unit=unit,
+            fq_ref_date=fq_ref_date,
+        )
+        return _parse_bars(data, fields)
+
+    bars_mapping = await _gather_securities(get_code_bars, security)
+    return _format_bars(bars_mapping, is_list_security, df, output_format)
+
+
+async def get_ticks_async(security, start_dt=None, end_dt=None, count=None,
+                          fields=None, skip=True, df=True,
+                          output_format=None):
+    """获取 Tick 数据"""
+    is_list_security = isinstance(security, (tuple, list, set)) or ',' in security
+    security = _convert_security(security)
+    end_dt = to_datetime(end_dt) if end_dt else datetime.datetime.now()
+    if count:
+        assert count > 0
+        get_data = functools.partial(
+            async_api.get_ticks, count=count, end_date=end_dt, skip=skip
+        )
+    else:
+        start_dt = to_datetime(start_dt if start_dt else end_dt.date())
+        get_data = functools.partial(
+            async_api.get_ticks_period, date=start_dt, end_date=end_dt,
+            skip=skip
+        )
+
+    async def get_code_ticks(code):
+        data = await get_data(code=code)
+        return _parse_ticks(data, fields)
+
+    ticks_mapping = await _gather_securities(get_code_ticks, security)
+    return _format_ticks(ticks_mapping, is_list_security, df, output_format)
+
+
+async def get_current_tick_async(security):
+    """获取最新的 tick 数据"""
+    if isinstance(security, Security):
+        security = security.code
+    data = await async_api.get_current_tick(code=security)
+    return _csv2df(data, dtype=_current_tick_dtype)
+
+
+async def get_current_ticks_async(security, chunk_size=None):
+    """获取多标的最新的 tick 数据
+
+    chunk_size 指定时，按每 chunk_size 个标的拆分为多个请求并发执行
+    """
+    security = _convert_security(security)
+    if not chunk_size:
+        chunk_size = len(security) or 1
+    chunks = [
+        ",".join(security[idx:(idx + chunk_size)])
+        for idx in range(0, len(security), chunk_size)
+    ]
+
+    async def get_chunk_ticks(codes):
+        return await async_api.get_current_ticks(code=codes)
+
+    results = await _gather_securities(get_chunk_ticks, chunks)
+    dfs = [
+        _csv2df(data, dtype=_current_ticks_dtype) for data in results.values()
+    ]
+    if len(dfs) == 1:
+        return dfs[0]
+    return pd.concat(dfs, ignore_index=True)
+
+
+async def get_factor_values_async(securities, factors=None, start_date=None,
+                                  end_date=None, count=None, ndarray=False):
+    """获取因子数据，返回值同 get_factor_values"""
+    securities = _convert_security(securities)
+    factors = _convert_factors(factors)
+
+    start_date = to_date(start_date)
+    end_date = to_date(end_date)
+
+    if count:
+        dates = await get_trade_days_async(start_date, end_date, count)
+        start_date, end_date = dates[0], dates[-1]
+    else:
+        start_date, end_date = _default_factor_dates(start_date, end_date)
+
+    factors_str = ','.join(factors)
+
+    async def get_code_factor_values(code):
+        data = await async_api.get_factor_values(
+            code=code,
+            date=start_date,
+            end_date=end_date,
+            columns=factors_str,
+        )
+        return _parse_factor_values(data, factors)
+
+    results = await _gather_securities(get_code_factor_values, securities)
+    return _format_factor_values(results, factors, ndarray)
@@ -3,14 +3,26 @@
 # Copyright (c) Huoty, All rights reserved
 # Author: Huoty <sudohuoty@163.com>
 
+import io
+import gzip
+import json
+import zlib
+import time
+import asyncio
 import datetime
 import functools
+import warnings
+import socket
+import threading
+import concurrent.futures
 from math import isclose
 from itertools import zip_longest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
+import pytest
 
 import jqdatahttp
-from jqdatahttp import JQDataApi
+from jqdatahttp import JQDataApi, JQDataError, InvalidTokenError
 
 
 def allclose(la, lb, *, rel_tol=1e-09, abs_tol=0.0):
@@ -19,6 +31,63 @@ def allclose(la, lb, *, rel_tol=1e-09, abs_tol=0.0):
     return True
 
 
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        params = json.loads(body)
+        with server.lock:
+            server.requests.append(dict(params))
+        method = params.pop("method")
+        handler = server.handlers.get(method)
+        if handler is None:
+            status, data = 200, "token-{}".format(len(server.requests))
+        else:
+            result = handler(params)
+            status, data = result if isinstance(result, tuple) else (200, result)
+        data = data.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        encoding = server.content_encoding
+        if encoding and encoding in self.headers.get("Accept-Encoding", ""):
+            if encoding == "gzip":
+                data = gzip.compress(data)
+            else:
+                data = zlib.compress(data)
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def mock_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.connection_count = 0
+    server.requests = []
+    server.handlers = {}
+    server.content_encoding = None
+    server.url = "http://127.0.0.1:{}/apis".format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
 class TestJQDataApi(object):
 
     def setup_class(cls):
@@ -422,3 +491,1277 @@ def test_get_pause_stocks():
     assert "688115.XSHG" in data
     data = jqdatahttp.get_pause_stocks(date=datetime.date.today())
     print(data)
+
+
+def test_keep_alive_pool(mock_server):
+    mock_server.handlers["get_security_info"] = lambda params: (
+        "code,display_name\n{},平安银行\n".format(params["code"])
+    )
+    api = JQDataApi(url=mock_server.url, token="token")
+    for idx in range(5):
+        data = api.get_security_info(code="00000{}.XSHE".format(idx))
+        assert data.startswith("code,display_name")
+    assert mock_server.connection_count == 1
+
+    api = JQDataApi(url=mock_server.url, token="token", keep_alive=False)
+    for idx in range(3):
+        api.get_security_info(code="00000{}.XSHE".format(idx))
+    assert mock_server.connection_count == 4
+
+
+def test_keep_alive_pool_prewarm(mock_server):
+    api = JQDataApi(url=mock_server.url, pool_size=4, pool_prewarm=3)
+    api.auth("user", "password")
+    assert api.token == "token-1"
+    assert api._pool.idle_count(mock_server.url) == 3
+    api.logout()
+    assert api._pool.idle_count() == 0
+
+
+def test_keep_alive_pool_errors(mock_server):
+    mock_server.handlers["get_bars"] = lambda params: (429, "")
+    mock_server.handlers["get_ticks"] = lambda params: (
+        200, "error: token无效，请重新获取"
+    )
+    mock_server.handlers["get_extras"] = lambda params: (
+        400, "error: 参数错误"
+    )
+    api = JQDataApi(url=mock_server.url, token="token")
+    with pytest.raises(JQDataError, match="请求频率过高"):
+        api.get_bars(code="000001.XSHE")
+    with pytest.raises(InvalidTokenError):
+        api.get_ticks(code="000001.XSHE")
+    with pytest.raises(JQDataError, match="参数错误"):
+        api.get_extras(code="000001.XSHE")
+    assert api.get_security_info(code="000001.XSHE")
+
+
+
+def test_keep_alive_pool_retries(mock_server):
+    mock_server.handlers["get_security_info"] = lambda params: (
+        "code,display_name\n{},平安银行\n".format(params["code"])
+    )
+
+    def slow_mtss(params):
+        time.sleep(1)
+        return "date,sec_code,fin_value\n"
+
+    mock_server.handlers["get_mtss"] = slow_mtss
+    api = JQDataApi(url=mock_server.url, token="token", pool_size=5)
+
+    # 复用的连接已被关闭时只在新建的连接上重试一次
+    api._pool.prewarm(mock_server.url, 2)
+    for conn, _ in api._pool._idle_conns.values().__iter__().__next__():
+        conn.sock.shutdown(socket.SHUT_RDWR)
+    assert api.get_security_info(code="000001.XSHE").startswith("code")
+    assert mock_server.connection_count == 3
+    assert api._pool.idle_count() == 2
+
+    # 超时不换连接重试，服务端收到的请求数与请求次数相同
+    api._pool.prewarm(mock_server.url, 5)
+    started = time.time()
+    with pytest.raises(socket.timeout):
+        api.get_mtss(code="000001.XSHE", request_timeout=0.2,
+                     request_attempt_count=2)
+    assert time.time() - started < 1.5
+    assert [r["method"] for r in mock_server.requests].count("get_mtss") == 2
+
+def _mock_bars(params):
+    code = params["code"]
+    if code.startswith("ERR"):
+        return 400, "error: 找不到标的{}".format(code)
+    price = int(code[:6]) % 100
+    lines = ["date,open,close,high,low,volume,money"]
+    for idx in range(int(params.get("count", 3))):
+        lines.append("2021-03-{:02d},{},{},{},{},100,1000".format(
+            idx + 1, price, price + 1, price + 2, price - 1
+        ))
+    return "\n".join(lines) + "\n"
+
+
+def test_get_bars_concurrently(mock_server, monkeypatch):
+    mock_server.handlers["get_bars"] = _mock_bars
+    monkeypatch.setattr(jqdatahttp, "api", JQDataApi(
+        url=mock_server.url, token="token"
+    ))
+    codes = ["0000{:02d}.XSHE".format(idx) for idx in range(1, 21)]
+    expected = jqdatahttp.get_bars(codes, count=3, max_workers=1)
+    data = jqdatahttp.get_bars(codes, count=3, max_workers=8)
+    assert list(data.index.get_level_values(0).unique()) == codes
+    assert data.equals(expected)
+
+    mapping = jqdatahttp.get_bars(codes, count=3, max_workers=8, df=False)
+    assert isinstance(mapping, dict) and list(mapping) == codes
+    assert mapping["000012.XSHE"]["open"][0] == 12
+
+    with pytest.raises(JQDataError, match="ERR001.XSHE") as excinfo:
+        jqdatahttp.get_bars(codes + ["ERR001.XSHE"], count=3, max_workers=8)
+    assert excinfo.value.security == "ERR001.XSHE"
+
+
+def test_async_api(mock_server, monkeypatch):
+    mock_server.handlers["get_bars"] = _mock_bars
+    mock_server.handlers["get_security_info"] = lambda params: (
+        "code,display_name,name,start_date,end_date,type,parent\n"
+        "{},平安银行,PAYH,1991-04-03,2200-01-01,stock,\n".format(params["code"])
+    )
+    mock_server.handlers["get_extras"] = lambda params: (
+        200, "error: token无效，请重新获取"
+    ) if params["token"] == "token-1" else "date,is_st\n2021-01-04,0\n"
+    api = jqdatahttp.AsyncJQDataApi(url=mock_server.url, max_concurrency=4)
+    monkeypatch.setattr(jqdatahttp, "async_api", api)
+    codes = ["0000{:02d}.XSHE".format(idx) for idx in range(1, 31)]
+
+    async def main():
+        # 并发请求时只获取一次 token
+        await asyncio.gather(*[
+            api.get_security_info(code=code) for code in codes[:5]
+        ])
+        assert [item["method"] for item in mock_server.requests].count(
+            "get_current_token"
+        ) == 1
+        # token 失效后自动重新获取
+        data = await api.get_extras(code="000001.XSHE", auto_format_result=True)
+        assert data["is_st"].tolist() == [0]
+        info = await jqdatahttp.get_security_info_async("000001.XSHE")
+        assert info.display_name == "平安银行"
+        data = await jqdatahttp.get_bars_async(codes, count=3)
+        assert list(data.index.get_level_values(0).unique()) == codes
+        with pytest.raises(JQDataError, match="ERR001.XSHE"):
+            await jqdatahttp.get_bars_async(codes + ["ERR001.XSHE"], count=3)
+        return data
+
+    data = asyncio.run(main())
+    assert data.loc["000012.XSHE", "open"].tolist() == [12, 12, 12]
+    assert mock_server.connection_count <= 4
+
+
+def test_is_cacheable_request():
+    today = datetime.date(2021, 6, 10)
+    is_cacheable = functools.partial(
+        jqdatahttp._is_cacheable_request, today=today
+    )
+    assert is_cacheable("get_bars", {"code": "a", "end_date": "2021-06-09"})
+    assert not is_cacheable("get_bars", {"code": "a", "end_date": "2021-06-10"})
+    assert not is_cacheable("get_bars", {"code": "a", "count": 10})
+    assert not is_cacheable("get_bars", {
+        "code": "a", "end_date": "2021-06-09", "fq_ref_date": "2021-06-10"
+    })
+    assert is_cacheable("get_ticks_period", {
+        "date": "2021-06-08 09:30:00", "end_date": "2021-06-09 15:00:00"
+    })
+    assert is_cacheable("get_fundamentals", {"date": "2021q1"})
+    assert not is_cacheable("get_fundamentals", {"date": "2021q2"})
+    assert not is_cacheable("get_fundamentals", {"date": "2021"})
+    assert not is_cacheable("get_fq_factor", {
+        "date": "2021-06-01", "end_date": "2021-06-09", "fq": "pre"
+    })
+    assert not is_cacheable("get_security_info", {"code": "000001.XSHE"})
+
+
+def test_disk_cache(mock_server, tmp_path):
+    mock_server.handlers["get_bars"] = _mock_bars
+    api = JQDataApi(url=mock_server.url)
+    cache = api.enable_cache(str(tmp_path), max_size=2000)
+    params = dict(code="000001.XSHE", count=5, end_date="2021-03-01")
+    data = api.get_bars(**params)
+    assert api.get_bars(**params) == data
+    # 命中缓存时不需要获取 token
+    assert [item["method"] for item in mock_server.requests] == [
+        "get_current_token", "get_bars"
+    ]
+    assert cache.hits == 1
+    assert api.get_bars(code="000001.XSHE", count=5) == data
+    assert len(mock_server.requests) == 3
+
+    for idx in range(20):
+        api.get_bars(code="0000{:02d}.XSHE".format(idx), count=50,
+                     end_date="2021-03-01")
+    assert 0 < cache.size() <= 2000
+    api.disable_cache()
+    api.get_bars(**params)
+    assert len(mock_server.requests) == 24
+
+
+def test_token_store(mock_server, tmp_path):
+    mock_server.handlers["get_extras"] = lambda params: (
+        200, "error: token无效，请重新获取"
+    ) if params["token"] == "token-1" else "date,is_st\n2021-01-04,0\n"
+    methods = lambda: [item["method"] for item in mock_server.requests]  # noqa
+
+    api1 = JQDataApi(url=mock_server.url, pool_prewarm=0)
+    api1.enable_token_store(str(tmp_path))
+    api1.auth("user", "password")
+    assert api1.token == "token-1"
+
+    # 新的进程直接使用已保存的 token
+    api2 = JQDataApi(url=mock_server.url, pool_prewarm=0)
+    api2.enable_token_store(str(tmp_path))
+    api2.auth("user", "password")
+    assert api2.token == "token-1"
+    assert methods() == ["get_current_token"]
+
+    # token 失效后只刷新一次
+    assert api2.get_extras(code="000001.XSHE").startswith("date")
+    assert api1.get_extras(code="000001.XSHE").startswith("date")
+    assert api1.token == api2.token == "token-3"
+    assert methods().count("get_current_token") == 2
+
+    api3 = JQDataApi(url=mock_server.url, pool_prewarm=0)
+    api3.enable_token_store(str(tmp_path))
+    api3.auth("other", "password")
+    assert api3.token != api1.token
+
+
+def test_rate_limiter(tmp_path):
+    path = str(tmp_path / "ratelimit")
+    limiter1 = jqdatahttp._RateLimiter(20, burst=5, path=path)
+    limiter2 = jqdatahttp._RateLimiter(20, burst=5, path=path)
+    start = time.time()
+    for idx in range(15):
+        (limiter1 if idx % 2 else limiter2).acquire()
+    # 突发的 5 个请求之后，剩余的 10 个请求按每秒 20 个的速率放行
+    assert 0.4 < time.time() - start < 1.0
+
+    limiter = jqdatahttp._RateLimiter(100, burst=1)
+    assert limiter.try_acquire() == 0
+    assert 0 < limiter.try_acquire() <= 0.01
+
+
+def test_rate_limit_retry_429(mock_server, tmp_path):
+    responses = iter([(429, ""), (200, "date,is_st\n2021-01-04,0\n")])
+    mock_server.handlers["get_extras"] = lambda params: next(responses)
+    api = JQDataApi(url=mock_server.url, token="token")
+    api.enable_rate_limit(100, path=str(tmp_path / "ratelimit"))
+    assert api.get_extras(code="000001.XSHE").startswith("date")
+
+
+def test_async_rate_limit_off_loop(mock_server, tmp_path):
+    mock_server.handlers["get_extras"] = lambda params: "date,is_st\n2021-01-04,0\n"
+    api = jqdatahttp.AsyncJQDataApi(url=mock_server.url, token="token")
+    api.enable_rate_limit(100, path=str(tmp_path / "ratelimit"))
+    try_acquire = api._rate_limiter.try_acquire
+
+    def slow_try_acquire():
+        # 模拟限速文件被其他进程长时间锁住
+        time.sleep(0.3)
+        return try_acquire()
+
+    api._rate_limiter.try_acquire = slow_try_acquire
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.time())
+            await asyncio.sleep(0.02)
+
+    async def main():
+        return (await asyncio.gather(
+            ticker(), api.get_extras(code="000001.XSHE")
+        ))[1]
+
+    assert asyncio.run(main()).startswith("date")
+    # 等待限流时事件循环上的其他协程照常运行
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.2
+
+
+def test_csv2array():
+    np = jqdatahttp.np
+    dtype = [
+        ("date", "O"), ("open", "<f8"), ("paused", "<i1"), ("volume", "<f8")
+    ]
+    header = "date,open,paused,volume\n"
+    payloads = [
+        "2021-01-01,1.5,0,100\n2021-01-02,2.5,1,200\n",
+        "2021-01-01,1.5,0,100\n",
+        "2021-01-01,1.5,0,100",
+        "2021-01-01,,1,\n2021-01-02,nan,,2\n,1,1,1\n",
+        "2021-01-01,1.5,0.0,1e3\n",
+        "2021-01-01,1.5,True,abc\n",
+        "",
+    ]
+    for payload in payloads:
+        data = header + payload
+        arr = jqdatahttp._csv2array(data, dtype=dtype, skip_header=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = np.genfromtxt(
+                io.StringIO(data), dtype=dtype, delimiter=",",
+                skip_header=1, encoding="utf-8"
+            )
+        expected = np.atleast_1d(expected)
+        assert arr.dtype == expected.dtype and arr.shape == expected.shape
+        for name in arr.dtype.names:
+            assert np.array_equal(arr[name], expected[name], equal_nan=(
+                arr.dtype[name].kind == "f"
+            )), (payload, name)
+
+
+def test_datetime_conversion():
+    np = jqdatahttp.np
+    pd = jqdatahttp.pd
+    Date = datetime.date
+    DateTime = datetime.datetime
+
+    dates = jqdatahttp.to_date(["2021-01-04", "20210105", b"2021/01/06", ""])
+    assert dates.dtype == np.dtype("datetime64[D]")
+    assert list(dates[:3]) == [
+        np.datetime64("2021-01-04"), np.datetime64("2021-01-05"),
+        np.datetime64("2021-01-06"),
+    ]
+    assert np.isnat(dates[3])
+    times = jqdatahttp.to_datetime(np.array(
+        [b"2021-03-04 22:56:00", b"2021-03-04 09:30:03.500"], dtype=object
+    ))
+    assert times.dtype == np.dtype("datetime64[ns]")
+    assert times[1] == np.datetime64("2021-03-04T09:30:03.500")
+    series = jqdatahttp.to_datetime(pd.Series(["20210104093000"], index=[3]))
+    assert series.index.tolist() == [3]
+    assert series.iloc[0] == pd.Timestamp("2021-01-04 09:30:00")
+    assert jqdatahttp.to_date("2021-01-04") == Date(2021, 1, 4)
+    assert jqdatahttp.to_datetime("20210104") == DateTime(2021, 1, 4)
+
+    bars = jqdatahttp._parse_bars("date,open\n2021-03-04 22:56:00,1.5\n")
+    assert bars.dtype["date"] == np.dtype("datetime64[ns]")
+    ticks = jqdatahttp._parse_ticks("time,current\n2021-03-04 09:30:03,1.5\n")
+    assert ticks.dtype["time"] == np.dtype("datetime64[ns]")
+    df = jqdatahttp._format_ticks({"A": ticks}, False, True)
+    assert df["time"].iloc[0] == pd.Timestamp("2021-03-04 09:30:03")
+
+    jqdatahttp.set_datetime_as_object(True)
+    try:
+        assert list(jqdatahttp.to_date(["2021-01-04"])) == [Date(2021, 1, 4)]
+        bars = jqdatahttp._parse_bars("date,open\n2021-03-04 22:56:00,1.5\n")
+        assert bars["date"][0] == DateTime(2021, 3, 4, 22, 56)
+        ticks = jqdatahttp._parse_ticks("time,current\n2021-03-04 09:30:03,1\n")
+        assert ticks["time"][0] == "2021-03-04 09:30:03"
+    finally:
+        jqdatahttp.set_datetime_as_object(False)
+
+
+def test_stream_response(mock_server):
+    payload = "date,open,close\n" + "".join(
+        "2021-03-{:02d},{}.5,{}\n".format(idx % 28 + 1, idx, idx)
+        for idx in range(500)
+    )
+    mock_server.handlers["get_bars"] = lambda params: payload
+    mock_server.handlers["get_security_info"] = lambda params: (
+        "code,display_name\n000001.XSHE,平安银行\n" * 50
+    )
+    mock_server.handlers["get_extras"] = lambda params: (
+        200, "error: token无效，请重新获取"
+    ) if params["token"] == "token-1" else "date,is_st\n2021-01-04,0\n"
+    api = JQDataApi(url=mock_server.url)
+    api.stream_chunk_size = 7
+
+    blocks = list(api.get_bars(code="000001.XSHE", stream=True))
+    assert len(blocks) > 1 and all(item.endswith("\n") for item in blocks)
+    assert "".join(blocks) == payload
+    # 多字节字符被截断在两块之间时也能正确解码
+    blocks = api.get_security_info(code="000001.XSHE", stream=True)
+    assert "".join(blocks).count("平安银行") == 50
+
+    bars = jqdatahttp._parse_bars(
+        api.get_bars(code="000001.XSHE", stream=True)
+    )
+    expected = jqdatahttp._parse_bars(payload)
+    assert bars.size == 500 and (bars == expected).all()
+
+    # 错误信息在返回之前就会抛出，token 失效时自动重新获取
+    blocks = api.get_extras(code="000001.XSHE", stream=True)
+    assert "".join(blocks) == "date,is_st\n2021-01-04,0\n"
+    api.set_token("token-1")
+    with pytest.raises(InvalidTokenError):
+        api.get_extras(code="000001.XSHE", stream=True)
+
+    # 读取完毕的连接会被放回连接池
+    assert api._pool.idle_count() == 1
+    api.close()
+
+
+def test_compressed_response(mock_server):
+    payload = "date,open,close\n" + "2021-03-04,1.5,2.5\n" * 2000
+    mock_server.handlers["get_bars"] = lambda params: payload
+    mock_server.handlers["get_extras"] = lambda params: (
+        400, "error: 找不到标的{}".format(params["code"])
+    )
+    api = JQDataApi(url=mock_server.url, token="token")
+    api.stream_chunk_size = 64
+    for encoding in ["gzip", "deflate"]:
+        mock_server.content_encoding = encoding
+        assert api.get_bars(code="000001.XSHE") == payload
+        info = api.last_transfer
+        assert info.method == "get_bars" and info.content_encoding == encoding
+        assert info.size == len(payload) and info.raw_size < len(payload) / 10
+
+        blocks = list(api.get_bars(code="000001.XSHE", stream=True))
+        assert "".join(blocks) == payload
+        assert api.last_transfer.raw_size == info.raw_size
+
+        with pytest.raises(JQDataError, match="找不到标的"):
+            api.get_extras(code="000001.XSHE")
+
+    api.compress = False
+    assert api.get_bars(code="000001.XSHE") == payload
+    assert api.last_transfer.content_encoding is None
+    assert api.last_transfer.raw_size == len(payload)
+
+    async_api = jqdatahttp.AsyncJQDataApi(url=mock_server.url, token="token")
+    data = asyncio.run(async_api.get_bars(code="000001.XSHE"))
+    assert data == payload
+    assert async_api.last_transfer.content_encoding == "deflate"
+
+
+def test_benchmarks(tmp_path, capsys):
+    import benchmarks
+    baseline = str(tmp_path / "baseline.json")
+    args = ["--rows", "20", "--repeat", "2"]
+    assert benchmarks.main(args + ["--save", baseline]) == 0
+    with open(baseline) as fp:
+        results = json.load(fp)
+    assert sorted(results) == sorted(benchmarks.BENCHMARKS)
+    for result in results.values():
+        assert result["calls_per_sec"] > 0
+        assert 0 < result["p50_ms"] <= result["p99_ms"]
+    # 小数据量下的耗时波动较大，只在每秒调用数下降到百分之一以下时才算退化
+    assert benchmarks.main(args + [
+        "--compare", baseline, "--compress", "--concurrency", "2",
+        "--tolerance", "0.99",
+    ]) == 0
+    output = capsys.readouterr().out
+    for name in benchmarks.BENCHMARKS:
+        assert name in output
+    assert "regression" not in output
+
+    # 每秒调用数远低于基准时报告退化
+    for result in results.values():
+        result["calls_per_sec"] *= 1000
+    with open(baseline, "w") as fp:
+        json.dump(results, fp)
+    assert benchmarks.main(
+        args + ["get_bars", "--compare", baseline, "--tolerance", "0.5"]
+    ) == 1
+    assert "regression: get_bars" in capsys.readouterr().out
+    assert not jqdatahttp.api.url.startswith("http://127.0.0.1")
+
+
+def test_coalesce_requests(mock_server):
+    def slow_security_info(params):
+        time.sleep(0.2)
+        if params["code"].startswith("ERR"):
+            return 400, "error: 找不到标的{}".format(params["code"])
+        return "code,display_name\n{},平安银行\n".format(params["code"])
+
+    mock_server.handlers["get_security_info"] = slow_security_info
+    api = JQDataApi(url=mock_server.url, token="token")
+    api.disable_memory_cache()
+
+    def count_requests(code):
+        return [item.get("code") for item in mock_server.requests].count(code)
+
+    def run_concurrently(code, count=8):
+        results = []
+
+        def target():
+            try:
+                results.append(api.get_security_info(code=code))
+            except JQDataError as ex:
+                results.append(ex)
+
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    results = run_concurrently("000001.XSHE")
+    assert len(set(results)) == 1 and "平安银行" in results[0]
+    assert count_requests("000001.XSHE") == 1
+    results = run_concurrently("ERR001.XSHE")
+    assert all(isinstance(item, JQDataError) for item in results)
+    assert count_requests("ERR001.XSHE") == 1
+    # 请求结束后不再合并
+    api.get_security_info(code="000001.XSHE")
+    assert count_requests("000001.XSHE") == 2
+
+    api.coalesce_requests = False
+    run_concurrently("000002.XSHE", count=4)
+    assert count_requests("000002.XSHE") == 4
+
+    async_api = jqdatahttp.AsyncJQDataApi(url=mock_server.url, token="token")
+    async_api.disable_memory_cache()
+
+    async def main():
+        return await asyncio.gather(*[
+            async_api.get_security_info(code="000003.XSHE") for _ in range(5)
+        ])
+
+    assert len(set(asyncio.run(main()))) == 1
+    assert count_requests("000003.XSHE") == 1
+
+
+def test_token_refresh_concurrently(mock_server):
+    mock_server.handlers["get_extras"] = lambda params: (
+        200, "error: token无效，请重新获取"
+    ) if params["token"] == "stale" else "date,is_st\n2021-01-04,0\n"
+    api = JQDataApi(url=mock_server.url, username="user", password="pwd")
+    api.coalesce_requests = False
+    api._auto_token = "stale"
+    results = []
+
+    def target(idx):
+        results.append(api.get_extras(code="{:06d}.XSHE".format(idx)))
+
+    threads = [threading.Thread(target=target, args=(idx,)) for idx in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["date,is_st\n2021-01-04,0\n"] * 8
+    methods = [item["method"] for item in mock_server.requests]
+    assert methods.count("get_current_token") == 1
+
+    # 后台在 token 过期前获取新的 token
+    api.token_ttl = 1.5
+    api._set_auto_token(api.token)
+    old_token = api.token
+    api.enable_token_auto_refresh(margin=1)
+    try:
+        deadline = time.time() + 5
+        while api.token == old_token and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        api.disable_token_auto_refresh()
+    assert api.token != old_token
+    assert [item["method"] for item in mock_server.requests].count(
+        "get_token"
+    ) >= 1
+
+
+def test_api_method_dispatch():
+    assert "get_bars" in vars(JQDataApi)
+    assert "get_bars" in vars(jqdatahttp.AsyncJQDataApi)
+    api = JQDataApi()
+    assert api.get_bars.__name__ == "get_bars"
+    assert callable(api.get_some_new_method)
+    assert "get_some_new_method" in vars(JQDataApi)
+    with pytest.raises(AttributeError):
+        api.some_attribute
+
+
+
+def test_async_coalesce_leader_cancelled():
+    flight = jqdatahttp._AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(len(calls))
+        await asyncio.sleep(0.2 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    async def main():
+        # 执行调用的协程超时被取消，等待者由其中一个重新执行，不会被取消
+        leader = asyncio.ensure_future(
+            asyncio.wait_for(flight.do("key", fetch), 0.05)
+        )
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flight.do("key", fetch)) for _ in range(3)]
+        with pytest.raises(asyncio.TimeoutError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    assert asyncio.run(main()) == [2, 2, 2]
+    assert len(calls) == 2 and not flight._calls
+
+def test_memory_cache(mock_server):
+    versions = {"get_concepts": 0}
+
+    def get_concepts(params):
+        versions["get_concepts"] += 1
+        time.sleep(0.1)
+        return "code,name\nGN001,概念{}\n".format(versions["get_concepts"])
+
+    mock_server.handlers["get_concepts"] = get_concepts
+    api = JQDataApi(url=mock_server.url, token="token")
+    api.enable_memory_cache({"get_concepts": (0.3, 1), "get_bars": (60, 2)})
+
+    def count_requests(method):
+        return [item["method"] for item in mock_server.requests].count(method)
+
+    assert "概念1" in api.get_concepts()
+    assert "概念1" in api.get_concepts()
+    assert count_requests("get_concepts") == 1
+    # 过期后先返回旧的结果，同时在后台刷新
+    time.sleep(0.35)
+    assert "概念1" in api.get_concepts()
+    assert "概念1" in api.get_concepts()
+    time.sleep(0.3)
+    assert "概念2" in api.get_concepts()
+    assert count_requests("get_concepts") == 2
+    # 超过 max_stale 的结果不再使用
+    time.sleep(0.7)
+    assert "概念3" in api.get_concepts()
+
+    # 超出条数时淘汰最久未使用的结果
+    mock_server.handlers["get_bars"] = _mock_bars
+    for code in ["000001.XSHE", "000002.XSHE", "000001.XSHE", "000003.XSHE",
+                 "000001.XSHE", "000002.XSHE"]:
+        api.get_bars(code=code, count=1)
+    assert count_requests("get_bars") == 4
+    stats = api.memory_cache.stats()
+    assert stats["get_bars"] == {
+        "hits": 2, "stale_hits": 0, "misses": 4, "size": 2
+    }
+    assert stats["get_concepts"]["stale_hits"] == 2
+
+    api.disable_memory_cache()
+    api.get_bars(code="000001.XSHE", count=1)
+    assert count_requests("get_bars") == 5
+
+
+def test_trading_calendar(mock_server, monkeypatch, tmp_path):
+    np = jqdatahttp.np
+    Date = datetime.date
+    days = ["2021-01-04", "2021-01-05", "2021-01-06", "2021-01-07",
+            "2021-01-08", "2021-01-11", "2021-01-12"]
+    mock_server.handlers["get_all_trade_days"] = lambda params: (
+        "\n".join(days) + "\n"
+    )
+    monkeypatch.setattr(jqdatahttp, "api", JQDataApi(
+        url=mock_server.url, token="token"
+    ))
+    calendar = jqdatahttp.get_trading_calendar()
+    assert calendar.days.dtype == np.dtype("datetime64[D]") and len(calendar) == 7
+    assert calendar.is_trading_day("2021-01-08")
+    assert not calendar.is_trading_day(Date(2021, 1, 9))
+    assert not calendar.is_trading_day("2020-12-31")
+    assert calendar.is_trading_day(
+        np.array(["2021-01-08", "2021-01-09", "2030-01-01"], dtype="M8[D]")
+    ).tolist() == [True, False, False]
+    assert calendar.previous("2021-01-11") == Date(2021, 1, 8)
+    assert calendar.previous("2021-01-11", include=True) == Date(2021, 1, 11)
+    assert calendar.next("2021-01-09") == Date(2021, 1, 11)
+    assert calendar.next("2021-01-12") is None
+    assert calendar.shift("2021-01-07", 2) == Date(2021, 1, 11)
+    assert calendar.shift("2021-01-09", 1) == Date(2021, 1, 11)
+    assert calendar.shift("2021-01-09", -1) == Date(2021, 1, 7)
+    assert calendar.shift("2021-01-04", -1) is None
+    assert calendar.count_between("2021-01-05", "2021-01-10") == 4
+
+    assert jqdatahttp.get_all_trade_days()[0] == Date(2021, 1, 4)
+    assert list(jqdatahttp.get_trade_days("2021-01-06", count=2)) == [
+        Date(2021, 1, 6), Date(2021, 1, 7)
+    ]
+    assert list(jqdatahttp.get_trade_days(end_date="2021-01-10", count=2)) == [
+        Date(2021, 1, 7), Date(2021, 1, 8)
+    ]
+    assert jqdatahttp.is_trading_day("2021-01-12")
+    # 交易日历在进程内保存，关闭内存缓存时也只请求一次
+    jqdatahttp.api.disable_memory_cache()
+    assert len([
+        r for r in mock_server.requests if r["method"] == "get_all_trade_days"
+    ]) == 1
+    jqdatahttp.clear_trading_calendar()
+
+    # 本地存储的交易日历在冷启动与请求失败时使用
+    path = str(tmp_path / "trade_days.npy")
+    monkeypatch.setattr(jqdatahttp, "_calendar_store", None)
+    store = jqdatahttp.enable_calendar_store(path, ttl=3600)
+    jqdatahttp.get_trading_calendar()
+    requested = len(mock_server.requests)
+    days.append("2021-01-13")
+    monkeypatch.setattr(jqdatahttp, "_calendar_store", None)
+    jqdatahttp.enable_calendar_store(path, ttl=3600)
+    calendar = jqdatahttp.get_trading_calendar()
+    assert len(calendar) == 7 and len(mock_server.requests) == requested
+
+    jqdatahttp._calendar_store.ttl = 0
+    jqdatahttp.clear_trading_calendar()
+    mock_server.handlers["get_all_trade_days"] = lambda params: (
+        400, "error: 服务不可用"
+    )
+    assert len(jqdatahttp.get_trading_calendar()) == 7
+    jqdatahttp.disable_calendar_store()
+    jqdatahttp.clear_trading_calendar()
+    with pytest.raises(JQDataError):
+        jqdatahttp.get_trading_calendar()
+    assert store.path == path
+
+
+def test_security_master(mock_server, monkeypatch):
+    listings = {
+        "stock": [
+            "000001.XSHE,平安银行,PAYH,1991-04-03,2200-01-01,stock",
+            "000003.XSHE,PT金田A,PTJTA,1991-07-03,2002-06-14,stock",
+            "688981.XSHG,中芯国际,ZXGJ,2020-07-16,2200-01-01,stock",
+        ],
+        "index": ["000300.XSHG,沪深300,HS300,2005-04-08,2200-01-01,index"],
+        "fja": ["150008.XSHE,瑞和小康,RHXK,2009-10-30,2200-01-01,fja"],
+    }
+
+    def get_all_securities(params):
+        if params["code"] not in listings:
+            return 400, "error: 没有权限"
+        return "\n".join(
+            ["code,display_name,name,start_date,end_date,type"]
+            + listings[params["code"]]
+        )
+
+    mock_server.handlers["get_all_securities"] = get_all_securities
+    mock_server.handlers["get_security_info"] = lambda params: (
+        "code,display_name,name,start_date,end_date,type,parent\n"
+        "{},瑞和小康,RHXK,2009-10-30,2200-01-01,fja,150007.XSHE".format(
+            params["code"]
+        )
+    )
+    monkeypatch.setattr(jqdatahttp, "api", JQDataApi(
+        url=mock_server.url, token="token"
+    ))
+    monkeypatch.setattr(jqdatahttp, "_security_master", None)
+    master = jqdatahttp.enable_security_master(
+        types=["stock", "index", "futures", "fja"]
+    )
+    security = jqdatahttp.get_security_info("000001.XSHE")
+    assert security.display_name == "平安银行"
+    assert security.start_date == datetime.date(1991, 4, 3)
+    assert jqdatahttp.get_security_info("000001.XSHE") is security
+    requested = len(mock_server.requests)
+    assert requested == 4
+
+    infos = jqdatahttp.get_securities_info(
+        ["000300.XSHG", "000001.XSHE", "150008.XSHE"]
+    )
+    assert list(infos) == ["000300.XSHG", "000001.XSHE", "150008.XSHE"]
+    assert infos["000300.XSHG"].type == "index"
+    assert infos["000001.XSHE"] is security
+    # 列表接口没有母基信息，分级基金仍然请求 get_security_info 接口
+    assert infos["150008.XSHE"].parent == "150007.XSHE"
+    assert [r["method"] for r in mock_server.requests[requested:]] == [
+        "get_security_info"
+    ]
+
+    df = jqdatahttp.get_all_securities("stock")
+    assert df.index.tolist() == ["000001.XSHE", "000003.XSHE", "688981.XSHG"]
+    assert df.columns.tolist() == [
+        "display_name", "name", "start_date", "end_date", "type"
+    ]
+    df = jqdatahttp.get_all_securities(["stock", "index"], date="2010-01-04")
+    assert df.index.tolist() == ["000001.XSHE", "000300.XSHG"]
+    assert jqdatahttp.get_all_securities("stock", "2002-06-14").index.tolist() == [
+        "000001.XSHE", "000003.XSHE"
+    ]
+    assert len(mock_server.requests) == requested + 1
+    with pytest.raises(JQDataError):
+        jqdatahttp.get_all_securities("futures")
+
+    # 日期变化后重新加载
+    master._day = datetime.date(2000, 1, 1)
+    assert jqdatahttp.get_security_info("000001.XSHE") is not security
+
+    jqdatahttp.disable_security_master()
+    jqdatahttp.api.disable_memory_cache()
+    assert jqdatahttp.get_all_securities("index").index.tolist() == ["000300.XSHG"]
+    assert mock_server.requests[-1]["code"] == "index"
+
+    # 加载证券列表时出现网络错误，记录日志后请求 get_security_info 接口
+    class BrokenApi(object):
+        def get_all_securities(self, **kwargs):
+            raise jqdatahttp.URLError("connection refused")
+
+    monkeypatch.setattr(jqdatahttp, "_security_master", jqdatahttp.SecurityMaster(
+        types=["stock"], api=BrokenApi()
+    ))
+    security = jqdatahttp.get_security_info("000001.XSHE")
+    assert security.code == "000001.XSHE"
+    assert mock_server.requests[-1]["method"] == "get_security_info"
+
+
+def test_get_billboard_list_all_stocks(mock_server, monkeypatch):
+    mock_server.handlers["get_all_trade_days"] = lambda params: (
+        "2021-06-07\n2021-06-08\n2021-06-09\n2021-06-10\n"
+    )
+    mock_server.handlers["get_all_securities"] = lambda params: (
+        "code,display_name,name,start_date,end_date,type\n"
+        "000001.XSHE,平安银行,PAYH,1991-04-03,2200-01-01,stock\n"
+        "000003.XSHE,PT金田A,PTJTA,1991-07-03,2002-06-14,stock\n"
+        "000009.XSHE,中国宝安,ZGBA,1991-06-25,2200-01-01,stock\n"
+        "301039.XSHE,中集车辆,ZJCL,2021-07-08,2200-01-01,stock\n"
+    )
+
+    running = {"now": 0, "max": 0}
+
+    def get_billboard_list(params):
+        with mock_server.lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.05)
+        with mock_server.lock:
+            running["now"] -= 1
+        if params["code"] != "000009.XSHE":
+            return ""
+        return (
+            "code,day,direction,rank,abnormal_code,abnormal_name,sales_depart_name\n"
+            "000009.XSHE,2021-06-08,ALL,0,106,连续三个交易日内涨幅偏离值累计达20%的证券,\n"
+            "000009.XSHE,2021-06-08,BUY,1,106,连续三个交易日内涨幅偏离值累计达20%的证券,机构专用\n"
+        )
+
+    mock_server.handlers["get_billboard_list"] = get_billboard_list
+    monkeypatch.setattr(jqdatahttp, "api", JQDataApi(
+        url=mock_server.url, token="token"
+    ))
+    monkeypatch.setattr(
+        jqdatahttp, "_security_master", jqdatahttp.SecurityMaster(["stock"])
+    )
+    df = jqdatahttp.get_billboard_list(
+        start_date="2021-06-05", end_date="2021-06-10"
+    )
+    assert len(df) == 2 and df.index.tolist() == [0, 1]
+    # 默认并发请求
+    assert running["max"] == 2
+    requests = [
+        r for r in mock_server.requests if r["method"] == "get_billboard_list"
+    ]
+    # 每个区间内上市的股票只请求一次
+    assert sorted(r["code"] for r in requests) == ["000001.XSHE", "000009.XSHE"]
+    assert requests[0]["date"] == "2021-06-07"
+    assert requests[0]["end_date"] == "2021-06-10"
+
+    with pytest.raises(jqdatahttp.ParamsError):
+        jqdatahttp.get_billboard_list(end_date="2021-06-10", count=2,
+                                      max_requests=1)
+    assert jqdatahttp.get_billboard_list(
+        stock_list=["000001.XSHE"], end_date="2021-06-10", count=1
+    ).empty
+
+
+def test_get_price_multiple_securities(mock_server, monkeypatch):
+    header = "date,open,close,high,low,volume,money,paused\n"
+    bars = {
+        "000001.XSHE": [
+            "2021-03-01,10.0,10.5,10.8,9.9,100,1000,0",
+            "2021-03-02,10.5,10.5,10.5,10.5,0,0,1",
+            "2021-03-03,10.6,11.0,11.2,10.4,200,2000,0",
+        ],
+        "600519.XSHG": [
+            "2021-03-02,2000,2010,2020,1990,10,20000,0",
+            "2021-03-03,2010,2030,2040,2000,20,40000,0",
+        ],
+    }
+
+    def get_price(params):
+        return header + "\n".join(bars[params["code"]][-int(params["count"]):])
+
+    def get_price_period(params):
+        return header + "\n".join(bars[params["code"]])
+
+    mock_server.handlers["get_price"] = get_price
+    mock_server.handlers["get_price_period"] = get_price_period
+    monkeypatch.setattr(jqdatahttp, "api", JQDataApi(
+        url=mock_server.url, token="token"
+    ))
+    np = jqdatahttp.np
+
+    df = jqdatahttp.get_price("000001.XSHE", end_date="2021-03-03", count=2,
+                              fields=["close"], fq=None)
+    assert df.index.name == "date" and df.columns.tolist() == ["close"]
+    assert df["close"].tolist() == [10.5, 11.0]
+    params = mock_server.requests[-1]
+    assert params["method"] == "get_price" and params["count"] == 2
+    assert "fq_ref_date" not in params
+
+    codes = ["000001.XSHE", "600519.XSHG"]
+    df = jqdatahttp.get_price(codes, start_date="2021-03-01",
+                              end_date="2021-03-03", fq="post", max_workers=2)
+    assert df.columns.tolist()[:3] == ["time", "code", "open"]
+    assert df["code"].tolist() == ["000001.XSHE"] * 3 + ["600519.XSHG"] * 2
+    assert df["time"].dtype.kind == "M"
+    params = mock_server.requests[-1]
+    assert params["method"] == "get_price_period"
+    assert params["date"] == "2021-03-01" and params["fq_ref_date"] == "1990-12-19"
+
+    df = jqdatahttp.get_price(codes, start_date="2021-03-01",
+                              end_date="2021-03-03", skip_paused=True)
+    assert len(df) == 4
+
+    panel = jqdatahttp.get_price(codes, start_date="2021-03-01",
+                                 end_date="2021-03-03", fields=["close", "volume"],
+                                 panel=True, fill_paused=False)
+    assert list(panel) == ["close", "volume"]
+    close = panel["close"]
+    assert close.columns.tolist() == codes and len(close) == 3
+    assert np.isnan(close["000001.XSHE"].iloc[1])
+    assert np.isnan(close["600519.XSHG"].iloc[0])
+    assert close["600519.XSHG"].iloc[2] == 2030
+
+
+def test_assemble_frame():
+    np = jqdatahttp.np
+    pd = jqdatahttp.pd
+    stock = np.array(
+        [("2021-03-01", 10.0, 100), ("2021-03-02", 10.5, 200)],
+        dtype=[("date", "M8[ns]"), ("close", "f8"), ("volume", "i8")],
+    )
+    future = np.array(
+        [("2021-03-01", 2000.0, 5, 7000.0)],
+        dtype=[("date", "M8[ns]"), ("close", "f8"), ("volume", "i8"),
+               ("open_interest", "f8")],
+    )
+    empty = np.empty(0, dtype=stock.dtype)
+    df = jqdatahttp._assemble_frame({
+        "000001.XSHE": stock, "000002.XSHE": empty, "FG8888.XZCE": future,
+    })
+    assert df.columns.tolist() == ["date", "close", "volume", "open_interest"]
+    assert df.index.tolist() == [
+        ("000001.XSHE", 0), ("000001.XSHE", 1), ("FG8888.XZCE", 0)
+    ]
+    assert df["date"].dtype.kind == "M" and df["volume"].dtype == np.int64
+    assert df.loc["FG8888.XZCE", "open_interest"].tolist() == [7000.0]
+    assert df.loc["000001.XSHE", "open_interest"].isna().all()
+
+    expected = pd.concat([
+        pd.DataFrame(stock, index=[["000001.XSHE"] * 2, [0, 1]]),
+        pd.DataFrame(future[["date", "close", "volume"]],
+                     index=[["FG8888.XZCE"], [0]]),
+    ])
+    df = jqdatahttp._assemble_frame({
+        "000001.XSHE": stock,
+        "FG8888.XZCE": future[["date", "close", "volume"]],
+    })
+    pd.testing.assert_frame_equal(df, expected, check_index_type=False)
+    assert jqdatahttp._assemble_frame({}).empty
+
+
+@pytest.mark.parametrize("output_format", ["arrow", "polars"])
+def test_output_format(mock_server, monkeypatch, output_format):
+    pytest.importorskip("pyarrow" if output_format == "arrow" else "polars")
+    mock_server.handlers["get_bars"] = lambda params: (
+        "date,open,close\n2021-03-01,10.0,10.5\n2021-03-02,10.5,11.0\n"
+    )
+    mock_server.handlers["get_fq_factor"] = lambda params: (
+        "date,factor\n2021-03-01,1.5\n"
+    )
+    api = JQDataApi(url=mock_server.url, token="token")
+    monkeypatch.setattr(jqdatahttp, "api", api)
+
+    table = jqdatahttp.get_bars(["000001.XSHE", "600519.XSHG"], 2,
+                                output_format=output_format)
+    if output_format == "arrow":
+        columns, codes = table.column_names, table["code"].to_pylist()
+    else:
+        columns, codes = table.columns, table["code"].to_list()
+    assert columns == ["code", "date", "open", "close"]
+    assert codes == ["000001.XSHE"] * 2 + ["600519.XSHG"] * 2
+    assert table.shape == (4, 4)
+
+    monkeypatch.setattr(jqdatahttp, "_output_format", output_format)
+    table = jqdatahttp.get_fq_factor("000001.XSHE", "2021-03-01", "2021-03-01")
+    assert table.shape == (1, 2)
+    table = api.get_fq_factor(code="000001.XSHE", auto_format_result=True,
+                              output_format=output_format)
+    assert table.shape == (1, 2)
+    monkeypatch.setattr(jqdatahttp, "_output_format", "pandas")
+    assert isinstance(jqdatahttp.get_bars("000001.XSHE", 2), jqdatahttp.pd.DataFrame)
+
+
+def test_period_chunks(mock_server, monkeypatch):
+    days = ["2021-03-0{}".format(day) for day in range(1, 6)] + [
+        "2021-03-08", "2021-03-09"
+    ]
+    mock_server.handlers["get_all_trade_days"] = lambda params: "\n".join(days)
+    times = []
+    for day in days:
+        times.extend([day + " 00:00:00", day + " 09:31:00", day + " 15:00:00"])
+    failures = {"count": 0}
+
+    def get_bars_period(params):
+        start, end = params["date"], params["end_date"]
+        # 000001.XSHE 的第一个时间段失败一次，03-05 ~ 03-09 的请求总是超时
+        first = params["code"] == "000001.XSHE" and start.endswith("09:30:00")
+        if (first and not failures.get("first")) or (start, end) == (
+            "2021-03-05 00:00:00", "2021-03-09 00:00:00"
+        ):
+            failures["first"] = failures.get("first") or first
+            failures["count"] += 1
+            return 504, ""
+        rows = [t for t in times if start <= t <= end]
+        return "date,close\n" + "".join(
+            "{},{}\n".format(t, idx) for idx, t in enumerate(rows)
+        )
+
+    mock_server.handlers["get_bars_period"] = get_bars_period
+    monkeypatch.setattr(jqdatahttp, "api", JQDataApi(
+        url=mock_server.url, token="token"
+    ))
+    chunks = jqdatahttp._split_period(
+        datetime.datetime(2021, 3, 1, 9, 30), datetime.datetime(2021, 3, 9, 15),
+        240, 480
+    )
+    assert [(str(start), str(end)) for start, end in chunks] == [
+        ("2021-03-01 09:30:00", "2021-03-03 00:00:00"),
+        ("2021-03-03 00:00:00", "2021-03-05 00:00:00"),
+        ("2021-03-05 00:00:00", "2021-03-09 00:00:00"),
+        ("2021-03-09 00:00:00", "2021-03-09 15:00:00"),
+    ]
+
+    df = jqdatahttp.get_bars_period(
+        ["000001.XSHE", "000002.XSHE"], "2021-03-01 09:30:00",
+        "2021-03-09 15:00:00", unit="1m", chunk_rows=480, max_workers=4,
+    )
+    expected = [t for t in times if "2021-03-01 09:30:00" <= t]
+    for code in ["000001.XSHE", "000002.XSHE"]:
+        dates = df.loc[code, "date"].astype(str).tolist()
+        assert dates == expected
+    # 第一次失败后单独重试，总是超时的时间段重试后拆分为两半
+    assert failures["count"] == 1 + 2 * 2
+
+    # 服务端返回的错误信息（如查询条数用尽）不重试也不拆分，直接抛出
+    mock_server.handlers["get_bars_period"] = lambda params: (
+        "error: 今日查询条数已用完"
+    )
+    requested = len(mock_server.requests)
+    with pytest.raises(JQDataError, match="查询条数"):
+        jqdatahttp.get_bars_period(
+            "000001.XSHE", "2021-03-01 09:30:00", "2021-03-09 15:00:00",
+            unit="1m", chunk_rows=480,
+        )
+    assert len(mock_server.requests) == requested + 1
+
+
+def test_factor_values_reshape(mock_server, monkeypatch):
+    np = jqdatahttp.np
+    data = {
+        "000001.XSHE": "date,size,EMA5\n2021-03-01,1.5,10\n2021-03-02,,11\n",
+        "600519.XSHG": "date,size,EMA5\n2021-03-02,3.5,2000\n2021-03-03,3.6,2010\n",
+        "000002.XSHE": "",
+    }
+    mock_server.handlers["get_factor_values"] = lambda params: data[params["code"]]
+    monkeypatch.setattr(jqdatahttp, "api", JQDataApi(
+        url=mock_server.url, token="token"
+    ))
+    codes = ["000001.XSHE", "600519.XSHG", "000002.XSHE"]
+    result = jqdatahttp.get_factor_values(
+        codes, ["size", "EMA5"], "2021-03-01", "2021-03-03", max_workers=3
+    )
+    assert list(result) == ["size", "EMA5"]
+    size = result["size"]
+    assert size.columns.tolist() == codes and size.index.name == "date"
+    assert [str(day.date()) for day in size.index] == [
+        "2021-03-01", "2021-03-02", "2021-03-03"
+    ]
+    assert size["000001.XSHE"].tolist()[0] == 1.5
+    assert np.isnan(size["000001.XSHE"].iloc[1])
+    assert size["000002.XSHE"].isna().all()
+    assert result["EMA5"]["600519.XSHG"].tolist()[1:] == [2000, 2010]
+
+    panel = jqdatahttp.get_factor_values(
+        codes, "size,EMA5", "2021-03-01", "2021-03-03", ndarray=True
+    )
+    assert panel.values.shape == (2, 3, 3)
+    assert panel.factors == ["size", "EMA5"] and panel.codes == codes
+    assert panel.dates.dtype == np.dtype("M8[D]")
+    assert panel.values[1, 2, 1] == 2010
+    assert np.array_equal(panel.values[0], size.values, equal_nan=True)
+
+
+def test_api_batch(mock_server, monkeypatch):
+    release = threading.Event()
+    running = []
+
+    def get_mtss(params):
+        with mock_server.lock:
+            running.append(params["code"])
+        release.wait(5)
+        if params["code"] == "bad":
+            return "error: 代码错误"
+        return "date,sec_code,fin_value\n2021-03-01,{},1.5\n".format(params["code"])
+
+    mock_server.handlers["get_mtss"] = get_mtss
+    api = JQDataApi(url=mock_server.url, token="token")
+    monkeypatch.setattr(jqdatahttp, "api", api)
+    progress = []
+    codes = ["000001.XSHE", "bad", "600519.XSHG", "000002.XSHE"]
+    with jqdatahttp.batch(max_workers=2, progress=lambda *args: progress.append(
+        args[:2]
+    )) as batch:
+        futures = [
+            batch.get_mtss(code=code, date="2021-03-01", auto_format_result=True)
+            for code in codes
+        ]
+        future = batch.submit(jqdatahttp.get_query_count)
+        # 同时进行的调用数不超过 max_workers
+        time.sleep(0.2)
+        assert len(running) == 2
+        assert future.cancel()
+        release.set()
+    assert [args[1] for args in progress][-1] == 5
+    assert sorted(args[0] for args in progress) == [1, 2, 3, 4, 5]
+    results = batch.results()
+    assert results[0]["fin_value"].tolist() == [1.5]
+    assert isinstance(results[1], JQDataError) and "代码错误" in str(results[1])
+    assert isinstance(results[4], concurrent.futures.CancelledError)
+    assert list(batch.errors()) == [1]
+    with pytest.raises(JQDataError):
+        batch.results(return_exceptions=False)
+    with pytest.raises(JQDataError):
+        batch.get_mtss(code="000001.XSHE")
+    with pytest.raises(AttributeError):
+        batch.show_raw_result
+
+
+def test_quote_poller(mock_server, monkeypatch):
+    np = jqdatahttp.np
+    pd = jqdatahttp.pd
+    quotes = {
+        "000001.XSHE": "2021-03-01 10:00:00,20.5,21.0,20.1,1000,20500",
+        "600519.XSHG": "2021-03-01 10:00:00,2100.0,2110.0,2090.0,500,1050000",
+        "000002.XSHE": "2021-03-01 10:00:00,30.2,30.5,30.0,800,24160",
+    }
+
+    def get_current_ticks(params):
+        codes = params["code"].split(",")
+        if "bad" in codes:
+            return "error: 代码错误"
+        lines = ["code,time,current,high,low,volume,money"]
+        lines.extend(
+            "{},{}".format(code, quotes[code]) for code in codes if code in quotes
+        )
+        return "\n".join(lines) + "\n"
+
+    mock_server.handlers["get_current_ticks"] = get_current_ticks
+    api = JQDataApi(url=mock_server.url, token="token")
+    api.disable_memory_cache()
+    codes = ["000001.XSHE", "600519.XSHG", "000002.XSHE", "000004.XSHE"]
+    poller = jqdatahttp.QuotePoller(
+        codes, interval=1, chunk_size=2, max_workers=2,
+        fields=["current", "volume", "a1_p"], api=api,
+    )
+    try:
+        changes, stats = poller.poll()
+        assert changes["code"].tolist() == codes[:3]
+        assert stats.requests == 2 and stats.rows == 3 and stats.changed == 3
+        assert stats.errors == 0 and stats.latency >= 0
+
+        # 只输出行情有变化的标的
+        quotes["600519.XSHG"] = "2021-03-01 10:00:03,2101.0,2110.0,2090.0,600,1260100"
+        changes, stats = poller.poll()
+        assert changes["code"].tolist() == ["600519.XSHG"]
+        assert changes["current"].tolist() == [2101.0]
+        assert changes["time"].tolist() == [pd.Timestamp("2021-03-01 10:00:03")]
+        snapshot = poller.snapshot()
+        assert snapshot["volume"].tolist()[:3] == [1000, 600, 800]
+        assert np.isnan(snapshot["current"].iloc[3])
+        assert snapshot["time"].isna().tolist() == [False, False, False, True]
+    finally:
+        poller.stop()
+
+    # 部分分片出错时其他分片照常更新
+    poller = jqdatahttp.QuotePoller(
+        ["bad", "000001.XSHE"], interval=1, chunk_size=1, api=api,
+    )
+    try:
+        changes, stats = poller.poll()
+        assert stats.errors == 1 and changes["code"].tolist() == ["000001.XSHE"]
+    finally:
+        poller.stop()
+
+    # 轮询时间按交易时段对齐，非交易日与交易时段之外不轮询
+    monkeypatch.setattr(jqdatahttp, "get_trading_calendar", lambda: (
+        jqdatahttp.TradingCalendar(["2021-03-01", "2021-03-02", "2021-03-05"])
+    ))
+    poller = jqdatahttp.QuotePoller(codes, interval=3, api=api)
+    dt = datetime.datetime
+    assert poller.next_poll_time(dt(2021, 3, 1, 8, 0)) == dt(2021, 3, 1, 9, 15)
+    assert poller.next_poll_time(dt(2021, 3, 1, 9, 15)) == dt(2021, 3, 1, 9, 15, 3)
+    assert poller.next_poll_time(dt(2021, 3, 1, 9, 15, 4, 500)) == (
+        dt(2021, 3, 1, 9, 15, 6)
+    )
+    assert poller.next_poll_time(dt(2021, 3, 1, 11, 30)) == dt(2021, 3, 1, 13, 0)
+    assert poller.next_poll_time(dt(2021, 3, 2, 15, 0)) == dt(2021, 3, 5, 9, 15)
+
+    # 后台线程按固定节奏轮询，每轮的统计信息保存在 history 中
+    updates = []
+    poller = jqdatahttp.QuotePoller(
+        codes, interval=0.1, sessions=None, api=api,
+        on_update=lambda changes, stats: updates.append(len(changes)),
+    )
+    poller.start()
+    time.sleep(0.55)
+    poller.stop()
+    assert not poller.running
+    assert updates[0] == 3 and len(poller.history) >= 3
+    assert all(stats.lag < 0.1 for stats in poller.history)
+
+
+def test_api_metrics(mock_server, monkeypatch):
+    attempts = {"get_bars": 0, "get_mtss": 0}
+
+    def get_bars(params):
+        attempts["get_bars"] += 1
+        if attempts["get_bars"] == 1:
+            return 503, "service unavailable"
+        return "date,open,close\n2021-03-01,1.0,2.0\n2021-03-02,2.0,3.0\n"
+
+    def get_mtss(params):
+        attempts["get_mtss"] += 1
+        if attempts["get_mtss"] == 1:
+            return "error: token expired"
+        return "date,sec_code,fin_value\n2021-03-01,000001.XSHE,1.5\n"
+
+    mock_server.handlers["get_bars"] = get_bars
+    mock_server.handlers["get_mtss"] = get_mtss
+    api = JQDataApi(username="user", password="pwd", url=mock_server.url)
+    api.disable_memory_cache()
+    monkeypatch.setattr(jqdatahttp, "api", api)
+
+    bars = jqdatahttp.get_bars("000001.XSHE", count=2, fields=["close"])
+    assert bars["close"].tolist() == [2.0, 3.0]
+    api.get_mtss(code="000001.XSHE", auto_format_result=True)
+
+    stats = jqdatahttp.stats()
+    bars_stats = stats["get_bars"]
+    # 第一次请求返回 503 后重试，token 缺失时先获取 token
+    assert bars_stats["calls"] == 1 and bars_stats["requests"] == 2
+    assert bars_stats["retries"] == 1 and bars_stats["errors"] == 0
+    assert bars_stats["token_refreshes"] == 1
+    assert bars_stats["request_bytes"] > 0
+    assert bars_stats["response_bytes"] == bars_stats["raw_response_bytes"] > 0
+    assert bars_stats["latency"]["count"] == 1
+    assert bars_stats["wait"]["count"] == 1
+    # 每次请求单独计时，不包括 0.5 秒的重试间隔
+    assert bars_stats["latency"]["sum"] < 0.5
+    assert bars_stats["latency"]["buckets"]["+Inf"] == 1
+    assert bars_stats["parse"]["csv2array"]["count"] >= 1
+    assert stats["get_current_token"]["calls"] == 2
+
+    # token 失效时刷新 token 后重试，失效的请求计为出错
+    mtss_stats = stats["get_mtss"]
+    assert mtss_stats["requests"] == 2 and mtss_stats["errors"] == 1
+    assert mtss_stats["token_refreshes"] == 1
+    assert mtss_stats["parse"]["csv2df"]["count"] == 1
+    # 之后无关的解析不计入任何接口
+    jqdatahttp._csv2array("a,b\n1,2\n", dtype=[("a", "i8"), ("b", "i8")], skip_header=1)
+    jqdatahttp._csv2df("a,b\n1,2\n")
+    assert api.stats()["get_mtss"]["parse"]["csv2df"]["count"] == 1
+    assert api.stats()["get_bars"]["parse"] == bars_stats["parse"]
+
+    text = jqdatahttp.format_prometheus(stats)
+    assert 'jqdatahttp_retries_total{method="get_bars"} 1' in text
+    assert 'jqdatahttp_latency_seconds_count{method="get_bars"} 1' in text
+    assert 'jqdatahttp_parse_seconds_count{method="get_mtss",parser="csv2df"} 1' in text
+
+    exported = []
+    api.add_metrics_exporter(exported.append, interval=None)
+    api.export_metrics()
+    assert exported[0]["get_bars"]["calls"] == 1
+    api.remove_metrics_exporter(exported.append)
+    periodic = []
+    jqdatahttp.add_metrics_exporter(periodic.append, interval=0.05)
+    time.sleep(0.3)
+    api.remove_metrics_exporter(periodic.append)
+    assert len(periodic) >= 2 and "get_mtss" in periodic[-1]
+
+    api.disable_metrics()
+    api.get_mtss(code="000001.XSHE")
+    assert api.stats() == {}
+    assert api.enable_metrics().stats() == {}